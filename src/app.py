@@ -1,14 +1,17 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import sys
 import os
-import ta
+import threading
+from contextlib import nullcontext
 
 # Add src to path so we can import our modules
 sys.path.append(os.path.abspath('src'))
-import data_fetcher
+# Only what the first page needs is imported here; the fetcher, plotly and
+# the universe scanner load on first use
+import downsample
+import features
+import instrumentation
 import predict
 
 # --- PAGE CONFIGURATION ---
@@ -20,113 +23,188 @@ st.markdown("End-to-End Machine Learning Capstone Project")
 # --- SIDEBAR SETTINGS ---
 st.sidebar.header("Settings")
 symbol = st.sidebar.text_input("Symbol", value="BTCUSDT")
-days_to_fetch = st.sidebar.slider("Days of History", min_value=100, max_value=2000, value=365)
+interval = st.sidebar.selectbox("Interval", ["1d", "4h", "1h", "15m", "1m"], index=0)
+bars_to_fetch = st.sidebar.number_input("Bars of History", min_value=100, max_value=1_000_000, value=365, step=100)
+analyze = st.sidebar.button("Analyze Market")
+
+st.sidebar.markdown("---")
+universe_size = st.sidebar.slider("Universe (top USDT pairs)", min_value=10, max_value=300, value=100)
+scan = st.sidebar.button("Scan Universe")
+
+st.sidebar.markdown("---")
+profile = st.sidebar.checkbox("Profile requests (sampling profiler)", value=False)
+
+MODEL_NAME = "best_crypto_model"
+
+# The buttons are only True for one run; remember the view so that moving
+# the range slider (a rerun) keeps showing it
+if analyze:
+    st.session_state["view"] = "analyze"
+elif scan:
+    st.session_state["view"] = "scan"
+view = st.session_state.get("view")
 
 # --- 1. FETCH DATA ---
-@st.cache_data(ttl=600) # Cache data for 10 minutes to prevent spamming Binance
-def get_data(sym, limit):
-    # We use the existing fetcher but return the dataframe directly
-    df = data_fetcher.fetch_binance_data(symbol=sym, limit=limit)
-    
+# The cached frames below are shared between reruns and sessions (no
+# copy per hit, which matters at 1M bars): never modify them in place.
+@st.cache_resource(ttl=600, max_entries=4, show_spinner=False) # Cache data for 10 minutes to prevent spamming Binance
+def get_data(sym, interval, limit):
+    # Straight from the API (paged); nothing is written to data/raw
+    import data_fetcher
+    df = data_fetcher.fetch_klines(sym, interval, limit=limit)
+
     # Basic Cleaning (same as processed_data.py)
-    df['open_time'] = pd.to_datetime(df['open_time'], unit='ms')
     numeric_cols = ["open", "high", "low", "close", "volume"]
-    for col in numeric_cols:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-    
+    df = df[["open_time"] + numeric_cols]
+    df = df.assign(open_time=pd.to_datetime(df['open_time'].astype("int64"), unit='ms'),
+                   **{col: pd.to_numeric(df[col], errors='coerce') for col in numeric_cols})
+
     return df
 
-# --- 2. APPLY FEATURES ON THE FLY ---
+# --- 2. MODEL & SCORED FRAMES ---
+def model_signature(name):
+    # Changes whenever the pickle or its .npz export is replaced (train.py / export.py)
+    signature = ()
+    for path in (predict._model_path(name), predict._model_path(f"{name}.npz")):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature += (stat.st_mtime_ns, stat.st_size)
+    return signature
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def get_model(name, signature):
+    # One load per model version, shared by every session; the exported
+    # .npz when it is current, so no model library has to be imported
+    return predict.warm_model(name)
+
 def add_features(df):
-    df = df.copy()
-    # Replicating logic from feature_generator.py
-    df["rsi"] = ta.momentum.RSIIndicator(df["close"], window=14).rsi()
-    macd = ta.trend.MACD(df["close"])
-    df["macd"] = macd.macd()
-    df["macd_signal"] = macd.macd_signal()
-    df["macd_hist"] = macd.macd_diff()
-    df["sma_20"] = ta.trend.SMAIndicator(df["close"], window=20).sma_indicator()
-    df["sma_50"] = ta.trend.SMAIndicator(df["close"], window=50).sma_indicator()
-    bb = ta.volatility.BollingerBands(df["close"], window=20, window_dev=2)
-    df["bb_high"] = bb.bollinger_hband()
-    df["bb_low"] = bb.bollinger_lband()
-    df["volatility"] = df["close"].pct_change().rolling(window=20).std()
-    df["pct_change_1d"] = df["close"].pct_change()
-    df["pct_change_7d"] = df["close"].pct_change(periods=7)
-    df.dropna(inplace=True)
-    return df
+    # Same feature definitions as the training pipeline (features.py)
+    return features.add_features(df, dropna=True)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_scored(sym, interval, limit, last_candle, signature, _raw_df):
+    # Keyed by symbol and last candle (plus the model version): features
+    # and predictions are only recomputed once a new candle arrives
+    with instrumentation.span("app.add_features"):
+        processed_df = add_features(_raw_df)
+    with instrumentation.span("app.predict"):
+        return predict.predict_from_dataframe(processed_df, model=get_model(MODEL_NAME, signature))
+
+# --- 3. CHART ---
+def price_chart(results_df, start, end):
+    """
+    Candles, SMAs, RSI and signals of the visible range, reduced on the
+    server (downsample.py) so any history length sends at most a few
+    thousand points to the browser.
+    """
+    shown, offset = downsample.visible(results_df, start, end)
+    candles = downsample.ohlc_buckets(shown, offset=offset)
+    signals = downsample.thin_signals(shown, offset=offset)
+
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    # Create interactive Plotly chart
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True,
+                        vertical_spacing=0.03, subplot_titles=('Price & SMA', 'RSI'),
+                        row_width=[0.2, 0.7])
+
+    # Candlestick
+    fig.add_trace(go.Candlestick(x=candles['open_time'],
+                    open=candles['open'], high=candles['high'],
+                    low=candles['low'], close=candles['close'], name='Price'), row=1, col=1)
+
+    # SMAs (WebGL lines)
+    for column, color, name in (('sma_20', 'blue', 'SMA 20'), ('sma_50', 'orange', 'SMA 50')):
+        x, y = downsample.line(shown, column)
+        fig.add_trace(go.Scattergl(x=x, y=y, line=dict(color=color, width=1), name=name), row=1, col=1)
+
+    # Buy/Sell Markers on Chart
+    buy_signals = signals[signals['prediction_text'] == 'BUY']
+    sell_signals = signals[signals['prediction_text'] == 'SELL']
+
+    fig.add_trace(go.Scattergl(x=buy_signals['open_time'], y=buy_signals['low']*0.98,
+                               mode='markers', marker=dict(symbol='triangle-up', size=10, color='green'),
+                               name='AI BUY'), row=1, col=1)
+
+    fig.add_trace(go.Scattergl(x=sell_signals['open_time'], y=sell_signals['high']*1.02,
+                               mode='markers', marker=dict(symbol='triangle-down', size=10, color='red'),
+                               name='AI SELL'), row=1, col=1)
+
+    # RSI
+    x, y = downsample.line(shown, 'rsi')
+    fig.add_trace(go.Scattergl(x=x, y=y, line=dict(color='purple', width=2), name='RSI'), row=2, col=1)
+
+    # Add RSI Lines
+    fig.add_hline(y=70, line_dash="dash", line_color="red", row=2, col=1)
+    fig.add_hline(y=30, line_dash="dash", line_color="green", row=2, col=1)
+
+    fig.update_layout(height=800, xaxis_rangeslider_visible=False)
+    return fig, len(shown), len(candles)
+
+# --- 4. TIMING BREAKDOWN ---
+def request_profiler():
+    # Samples only this script run's thread; a no-op context when disabled
+    if not profile:
+        return nullcontext()
+    return instrumentation.SamplingProfiler(thread_ids=[threading.get_ident()])
+
+def show_timings(request_trace, profiler=None):
+    with st.expander(f"⏱ Timing breakdown ({request_trace.seconds * 1000:.0f} ms)"):
+        st.dataframe(pd.DataFrame(request_trace.table()), use_container_width=True)
+        if profiler is not None:
+            st.caption(f"Sampling profiler: {profiler.sample_count} samples (self / total share of time)")
+            st.dataframe(pd.DataFrame(profiler.top(25)), use_container_width=True)
 
 # Button to trigger analysis
-if st.sidebar.button("Analyze Market"):
-    with st.spinner(f"Fetching data for {symbol}..."):
+if view == "analyze":
+    with st.spinner(f"Fetching data for {symbol}..."), instrumentation.trace() as request_trace, \
+            request_profiler() as profiler:
         try:
             # 1. Get Data
-            raw_df = get_data(symbol, days_to_fetch)
-            
-            # 2. Engineer Features
-            processed_df = add_features(raw_df)
-            
-            # 3. Predict (Using the last 20 days for the chart, but only today for the big metric)
+            with instrumentation.span("app.get_data"):
+                raw_df = get_data(symbol, interval, int(bars_to_fetch))
+
+            # 2. Engineer Features & 3. Predict (cached until the next candle)
             # We use our modular predict.py script
-            results_df = predict.predict_from_dataframe(processed_df)
-            
+            with instrumentation.span("app.score"):
+                last_candle = raw_df['open_time'].iloc[-1].value
+                results_df = get_scored(symbol, interval, int(bars_to_fetch), last_candle,
+                                        model_signature(MODEL_NAME), raw_df)
+
             # Get latest prediction
             latest = results_df.iloc[-1]
-            
+
             # --- DISPLAY METRICS ---
             col1, col2, col3, col4 = st.columns(4)
             col1.metric("Current Price", f"${latest['close']:.2f}")
-            
+
             # Color code the prediction
             pred_color = "off"
             if latest['prediction_text'] == "BUY": pred_color = "normal" # Green
             elif latest['prediction_text'] == "SELL": pred_color = "inverse" # Red
-            
+
             col2.metric("AI Prediction", latest['prediction_text'], delta=None, delta_color=pred_color)
             col3.metric("Confidence", f"{latest['confidence']*100:.1f}%")
             col4.metric("RSI (14)", f"{latest['rsi']:.1f}")
 
             # --- DISPLAY CHART ---
             st.subheader("Technical Analysis & AI Signals")
-            
-            # Create interactive Plotly chart
-            fig = make_subplots(rows=2, cols=1, shared_xaxes=True, 
-                                vertical_spacing=0.03, subplot_titles=('Price & SMA', 'RSI'),
-                                row_width=[0.2, 0.7])
-
-            # Candlestick
-            fig.add_trace(go.Candlestick(x=results_df['open_time'],
-                            open=results_df['open'], high=results_df['high'],
-                            low=results_df['low'], close=results_df['close'], name='Price'), row=1, col=1)
-
-            # SMAs
-            fig.add_trace(go.Scatter(x=results_df['open_time'], y=results_df['sma_20'], 
-                                     line=dict(color='blue', width=1), name='SMA 20'), row=1, col=1)
-            fig.add_trace(go.Scatter(x=results_df['open_time'], y=results_df['sma_50'], 
-                                     line=dict(color='orange', width=1), name='SMA 50'), row=1, col=1)
-
-            # Buy/Sell Markers on Chart
-            buy_signals = results_df[results_df['prediction_text'] == 'BUY']
-            sell_signals = results_df[results_df['prediction_text'] == 'SELL']
-
-            fig.add_trace(go.Scatter(x=buy_signals['open_time'], y=buy_signals['low']*0.98,
-                                     mode='markers', marker=dict(symbol='triangle-up', size=10, color='green'),
-                                     name='AI BUY'), row=1, col=1)
-            
-            fig.add_trace(go.Scatter(x=sell_signals['open_time'], y=sell_signals['high']*1.02,
-                                     mode='markers', marker=dict(symbol='triangle-down', size=10, color='red'),
-                                     name='AI SELL'), row=1, col=1)
-
-            # RSI
-            fig.add_trace(go.Scatter(x=results_df['open_time'], y=results_df['rsi'], 
-                                     line=dict(color='purple', width=2), name='RSI'), row=2, col=1)
-            
-            # Add RSI Lines
-            fig.add_hline(y=70, line_dash="dash", line_color="red", row=2, col=1)
-            fig.add_hline(y=30, line_dash="dash", line_color="green", row=2, col=1)
-
-            fig.update_layout(height=800, xaxis_rangeslider_visible=False)
-            st.plotly_chart(fig, use_container_width=True)
+
+            # Visible range: only these bars are reduced and sent to the browser
+            start = results_df['open_time'].iloc[0].to_pydatetime()
+            end = results_df['open_time'].iloc[-1].to_pydatetime()
+            if start < end:
+                start, end = st.slider("Visible range", min_value=start, max_value=end, value=(start, end),
+                                       step=pd.Timedelta(interval).to_pytimedelta(),
+                                       key=f"range-{symbol}-{interval}-{bars_to_fetch}")
+
+            with instrumentation.span("app.downsample"):
+                fig, shown_bars, candle_count = price_chart(results_df, start, end)
+            if candle_count < shown_bars:
+                st.caption(f"{shown_bars:,} bars shown as {candle_count:,} aggregated candles")
+            with instrumentation.span("app.render_chart"):
+                st.plotly_chart(fig, use_container_width=True)
 
             # --- DATA TABLE ---
             st.subheader("Recent Data & Predictions")
@@ -135,5 +213,22 @@ if st.sidebar.button("Analyze Market"):
 
         except Exception as e:
             st.error(f"Error analyzing market: {e}")
+    show_timings(request_trace, profiler)
+elif view == "scan":
+    with st.spinner(f"Scoring the top {universe_size} USDT pairs..."), instrumentation.trace() as request_trace, \
+            request_profiler() as profiler:
+        try:
+            # One concurrent fetch, one feature pass, one predict_proba call
+            # (only the latest candles matter here, so at most one page each)
+            with instrumentation.span("app.score_universe"):
+                import universe
+                signals = universe.score_universe(interval=interval, limit=min(int(bars_to_fetch), 1000),
+                                                  n_symbols=universe_size)
+            st.subheader("BUY / SELL Signals Across the Universe")
+            st.dataframe(signals[['symbol', 'open_time', 'close', 'prediction', 'confidence',
+                                  'p_buy', 'p_sell']], use_container_width=True)
+        except Exception as e:
+            st.error(f"Error scanning universe: {e}")
+    show_timings(request_trace, profiler)
 else:
-    st.info("Click 'Analyze Market' in the sidebar to start.")
\ No newline at end of file
+    st.info("Click 'Analyze Market' (one symbol) or 'Scan Universe' (many symbols) in the sidebar to start.")
@@ -0,0 +1,276 @@
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+import predict
+
+# Turns predicted labels into a PnL. Everything is vectorized over bars,
+# and a sweep evaluates every parameter combination in batched passes:
+# positions are built once per (threshold, shorting) pair, and all fee /
+# slippage levels are scored from a few running sums, because costs enter
+# the returns linearly.
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+# Label -> direction (SELL, HOLD, BUY)
+DIRECTION = np.array([-1, 0, 1], dtype=np.int8)
+
+
+# --- POSITIONS ---
+
+def _ffill_zero(pos):
+    """
+    Forward-fills zeros along the last axis (a flat signal keeps the
+    previous position).
+    """
+    n = pos.shape[-1]
+    idx = np.where(pos != 0, np.arange(n), 0)
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    # Before the first signal idx points at bar 0, which is flat
+    return np.take_along_axis(pos, idx, axis=-1)
+
+
+def signal_positions(labels, confidence, thresholds=(0.0,), allow_short=True, hold="flat"):
+    """
+    Target position per bar for every confidence threshold: +1 on BUY,
+    -1 on SELL (0 if allow_short is False), 0 on HOLD or when confidence
+    is below the threshold. hold="carry" keeps the previous position
+    instead of going flat. Returns int8 (len(thresholds), bars).
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    confidence = np.asarray(confidence, dtype=np.float64)
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=np.float64))
+
+    direction = DIRECTION[labels]
+    if not allow_short:
+        direction = np.maximum(direction, 0)
+    pos = np.where(confidence[None, :] >= thresholds[:, None], direction[None, :], np.int8(0))
+    if hold == "carry":
+        pos = _ffill_zero(pos)
+    elif hold != "flat":
+        raise ValueError(f"Unknown hold mode: {hold}")
+    return pos
+
+
+def gross_returns(pos, open_, close, fill="close"):
+    """
+    Per-bar strategy returns before costs and the turnover that produced
+    them. A position decided on bar t is traded at the close of bar t
+    (fill="close") or at the open of bar t+1 (fill="next_open").
+    Returns (gross, turnover), both (rows, bars) float64.
+    """
+    pos = np.asarray(pos)
+    close = np.asarray(close, dtype=np.float64)
+    # held[t]: position carried into bar t (what was decided on bar t-1)
+    held = np.empty(np.shape(pos), dtype=np.float64)
+    held[:, 0] = 0
+    held[:, 1:] = pos[:, :-1]
+
+    if fill == "close":
+        ret = np.zeros_like(close)
+        ret[1:] = close[1:] / close[:-1] - 1
+        gross = held * ret
+    elif fill == "next_open":
+        open_ = np.asarray(open_, dtype=np.float64)
+        # The old position carries the gap from the previous close, the new one the bar
+        gross = held * (close / open_ - 1)
+        gross[:, 2:] += held[:, 1:-1] * (open_[2:] / close[1:-1] - 1)
+    else:
+        raise ValueError(f"Unknown fill: {fill}")
+
+    turnover = np.diff(held, axis=-1, prepend=0.0)
+    np.abs(turnover, out=turnover)
+    return gross, turnover
+
+
+# --- METRICS ---
+
+def _signal_chunks(labels, confidence, open_, close, signals, rows, hold, fill, max_bytes):
+    """
+    Yields (rows, pos, gross, turnover) for the requested signal rows
+    ((threshold, allow_short) pairs), a few at a time so the (rows, bars)
+    temporaries stay under max_bytes.
+    """
+    # pos (int8) + held, prev, gross, turnover and one temporary (float64)
+    step = max(1, int(max_bytes // (len(close) * 41)))
+    for start in range(0, len(rows), step):
+        chunk = rows[start:start + step]
+        pos = np.empty((len(chunk), len(close)), dtype=np.int8)
+        for short in (True, False):
+            sel = [i for i, r in enumerate(chunk) if signals[r][1] == short]
+            if sel:
+                pos[sel] = signal_positions(labels, confidence, [signals[chunk[i]][0] for i in sel], short, hold)
+        gross, turnover = gross_returns(pos, open_, close, fill)
+        yield chunk, pos, gross, turnover
+
+
+def _moment_metrics(gross, turnover, costs, periods_per_year):
+    """
+    Sharpe, mean return and turnover for every (row, cost) pair from
+    per-row sums; net = gross - cost * turnover, so no (rows, costs, bars)
+    array is ever built.
+    """
+    n = gross.shape[-1]
+    g, u = gross.sum(axis=-1), turnover.sum(axis=-1)
+    g2 = np.einsum('ij,ij->i', gross, gross)
+    u2 = np.einsum('ij,ij->i', turnover, turnover)
+    gu = np.einsum('ij,ij->i', gross, turnover)
+    c = np.asarray(costs, dtype=np.float64)[None, :]
+
+    mean = (g[:, None] - c * u[:, None]) / n
+    second = (g2[:, None] - 2 * c * gu[:, None] + c * c * u2[:, None]) / n
+    std = np.sqrt(np.maximum(second - mean * mean, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, mean / std * np.sqrt(periods_per_year), 0.0)
+    return {
+        "sharpe": sharpe,
+        "mean_return": mean,
+        "annual_turnover": np.broadcast_to((u / n * periods_per_year)[:, None], sharpe.shape),
+        "trades": np.broadcast_to(np.count_nonzero(turnover, axis=-1)[:, None], sharpe.shape),
+    }
+
+
+def _path_metrics(gross, turnover, rows, costs, max_bytes):
+    """
+    Compounded total return and max drawdown for (row, cost) pairs, in
+    chunks of combinations that keep the temporary under max_bytes.
+    """
+    n = gross.shape[-1]
+    total = np.empty(len(rows))
+    drawdown = np.empty(len(rows))
+    step = max(1, int(max_bytes // (n * 8 * 2)))
+    for start in range(0, len(rows), step):
+        r, c = rows[start:start + step], costs[start:start + step]
+        net = gross[r] - c[:, None] * turnover[r]
+        # Returns below -100% would wipe the account out; cap there
+        log_equity = np.cumsum(np.log1p(np.maximum(net, -1 + 1e-12)), axis=-1)
+        peak = np.maximum(np.maximum.accumulate(log_equity, axis=-1), 0.0)
+        total[start:start + step] = np.expm1(log_equity[:, -1])
+        drawdown[start:start + step] = -np.expm1((log_equity - peak).min(axis=-1))
+    return total, drawdown
+
+
+def periods_per_year(df):
+    """
+    Bars per year, inferred from the median spacing of open_time (or a
+    DatetimeIndex). Falls back to daily bars.
+    """
+    if "open_time" in df.columns:
+        times = pd.to_datetime(df["open_time"])
+    elif isinstance(df.index, pd.DatetimeIndex):
+        times = df.index.to_series()
+    else:
+        return 365.0
+    step = times.diff().median()
+    if pd.isna(step) or step.total_seconds() <= 0:
+        return 365.0
+    return SECONDS_PER_YEAR / step.total_seconds()
+
+
+# --- PUBLIC API ---
+
+def sweep(df, thresholds=(0.0,), fees=(0.001,), slippages=(0.0005,), allow_short=(True,), hold="flat",
+          fill="close", drawdown_top=None, max_bytes=256 << 20, ppy=None):
+    """
+    Backtests every combination of confidence threshold, fee, slippage
+    and shorting on a predict_from_dataframe() output (needs
+    predicted_label, confidence, open, close).
+
+    Sharpe / turnover for all combinations come from one batched pass;
+    compounded return and max drawdown need the equity path and are
+    computed in chunks, for every combination or only the best
+    `drawdown_top` by Sharpe. Costs are per unit of turnover, in
+    fractions (0.001 = 10 bps). Returns a DataFrame sorted by Sharpe.
+    """
+    labels = df["predicted_label"].to_numpy()
+    confidence = df["confidence"].to_numpy()
+    open_ = df["open"].to_numpy() if "open" in df.columns else None
+    close = df["close"].to_numpy()
+    ppy = ppy or periods_per_year(df)
+
+    signals = [(float(t), bool(s)) for s in allow_short for t in np.atleast_1d(thresholds)]
+    cost_grid = list(itertools.product(fees, slippages))
+    costs = np.array([f + s for f, s in cost_grid], dtype=np.float64)
+    n_signals, n_costs = len(signals), len(costs)
+
+    # Pass 1: moment metrics for every combination
+    metrics = {k: np.empty((n_signals, n_costs)) for k in ("sharpe", "mean_return", "annual_turnover", "trades")}
+    exposure = np.empty(n_signals)
+    for rows, pos, gross, turnover in _signal_chunks(labels, confidence, open_, close, signals,
+                                                    np.arange(n_signals), hold, fill, max_bytes):
+        for k, v in _moment_metrics(gross, turnover, costs, ppy).items():
+            metrics[k][rows] = v
+        exposure[rows] = (pos != 0).mean(axis=-1)
+
+    # One row per combination: signal rows x cost columns
+    row_idx, cost_idx = np.divmod(np.arange(n_signals * n_costs), n_costs)
+    result = pd.DataFrame({
+        "threshold": np.array([t for t, _ in signals])[row_idx],
+        "allow_short": np.array([s for _, s in signals])[row_idx],
+        "fee": np.array([f for f, _ in cost_grid], dtype=np.float64)[cost_idx],
+        "slippage": np.array([s for _, s in cost_grid], dtype=np.float64)[cost_idx],
+        "sharpe": metrics["sharpe"].ravel(),
+        "mean_return": metrics["mean_return"].ravel(),
+        "annual_turnover": metrics["annual_turnover"].ravel(),
+        "trades": metrics["trades"].ravel().astype(np.int64),
+        "exposure": exposure[row_idx],
+        "total_return": np.nan,
+        "max_drawdown": np.nan,
+    })
+
+    # Pass 2: equity paths, only for the signal rows that are needed
+    order = np.argsort(-result["sharpe"].to_numpy(), kind="stable")
+    chosen = np.sort(order if drawdown_top is None else order[:drawdown_top])
+    needed = np.unique(row_idx[chosen])
+    total = np.empty(n_signals * n_costs)
+    drawdown = np.empty(n_signals * n_costs)
+    for rows, _, gross, turnover in _signal_chunks(labels, confidence, open_, close, signals,
+                                                   needed, hold, fill, max_bytes):
+        combos = chosen[np.isin(row_idx[chosen], rows)]
+        local = np.searchsorted(rows, row_idx[combos])
+        total[combos], drawdown[combos] = _path_metrics(gross, turnover, local, costs[cost_idx[combos]], max_bytes)
+    result.loc[chosen, "total_return"] = total[chosen]
+    result.loc[chosen, "max_drawdown"] = drawdown[chosen]
+    return result.iloc[order].reset_index(drop=True)
+
+
+def backtest(df, threshold=0.0, fee=0.001, slippage=0.0005, allow_short=True, hold="flat", fill="close",
+             ppy=None):
+    """
+    Single backtest. Returns (metrics dict, equity curve Series).
+    """
+    ppy = ppy or periods_per_year(df)
+    pos = signal_positions(df["predicted_label"].to_numpy(), df["confidence"].to_numpy(),
+                           [threshold], allow_short, hold)
+    gross, turnover = gross_returns(pos, df["open"].to_numpy() if "open" in df.columns else None,
+                                    df["close"].to_numpy(), fill)
+    metrics = sweep(df, [threshold], [fee], [slippage], [allow_short], hold, fill, ppy=ppy).iloc[0].to_dict()
+    net = gross[0] - (fee + slippage) * turnover[0]
+    equity = pd.Series(np.cumprod(1 + net), index=df.index, name="equity")
+    return metrics, equity
+
+
+def backtest_model(df, model_name="best_crypto_model", **kwargs):
+    """
+    Scores df with a saved model and sweeps it (kwargs go to sweep()).
+    """
+    scored = predict.predict_from_dataframe(df, model_name)
+    return sweep(scored, **kwargs)
+
+
+if __name__ == "__main__":
+    import kline_store
+
+    df = kline_store.read_stage("labeled")
+    if df is None:
+        print(f" Error: File not found at {kline_store.stage_path('labeled')}")
+    else:
+        df = df.dropna().iloc[int(len(df) * 0.85):]
+        started = time.perf_counter()
+        results = backtest_model(df, thresholds=np.linspace(0.3, 0.9, 25), fees=[0.0, 0.0005, 0.001],
+                                 slippages=[0.0, 0.0005, 0.001], allow_short=(True, False))
+        elapsed = time.perf_counter() - started
+        print(f"\n {len(results)} combinations in {elapsed:.2f}s")
+        print(results.head(10).to_string(index=False))
@@ -0,0 +1,701 @@
+import contextlib
+import http.server
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import data_fetcher
+import features
+import kline_store
+import predict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Offline benchmark suite. Synthetic OHLCV of each size is written as a
+# raw kline CSV into a scratch data/model folder, pushed through every
+# pipeline stage and the prediction hot path, and the timings are saved
+# as JSON so runs can be compared. Each stage runs in a fresh process so
+# its peak memory is its own.
+
+SIZES = (1_000, 100_000, 10_000_000)
+
+# (module, function, kwargs) per stage, resolved inside the worker
+STAGES = {
+    "clean_raw_data": ("data_processor", "clean_raw_data", {}),
+    "feature_generator": ("feature_generator", "feature_generator", {}),
+    "create_labels": ("labeler", "create_labels", {}),
+    "train_models": ("train", "train_models", {}),
+    "evaluate_models": ("evaluate", "evaluate_models", {"use_cache": False}),
+    "predict_from_dataframe": ("benchmark", "_predict_labeled", {}),
+    "inference": ("benchmark", "inference_latency", {}),
+}
+
+# A stage is flagged when it is this much slower (or bigger) than the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and the difference is above the noise floor
+MIN_SECONDS = 0.05
+MIN_MB = 16.0
+
+
+# --- SYNTHETIC DATA ---
+
+def synthetic_ohlcv(n, seed=0, interval="1m", start_ms=1_600_000_000_000, price=20_000.0, vol=0.002,
+                    regimes=True):
+    """
+    n klines of a geometric random walk with GARCH-like volatility
+    clusters, in the raw Binance column layout (KLINE_COLUMNS).
+    regimes=False keeps the volatility constant (stationary returns).
+    Deterministic for a given seed.
+    """
+    rng = np.random.default_rng(seed)
+    step = data_fetcher.INTERVAL_MS[interval]
+    # Volatility regimes: a slow random walk in log-vol
+    regime = np.exp(np.cumsum(rng.normal(0, 0.02, n)).clip(-2, 2)) if regimes else np.ones(n)
+    log_ret = rng.normal(0, vol, n) * regime
+    close = price * np.exp(np.cumsum(log_ret))
+    open_ = np.empty(n)
+    open_[0] = price
+    open_[1:] = close[:-1]
+    wick = np.abs(rng.normal(0, vol / 2, (2, n))) * regime
+    high = np.maximum(open_, close) * (1 + wick[0])
+    low = np.minimum(open_, close) * (1 - wick[1])
+    volume = rng.lognormal(3, 1, n) * regime
+    open_time = start_ms + step * np.arange(n, dtype=np.int64)
+    taker_share = rng.uniform(0.3, 0.7, n)
+    return pd.DataFrame({
+        "open_time": open_time,
+        "open": open_,
+        "high": high,
+        "low": low,
+        "close": close,
+        "volume": volume,
+        "close_time": open_time + step - 1,
+        "quote_asset_volume": volume * close,
+        "num_trades": rng.poisson(500, n),
+        "taker_base_volume": volume * taker_share,
+        "taker_quote_volume": volume * taker_share * close,
+        "ignore": 0,
+    }, columns=data_fetcher.KLINE_COLUMNS)
+
+
+def write_raw(n, seed=0, chunk_rows=1_000_000):
+    """
+    Writes n synthetic klines to data/raw/raw_data.csv, a chunk at a time
+    (the walk continues across chunks), so 10M rows fit in memory.
+    """
+    path = os.path.join(kline_store.data_dir(), 'raw', 'raw_data.csv')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    price, start_ms = 20_000.0, 1_600_000_000_000
+    with open(path, 'w', newline='') as f:
+        for i, start in enumerate(range(0, n, chunk_rows)):
+            chunk = synthetic_ohlcv(min(chunk_rows, n - start), seed=seed + i, start_ms=start_ms, price=price)
+            chunk.to_csv(f, index=False, header=i == 0, float_format="%.8f")
+            price = float(chunk["close"].iloc[-1])
+            start_ms = int(chunk["open_time"].iloc[-1]) + data_fetcher.INTERVAL_MS["1m"]
+    return path
+
+
+# --- MEASUREMENT ---
+
+def _rss_mb():
+    # Current resident set size (Linux); None elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # Worker pools (train/evaluate) count too
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def _run_stage(module, function, kwargs, quiet, workdir):
+    """
+    Worker: imports and runs one stage, returning its timing and memory.
+    Imports happen before the clock starts.
+    """
+    fn = getattr(importlib.import_module(module), function)
+    # Anything a library writes to the working directory stays in the scratch folder
+    os.chdir(workdir)
+    rss_start = _rss_mb()
+    out = io.StringIO() if quiet else sys.stdout
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        result = fn(**kwargs)
+    seconds = time.perf_counter() - started
+    peak = _peak_rss_mb()
+    report = {
+        "seconds": seconds,
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+        "rss_start_mb": round(rss_start, 1) if rss_start is not None else None,
+    }
+    if isinstance(result, pd.DataFrame):
+        report["rows"] = len(result)
+    elif isinstance(result, dict):
+        # Stages that measure themselves (inference)
+        report.update(result)
+    elif isinstance(result, list):
+        # train_models: one result per model
+        failed = [r["name"] for r in result if r.get("error")]
+        if failed:
+            raise RuntimeError(f"models failed: {', '.join(failed)}")
+    elif result is None or (isinstance(result, tuple) and result[0] is None):
+        raise RuntimeError(f"{module}.{function} failed")
+    return report
+
+
+def _predict_labeled(model_name="best_crypto_model"):
+    df = kline_store.read_stage("labeled")
+    return predict.predict_from_dataframe(df, model_name)
+
+
+def inference_latency(single_repeats=200, batch_rows=10_000, batch_repeats=3):
+    """
+    Per-model latency on the labeled data: single-row calls (p50/p99 ms)
+    and one batch of batch_rows (best of batch_repeats, rows/s). Covers
+    every saved model plus the exported best_crypto_model.npz.
+    """
+    df = kline_store.read_stage("labeled")
+    X = features.feature_matrix(df.tail(batch_rows))
+
+    names = predict.list_models()
+    if os.path.exists(predict._model_path("best_crypto_model.npz")):
+        names.append("best_crypto_model.npz")
+
+    models = {}
+    for name in names:
+        model = predict.load_model(name)
+        # Warm-up call (lazy init, first-call allocations)
+        predict.score_matrix(model, X[:1])
+
+        times = np.empty(single_repeats)
+        for i in range(single_repeats):
+            row = X[i % len(X):i % len(X) + 1]
+            started = time.perf_counter()
+            predict.score_matrix(model, row)
+            times[i] = time.perf_counter() - started
+
+        best = float("inf")
+        for _ in range(batch_repeats):
+            started = time.perf_counter()
+            predict.score_matrix(model, X)
+            best = min(best, time.perf_counter() - started)
+
+        p50, p99 = np.percentile(times * 1000, [50, 99])
+        models[name] = {
+            "single_p50_ms": round(float(p50), 4),
+            "single_p99_ms": round(float(p99), 4),
+            "batch_rows": len(X),
+            "batch_ms": round(best * 1000, 3),
+            "batch_rows_per_s": round(len(X) / best, 1),
+        }
+    return {"rows": len(X), "models": models}
+
+
+# --- SUITE ---
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "commit": commit,
+    }
+
+
+def results_dir():
+    return os.path.join(kline_store.data_dir(), 'benchmarks')
+
+
+def run_benchmarks(sizes=SIZES[:2], stages=None, seed=0, quiet=True, save=True, baseline=None,
+                   tolerance=DEFAULT_TOLERANCE, keep_workdir=False):
+    """
+    Runs the suite for each size (rows of synthetic 1m klines) and
+    returns the results dict: per size and stage, wall time, rows/s and
+    peak memory, plus per-model single-row / batch inference latency.
+
+    Everything runs in a scratch folder (CRYPTO_DATA_DIR /
+    CRYPTO_MODEL_DIR), so real data and models are untouched. The results
+    are saved to data/benchmarks/<timestamp>.json; with a baseline (a
+    results dict or JSON path) slowdowns beyond `tolerance` are listed
+    under "regressions".
+
+    The 10M-row size needs several GB of RAM and trains every model on
+    7M rows; pass stages=[...] to limit it.
+    """
+    stages = list(stages or STAGES)
+    out_dir = results_dir()
+    results = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": _environment(),
+               "seed": seed, "sizes": {}}
+    saved_env = {k: os.environ.get(k) for k in ("CRYPTO_DATA_DIR", "CRYPTO_MODEL_DIR")}
+
+    for n in sizes:
+        workdir = tempfile.mkdtemp(prefix=f"crypto-bench-{n}-")
+        os.environ["CRYPTO_DATA_DIR"] = os.path.join(workdir, 'data')
+        os.environ["CRYPTO_MODEL_DIR"] = os.path.join(workdir, 'models')
+        print(f"\n Benchmark: {n:,} rows ({workdir})")
+        try:
+            started = time.perf_counter()
+            write_raw(n, seed)
+            print(f"   {'synthetic data':<24} {time.perf_counter() - started:>9.2f}s")
+
+            size_results = {}
+            for name in stages:
+                module, function, kwargs = STAGES[name]
+                # Fresh interpreter per stage: clean peak-RSS and no warm caches
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    try:
+                        report = pool.submit(_run_stage, module, function, kwargs, quiet, workdir).result()
+                    except Exception as e:
+                        report = {"error": f"{type(e).__name__}: {e}"}
+                if "error" not in report:
+                    report["rows"] = report.get("rows", n)
+                    if report["seconds"] and "models" not in report:
+                        report["rows_per_s"] = round(report["rows"] / report["seconds"], 1)
+                    report["seconds"] = round(report["seconds"], 4)
+                size_results[name] = report
+                _print_stage(name, report)
+            results["sizes"][str(n)] = size_results
+        finally:
+            for k, v in saved_env.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            if not keep_workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    if baseline is not None:
+        results["baseline"] = baseline if isinstance(baseline, str) else baseline.get("created_at")
+        results["regressions"] = compare(results, baseline, tolerance)
+        print_regressions(results["regressions"], tolerance)
+
+    if save:
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        os.replace(tmp_path, path)
+        results["path"] = path
+        print(f"\n Results saved to: {path}")
+    return results
+
+
+def _print_stage(name, report):
+    if "error" in report:
+        print(f"   ❌ {name:<22} {report['error']}")
+        return
+    rate = f"{report['rows_per_s']:>14,.0f} rows/s" if report.get("rows_per_s") else ""
+    peak = f"{report['peak_rss_mb']:>8.0f} MB peak" if report.get("peak_rss_mb") is not None else ""
+    print(f"   {name:<24} {report['seconds']:>9.2f}s {rate} {peak}")
+    for model, m in report.get("models", {}).items():
+        print(f"      - {model:<24} single p50 {m['single_p50_ms']:>8.3f} ms  p99 {m['single_p99_ms']:>8.3f} ms  "
+              f"batch {m['batch_rows_per_s']:>12,.0f} rows/s")
+
+
+# --- REGRESSION CHECK ---
+
+def _metrics(size_results):
+    # Flattens one size's results to {metric path: (value, kind)}; "higher is worse" for all
+    flat = {}
+    for stage, report in size_results.items():
+        if "error" in report:
+            continue
+        flat[f"{stage}.seconds"] = (report["seconds"], "seconds")
+        if report.get("peak_rss_mb") is not None:
+            flat[f"{stage}.peak_rss_mb"] = (report["peak_rss_mb"], "mb")
+        for model, m in report.get("models", {}).items():
+            flat[f"{stage}.{model}.single_p50_ms"] = (m["single_p50_ms"] / 1000, "seconds")
+            flat[f"{stage}.{model}.batch_ms"] = (m["batch_ms"] / 1000, "seconds")
+    return flat
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Lists every metric (stage time, peak memory, model latency) that got
+    more than `tolerance` worse than in `baseline` (a results dict or a
+    JSON path) for the sizes both runs share. Differences below the noise
+    floor (MIN_SECONDS / MIN_MB) are ignored. Stages that failed now but
+    not in the baseline are reported too.
+    """
+    if isinstance(baseline, str):
+        with open(baseline) as f:
+            baseline = json.load(f)
+
+    regressions = []
+    for size, now in current["sizes"].items():
+        before = baseline.get("sizes", {}).get(size)
+        if before is None:
+            continue
+        for stage, report in now.items():
+            if "error" in report and "error" not in before.get(stage, {"error": None}):
+                regressions.append({"size": int(size), "metric": stage, "baseline": "ok", "current": "failed"})
+
+        old = _metrics(before)
+        for key, (value, kind) in _metrics(now).items():
+            if key not in old:
+                continue
+            reference = old[key][0]
+            floor = MIN_SECONDS if kind == "seconds" else MIN_MB
+            if value > reference * (1 + tolerance) and value - reference > floor:
+                regressions.append({
+                    "size": int(size), "metric": key, "baseline": reference, "current": value,
+                    "ratio": round(value / reference, 3) if reference else None,
+                })
+    return regressions
+
+
+def print_regressions(regressions, tolerance=DEFAULT_TOLERANCE):
+    if not regressions:
+        print(f"\n ✅ No regressions (tolerance {tolerance:.0%})")
+        return
+    print(f"\n ❌ {len(regressions)} regressions (tolerance {tolerance:.0%}):")
+    for r in regressions:
+        ratio = f"x{r['ratio']}" if r.get("ratio") else ""
+        print(f"   {r['size']:>10,} rows  {r['metric']:<52} {r['baseline']} -> {r['current']} {ratio}")
+
+
+# --- CHECKS ---
+# Correctness checks on synthetic data, each in its own scratch folder
+# (python src/benchmark.py --checks). They raise AssertionError on failure.
+
+@contextlib.contextmanager
+def scratch_dirs(prefix="crypto-check-"):
+    """
+    Points CRYPTO_DATA_DIR / CRYPTO_MODEL_DIR (and the working
+    directory) at a temporary folder for the duration of the block, then
+    restores them and deletes it.
+    """
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    cwd = os.getcwd()
+    saved_env = {k: os.environ.get(k) for k in ("CRYPTO_DATA_DIR", "CRYPTO_MODEL_DIR")}
+    os.environ["CRYPTO_DATA_DIR"] = os.path.join(workdir, 'data')
+    os.environ["CRYPTO_MODEL_DIR"] = os.path.join(workdir, 'models')
+    os.chdir(workdir)
+    try:
+        yield workdir
+    finally:
+        os.chdir(cwd)
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _build_labeled(raw):
+    # raw klines -> data/raw/raw_data.csv -> process -> features -> labels
+    import data_processor
+    import feature_generator
+    import labeler
+
+    path = os.path.join(kline_store.data_dir(), 'raw', 'raw_data.csv')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    raw.to_csv(path, index=False, float_format="%.8f")
+    with contextlib.redirect_stdout(io.StringIO()):
+        data_processor.clean_raw_data()
+        feature_generator.feature_generator()
+        labeler.create_labels()
+
+
+def check_incremental_retrain(n=60_000, new_rows=1_000, seed=0,
+                              model_names=("RandomForest", "XGBoost", "LightGBM")):
+    """
+    Stationary 1m bars (constant volatility) through the pipeline and
+    train_models, then new_rows more bars from the same generator:
+    retrain_incremental must update every model in place (action
+    "incremental") rather than see drift and refit it.
+    Returns the retrain results.
+    """
+    import train
+
+    raw = synthetic_ohlcv(n + new_rows, seed=seed, regimes=False)
+    with scratch_dirs():
+        _build_labeled(raw.iloc[:n])
+        with contextlib.redirect_stdout(io.StringIO()):
+            train.train_models(parallel=False, model_names=list(model_names))
+        _build_labeled(raw)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = train.retrain_incremental(model_names=list(model_names))
+
+    refit = [f"{r['name']}: {r['action']} ({r['error'] or r['reason']})" for r in results
+             if r["action"] != "incremental" or r["error"]]
+    assert not refit, f"stationary data did not take the incremental path: {'; '.join(refit)}"
+    return results
+
+
+def check_export_parity(n=20_000, seed=0, model_names=None, atol=1e-6):
+    """
+    Trains every model type (default: train.MODEL_NAMES) on synthetic
+    bars, exports each to .npz and compares its probabilities with the
+    pickle on the labeled rows (export.check_parity).
+    Returns {model: parity}.
+    """
+    import export
+    import train
+
+    names = list(model_names or train.MODEL_NAMES)
+    with scratch_dirs():
+        _build_labeled(synthetic_ohlcv(n, seed=seed))
+        with contextlib.redirect_stdout(io.StringIO()):
+            fitted = train.train_models(parallel=False, model_names=names)
+        failed = [f"{r['name']}: {r['error']}" for r in fitted if r["error"]]
+        assert not failed, f"training failed: {'; '.join(failed)}"
+        X = features.feature_matrix(kline_store.read_stage("labeled").dropna())
+        results = {}
+        for name in names:
+            export.export_model(name)
+            results[name] = export.check_parity(name, X, atol)
+    return results
+
+
+def _ta_features(close):
+    # The indicators as feature_generator computed them with `ta`
+    from ta.momentum import RSIIndicator
+    from ta.trend import MACD, SMAIndicator
+    from ta.volatility import BollingerBands
+
+    macd = MACD(close, window_slow=26, window_fast=12, window_sign=9)
+    bb = BollingerBands(close, window=20, window_dev=2)
+    returns = close.pct_change()
+    return pd.DataFrame({
+        "rsi": RSIIndicator(close, window=14).rsi(),
+        "macd": macd.macd(),
+        "macd_signal": macd.macd_signal(),
+        "macd_hist": macd.macd_diff(),
+        "sma_20": SMAIndicator(close, window=20).sma_indicator(),
+        "sma_50": SMAIndicator(close, window=50).sma_indicator(),
+        "sma_200": SMAIndicator(close, window=200).sma_indicator(),
+        "bb_high": bb.bollinger_hband(),
+        "bb_low": bb.bollinger_lband(),
+        "volatility": returns.rolling(20).std(),
+        "pct_change_1d": returns,
+        "pct_change_7d": close.pct_change(7),
+    })[features.FEATURE_COLUMNS]
+
+
+def check_incremental_parity(n=5_000, seed=0, rtol=1e-6, atol=1e-9):
+    """
+    Feeds synthetic bars one at a time through IncrementalFeatureEngine,
+    checkpointing and restoring it halfway, and compares every feature
+    column with features.add_features and with the `ta` indicators: same
+    warm-up NaNs, values within rtol/atol.
+    Returns {column: largest absolute difference from ta}.
+    """
+    from incremental_features import IncrementalFeatureEngine
+
+    raw = synthetic_ohlcv(n, seed=seed)
+    closes, times = raw["close"].tolist(), raw["open_time"].tolist()
+    split = n // 2
+
+    engine = IncrementalFeatureEngine()
+    rows = [engine.update_one(c, t) for c, t in zip(closes[:split], times[:split])]
+    with scratch_dirs() as workdir:
+        engine = IncrementalFeatureEngine.restore(engine.checkpoint(os.path.join(workdir, 'engine.joblib')))
+    assert engine.last_open_time == times[split - 1], "restored engine lost its position"
+    rows += [engine.update_one(c, t) for c, t in zip(closes[split:], times[split:])]
+    assert engine.is_warm, "engine not warm after the whole series"
+
+    incremental = pd.DataFrame(rows)[features.FEATURE_COLUMNS].to_numpy()
+    references = {"add_features": features.add_features(raw, dropna=False)[features.FEATURE_COLUMNS].to_numpy(),
+                  "ta": _ta_features(raw["close"]).to_numpy()}
+    mismatches, worst = [], {}
+    for ref_name, expected in references.items():
+        for j, column in enumerate(features.FEATURE_COLUMNS):
+            got, want = incremental[:, j], expected[:, j]
+            if not np.array_equal(np.isnan(got), np.isnan(want)):
+                mismatches.append(f"{column} vs {ref_name}: warm-up NaNs differ")
+                continue
+            valid = ~np.isnan(want)
+            if not np.allclose(got[valid], want[valid], rtol=rtol, atol=atol):
+                mismatches.append(f"{column} vs {ref_name}: max diff {np.abs(got[valid] - want[valid]).max():.3g}")
+            if ref_name == "ta":
+                worst[column] = float(np.abs(got[valid] - want[valid]).max()) if valid.any() else 0.0
+    assert not mismatches, "; ".join(mismatches)
+    return worst
+
+
+class _KlineStub(http.server.BaseHTTPRequestHandler):
+    # /api/v3/klines over server.klines with Binance's paging rules (startTime
+    # pages forwards, otherwise the newest `limit` rows up to endTime). Only
+    # the first server.visible rows exist yet; the next server.throttle
+    # requests get a 429 with Retry-After. Every answer reports the weight used.
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        server = self.server
+        with server.lock:
+            server.requests.append(params)
+            server.weight += 2
+            weight, throttled = server.weight, server.throttle > 0
+            if throttled:
+                server.throttle -= 1
+        if url.path != data_fetcher.KLINES_ENDPOINT:
+            return self._send(404, {"msg": "Unknown endpoint"}, weight)
+        if throttled:
+            return self._send(429, {"code": -1003, "msg": "Too many requests"}, weight,
+                              {"Retry-After": str(server.retry_after)})
+
+        rows, limit = server.klines[:server.visible], int(params.get("limit", 500))
+        if "endTime" in params:
+            rows = [r for r in rows if r[0] <= int(params["endTime"])]
+        if "startTime" in params:
+            rows = [r for r in rows if r[0] >= int(params["startTime"])][:limit]
+        else:
+            rows = rows[-limit:]
+        self._send(200, rows, weight)
+
+    def _send(self, status, body, weight, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-MBX-USED-WEIGHT-1M", str(weight))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def kline_stub(klines, retry_after=1):
+    """
+    Serves `klines` (rows in KLINE_COLUMNS layout, oldest first) as a
+    Binance klines endpoint on localhost for the duration of the block.
+    Yields the server: base_url, requests (query params, in order),
+    weight, and the visible / throttle knobs (see _KlineStub).
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _KlineStub)
+    server.klines, server.visible, server.throttle, server.retry_after = klines, len(klines), 0, retry_after
+    server.requests, server.weight, server.lock = [], 0, threading.Lock()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def check_fetcher(n=2_500, seed=0, symbol="BTCUSDT", interval="1m"):
+    """
+    data_fetcher against a local Binance stub: fetch_klines must page
+    backwards with endTime down to start_time, update_many must resume
+    after the last stored candle and ride out a 429 (Retry-After), and a
+    response near the weight budget must pause the RateLimiter until the
+    next minute. Returns {step: requests made}.
+    """
+    raw = synthetic_ohlcv(n, seed=seed, interval=interval)
+    open_ms = raw["open_time"].tolist()
+    results = {}
+    with kline_stub(json.loads(raw.to_json(orient="values"))) as stub:
+        # Newest page first, then older ones below it; startTime only once it fits a page
+        df = data_fetcher.fetch_klines(symbol, interval, start_time=open_ms[100], base_url=stub.base_url)
+        assert df["open_time"].astype("int64").tolist() == open_ms[100:], "paged fetch does not cover the range"
+        ends = [int(p["endTime"]) for p in stub.requests if "endTime" in p]
+        assert "endTime" not in stub.requests[0] and ends == sorted(ends, reverse=True) and len(ends) > 1, \
+            f"not paged backwards: {stub.requests}"
+        assert all("startTime" not in p for p in stub.requests[:-1]), "startTime sent before the last page"
+        results["paging"] = len(stub.requests)
+
+        with scratch_dirs(), contextlib.redirect_stdout(io.StringIO()):
+            stub.visible = n - 500
+            first = data_fetcher.update_many([symbol], (interval,), start_time=open_ms[0], base_url=stub.base_url)
+            stub.visible, stub.throttle = n, 1
+            del stub.requests[:]
+            started = time.perf_counter()
+            second = data_fetcher.update_many([symbol], (interval,), start_time=open_ms[0], base_url=stub.base_url)
+            elapsed = time.perf_counter() - started
+            stored = kline_store.read_klines(symbol, interval, columns=["open_time"])
+        assert first == {(symbol, interval): n - 500}, f"first download: {first}"
+        assert second == {(symbol, interval): 500}, f"resumed download: {second}"
+        # The 429 plus one page: nothing before the stored tail was asked for again
+        assert len(stub.requests) == 2 and stub.throttle == 0, f"resume requests: {stub.requests}"
+        assert elapsed >= stub.retry_after, f"Retry-After not honoured ({elapsed:.2f}s)"
+        assert (stored["open_time"].astype("int64") // 1_000_000).tolist() == open_ms, "store is not the full series"
+        results["resume"] = len(stub.requests)
+
+        limiter = data_fetcher.RateLimiter(weight_limit=stub.weight + 2)
+        data_fetcher.fetch_klines(symbol, interval, limit=10, base_url=stub.base_url, limiter=limiter)
+        pause = limiter._resume_at - time.time()
+        assert 0 < pause <= 60, f"weight limit reached without a pause ({pause:.1f}s)"
+        results["weight_limit"] = 1
+    return results
+
+
+def run_checks():
+    """
+    Runs every check; returns {check: "ok" or the failure}.
+    """
+    checks = {"export_parity": check_export_parity, "incremental_retrain": check_incremental_retrain,
+              "incremental_parity": check_incremental_parity, "fetcher": check_fetcher}
+    results = {}
+    for name, check in checks.items():
+        try:
+            check()
+            results[name] = "ok"
+        except Exception as e:
+            results[name] = f"{type(e).__name__}: {e}"
+        print(f"   {'✅' if results[name] == 'ok' else '❌'} {name:<24} {results[name]}")
+    return results
+
+
+def latest_results(exclude=None):
+    """
+    Path of the newest saved results file (other than `exclude`), or None.
+    """
+    if not os.path.isdir(results_dir()):
+        return None
+    paths = sorted(os.path.join(results_dir(), f) for f in os.listdir(results_dir()) if f.endswith('.json'))
+    paths = [p for p in paths if p != exclude]
+    return paths[-1] if paths else None
+
+
+if __name__ == "__main__":
+    # python src/benchmark.py [rows ...]   (default: 1000 100000)
+    # Compares against the previous run and exits 1 on a regression
+    # python src/benchmark.py --checks    correctness checks, exits 1 on a failure
+    if sys.argv[1:] == ["--checks"]:
+        sys.exit(0 if all(r == "ok" for r in run_checks().values()) else 1)
+    sizes = [int(s.replace('_', '')) for s in sys.argv[1:]] or SIZES[:2]
+    previous = latest_results()
+    results = run_benchmarks(sizes, baseline=previous)
+    sys.exit(1 if results.get("regressions") else 0)
@@ -1,57 +1,341 @@
 import requests
 import pandas as pd
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+import instrumentation
+import kline_store
 
-def fetch_binance_data(symbol="BTCUSDT", interval="1d", limit=1000):
+BASE_URL = "https://api.binance.com"
+KLINES_ENDPOINT = "/api/v3/klines"
+TICKER_ENDPOINT = "/api/v3/ticker/24hr"
+
+# Binance refuses anything above 1000 rows per klines request
+MAX_LIMIT = 1000
+
+KLINE_COLUMNS = [
+    "open_time", "open", "high", "low", "close", "volume",
+    "close_time", "quote_asset_volume", "num_trades",
+    "taker_base_volume", "taker_quote_volume", "ignore"
+]
+
+# Candle length in milliseconds for every fixed-size Binance interval
+INTERVAL_MS = {
+    "1m": 60_000, "3m": 180_000, "5m": 300_000, "15m": 900_000, "30m": 1_800_000,
+    "1h": 3_600_000, "2h": 7_200_000, "4h": 14_400_000, "6h": 21_600_000,
+    "8h": 28_800_000, "12h": 43_200_000,
+    "1d": 86_400_000, "3d": 259_200_000, "1w": 604_800_000,
+}
+
+
+# --- HTTP CLIENT ---
+
+def create_session(pool_size=16):
+    """
+    Creates a requests Session with a connection pool large enough to be
+    shared by every worker thread of a multi-symbol fetch.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class RateLimiter:
+    """
+    Tracks the request weight Binance reports in the X-MBX-USED-WEIGHT-1M
+    header and pauses callers before the per-minute budget runs out.
+    Shared by all threads of a fetch so they back off together.
+    """
+
+    def __init__(self, weight_limit=6000, safety=0.9):
+        self.weight_limit = weight_limit
+        self.safety = safety
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = self._resume_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause_for(self, seconds):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.time() + seconds)
+
+    def update(self, headers):
+        used = headers.get("X-MBX-USED-WEIGHT-1M")
+        if used is None:
+            return
+        if int(used) >= self.weight_limit * self.safety:
+            # Weight resets at the start of the next wall-clock minute
+            self.pause_for(60 - (time.time() % 60))
+
+
+def _get_json(session, url, params, limiter=None, max_retries=5, backoff=1.0):
+    """
+    GETs a Binance endpoint, retrying with exponential backoff on
+    429/418 (rate limited), 5xx and connection errors. Honours Retry-After.
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.wait()
+
+        try:
+            with instrumentation.span("fetch.request"):
+                response = session.get(url, params=params, timeout=30)
+        except (requests.ConnectionError, requests.Timeout):
+            instrumentation.incr("fetch_errors", kind="connection")
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            continue
+
+        if limiter is not None:
+            limiter.update(response.headers)
+
+        instrumentation.incr("fetch_requests", status=response.status_code)
+        if response.status_code in (418, 429) or response.status_code >= 500:
+            if attempt == max_retries:
+                response.raise_for_status()
+            retry_after = response.headers.get("Retry-After")
+            delay = float(retry_after) if retry_after else backoff * 2 ** attempt
+            if limiter is not None:
+                limiter.pause_for(delay)
+            else:
+                time.sleep(delay)
+            continue
+
+        response.raise_for_status()
+        return response.json()
+
+
+# --- PAGINATED FETCH ---
+
+def _fits_in_page(start_time, end_time, interval, page_size):
+    """
+    True when [start_time, end_time] holds at most page_size candles.
+    """
+    step = INTERVAL_MS.get(interval)
+    if step is None:
+        return False
+    if end_time is None:
+        end_time = int(time.time() * 1000)
+    return (end_time - start_time) // step < page_size
+
+
+def fetch_klines(symbol="BTCUSDT", interval="1d", start_time=None, end_time=None,
+                 limit=None, session=None, base_url=BASE_URL, limiter=None):
+    """
+    Fetches klines for one symbol/interval, paging backwards from end_time
+    with startTime/endTime until start_time (ms) is reached, `limit` rows
+    have been collected, or the symbol's listing date is hit.
+
+    Returns a DataFrame with KLINE_COLUMNS in ascending open_time order,
+    values exactly as Binance sends them (prices are strings).
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(pool_size=1)
+
+    url = f"{base_url}{KLINES_ENDPOINT}"
+    pages = []
+    rows = 0
+    cursor = end_time
+
+    try:
+        while limit is None or rows < limit:
+            page_size = MAX_LIMIT if limit is None else min(MAX_LIMIT, limit - rows)
+            params = {"symbol": symbol, "interval": interval, "limit": page_size}
+            if cursor is not None:
+                params["endTime"] = int(cursor)
+            # With both bounds Binance pages forwards from startTime, so only
+            # send it once the remaining span fits in this single page
+            if start_time is not None and _fits_in_page(start_time, cursor, interval, page_size):
+                params["startTime"] = int(start_time)
+
+            batch = _get_json(session, url, params, limiter=limiter)
+            if not batch:
+                break
+
+            pages.append(batch)
+            rows += len(batch)
+
+            # A short page means Binance has nothing older to give us
+            if len(batch) < page_size:
+                break
+
+            cursor = batch[0][0] - 1
+            if start_time is not None and cursor < start_time:
+                break
+    finally:
+        if own_session:
+            session.close()
+
+    data = [row for batch in reversed(pages) for row in batch]
+    df = pd.DataFrame(data, columns=KLINE_COLUMNS)
+    if not df.empty:
+        df = df.drop_duplicates(subset="open_time", keep="last")
+        if start_time is not None:
+            df = df[df["open_time"].astype("int64") >= start_time]
+        if limit is not None:
+            df = df.tail(limit)
+        df = df.reset_index(drop=True)
+    return df
+
+
+def fetch_many(symbols, intervals=("1d",), start_time=None, end_time=None, limit=None,
+               max_workers=8, base_url=BASE_URL, weight_limit=6000):
+    """
+    Fetches every (symbol, interval) pair concurrently over one pooled session.
+    Returns {(symbol, interval): DataFrame}; failed pairs map to None.
+    """
+    if isinstance(symbols, str):
+        symbols = [symbols]
+    if isinstance(intervals, str):
+        intervals = [intervals]
+
+    jobs = [(s, i) for s in symbols for i in intervals]
+    session = create_session(pool_size=max_workers)
+    limiter = RateLimiter(weight_limit=weight_limit)
+    results = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(fetch_klines, s, i, start_time, end_time, limit,
+                            session, base_url, limiter): (s, i)
+                for s, i in jobs
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    print(f"❌ Error fetching {key[0]} {key[1]}: {e}")
+                    results[key] = None
+    finally:
+        session.close()
+
+    return results
+
+
+def fetch_top_symbols(quote="USDT", n=300, session=None, base_url=BASE_URL):
+    """
+    The `n` most traded `quote` pairs over the last 24h (by quote volume),
+    from a single ticker request.
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(pool_size=1)
+    try:
+        tickers = _get_json(session, f"{base_url}{TICKER_ENDPOINT}", {})
+    finally:
+        if own_session:
+            session.close()
+
+    pairs = [t for t in tickers if t["symbol"].endswith(quote) and float(t.get("quoteVolume", 0)) > 0]
+    pairs.sort(key=lambda t: float(t["quoteVolume"]), reverse=True)
+    return [t["symbol"] for t in pairs[:n]]
+
+
+# --- RESUMABLE LOCAL STORE ---
+
+def update_klines(symbol="BTCUSDT", interval="1h", start_time=None,
+                  session=None, base_url=BASE_URL, limiter=None):
+    """
+    Brings the kline store (see kline_store.py) up to date for one
+    symbol/interval, downloading only the candles after the last stored
+    open_time and appending them. Only closed candles are stored, so the
+    tail never needs rewriting.
+
+    start_time (ms) is used for the very first download; without it the
+    full history since listing is pulled.
+    Returns the number of rows appended.
+    """
+    last = kline_store.last_open_time(symbol, interval)
+    if last is not None:
+        last_ms = int(last.value // 1_000_000)
+        start_time = last_ms + INTERVAL_MS[interval]
+
+    df = fetch_klines(symbol, interval, start_time=start_time, session=session,
+                      base_url=base_url, limiter=limiter)
+
+    # Drop the still-forming candle
+    now_ms = int(time.time() * 1000)
+    df = df[df["close_time"].astype("int64") < now_ms]
+
+    if df.empty:
+        print(f"   {symbol} {interval}: already up to date.")
+        return 0
+
+    appended = kline_store.append_klines(df, symbol, interval)
+    print(f"✅ {symbol} {interval}: appended {appended} rows")
+    return appended
+
+
+def update_many(symbols, intervals=("1h",), start_time=None, max_workers=8, base_url=BASE_URL, weight_limit=6000):
+    """
+    Runs update_klines for every (symbol, interval) pair concurrently.
+    Returns {(symbol, interval): rows appended}; failed pairs map to None.
+    """
+    if isinstance(symbols, str):
+        symbols = [symbols]
+    if isinstance(intervals, str):
+        intervals = [intervals]
+
+    jobs = [(s, i) for s in symbols for i in intervals]
+    session = create_session(pool_size=max_workers)
+    limiter = RateLimiter(weight_limit=weight_limit)
+    results = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(update_klines, s, i, start_time,
+                            session, base_url, limiter): (s, i)
+                for s, i in jobs
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    print(f"❌ Error updating {key[0]} {key[1]}: {e}")
+                    results[key] = None
+    finally:
+        session.close()
+
+    return results
+
+
+@instrumentation.timed("stage.fetch")
+def fetch_binance_data(symbol="BTCUSDT", interval="1d", limit=1000, base_url=BASE_URL):
     """
     Fetches historical kline data from Binance and saves it to data/raw.
+    Limits above 1000 rows are fetched page by page.
     """
     print(f"Fetching {limit} rows of {interval} data for {symbol}...")
-    
-    url = "https://api.binance.com/api/v3/klines"
-    params = {
-        "symbol": symbol,
-        "interval": interval,
-        "limit": limit
-    }
-    
+
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        
-        cols = [
-            "open_time", "open", "high", "low", "close", "volume",
-            "close_time", "quote_asset_volume", "num_trades",
-            "taker_base_volume", "taker_quote_volume", "ignore"
-        ]
-        
-        df = pd.DataFrame(data, columns=cols)
-        
-        # --- ROBUST PATH FIX ---
-        # 1. Get the folder where THIS script (data_fetcher.py) lives (src/)
-        current_script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # 2. Go up one level to the project root (Crypto_Classifier/)
-        project_root = os.path.dirname(current_script_dir)
-        
-        # 3. Construct the path to data/raw
-        output_dir = os.path.join(project_root, 'data', 'raw')
-        
-        # 4. Create directory if it doesn't exist
+        df = fetch_klines(symbol, interval, limit=limit, base_url=base_url)
+
+        output_dir = os.path.join(kline_store.data_dir(), 'raw')
         os.makedirs(output_dir, exist_ok=True)
-        # -----------------------
 
         output_path = os.path.join(output_dir, "raw_data.csv")
-        df.to_csv(output_path, index=False)
+        with instrumentation.span("fetch.write_csv"):
+            df.to_csv(output_path, index=False)
         print(f"✅ Data saved to {output_path}")
         return df
-        
+
     except Exception as e:
         print(f"❌ Error fetching data: {e}")
         return None
 
 if __name__ == "__main__":
     fetch_binance_data()
-
-
@@ -1,22 +1,29 @@
 import pandas as pd
+import numpy as np
 import os
+import instrumentation
+import integrity
+import kline_store
+import resample
 
-def clean_raw_data():
+@instrumentation.timed("stage.process")
+def clean_raw_data(chunksize=None, lean=False, gap_policy="ffill", interval=None):
     """
     Reads 'raw_data.csv', converts data types (timestamps & floats),
-    and saves the clean version to 'data/processed/processed_data.csv'.
+    and saves the clean, typed version to 'data/processed/processed_data.parquet'.
+
+    Rows are sorted by open_time and deduplicated, and missing candles
+    are handled by gap_policy (integrity.py): "ffill" inserts flat
+    candles, "report" only counts them. interval defaults to the bar
+    spacing of the data.
+
+    chunksize: process the CSV this many rows at a time (out of core,
+    memory stays O(chunksize)); returns the number of rows written.
+    lean: float32/int32 columns and a categorical symbol column (see
+    kline_store.downcast).
     """
-    # --- 1. ROBUST PATH SETUP ---
-    # Get the directory where THIS script is located (src/)
-    current_script_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Go up one level to the project root (Crypto_Classifier/)
-    project_root = os.path.dirname(current_script_dir)
-    
-    # Define Input and Output paths based on the project root
-    raw_path = os.path.join(project_root, 'data', 'raw', 'raw_data.csv')
-    processed_dir = os.path.join(project_root, 'data', 'processed')
-    output_path = os.path.join(processed_dir, 'processed_data.csv')
+    # --- 1. PATH SETUP ---
+    raw_path = os.path.join(kline_store.data_dir(), 'raw', 'raw_data.csv')
 
     print(f"Reading raw data from: {raw_path}")
 
@@ -26,37 +33,38 @@ def clean_raw_data():
         print("Please run data_fetcher.py first.")
         return None
 
+    if gap_policy == "refetch":
+        raise ValueError("raw_data.csv has no symbol to refetch; use clean_store_data")
+    integrity._check_policy(gap_policy)
+
+    if chunksize:
+        return _clean_chunked(raw_path, chunksize, lean, gap_policy, interval)
+
     # --- 2. LOAD DATA ---
-    df = pd.read_csv(raw_path)
+    with instrumentation.span("process.read_csv"):
+        df = pd.read_csv(raw_path)
 
     # --- 3. CLEANING (Type Conversion) ---
     print("Cleaning data types...")
 
-    # Convert timestamps (ms to datetime)
-    if 'open_time' in df.columns:
-        df["open_time"] = pd.to_datetime(df["open_time"], unit='ms')
-    if 'close_time' in df.columns:
-        df["close_time"] = pd.to_datetime(df["close_time"], unit='ms')
-
-    # Convert numeric columns to floats (handling errors)
-    potential_numeric_cols = [
-        "open", "high", "low", "close", "volume",
-        "quote_asset_volume", "num_trades", 
-        "taker_base_volume", "taker_quote_volume", "ignore"
-    ]
-
-    for col in potential_numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+    # Timestamps (ms -> datetime) and numeric columns (-> floats)
+    with instrumentation.span("process.coerce_types"):
+        kline_store.coerce_kline_types(df)
 
     # Remove any completely empty rows
     df.dropna(how='all', inplace=True)
 
+    # Overlapping fetches / holes would shift the rolling windows
+    with instrumentation.span("process.integrity"):
+        df, report = integrity.repair(df, interval, policy=gap_policy)
+    print(f"   Integrity: {integrity.summary(report)}")
+    if lean:
+        kline_store.downcast(df)
+
     # --- 4. SAVE ---
-    # Create the folder if it doesn't exist (Crucial fix!)
-    os.makedirs(processed_dir, exist_ok=True)
-    
-    df.to_csv(output_path, index=False)
+    # Parquet keeps the dtypes, so later stages don't have to re-parse
+    with instrumentation.span("process.write_parquet"):
+        output_path = kline_store.write_stage(df, "processed")
     
     print(f"✅ Successfully cleaned data.")
     print(f"   Rows: {len(df)}")
@@ -64,5 +72,98 @@ def clean_raw_data():
     
     return df
 
+def _clean_chunked(raw_path, chunksize, lean, gap_policy, interval):
+    # The C parser produces the final float dtype directly, so no float64 copy is made
+    float_dtype = np.float32 if lean else np.float64
+    dtypes = {c: float_dtype for c in kline_store.FLOAT_COLS}
+    if lean:
+        dtypes["symbol"] = "category"
+    print(f"Cleaning in chunks of {chunksize:,} rows...")
+
+    def typed_chunks():
+        for df in pd.read_csv(raw_path, chunksize=chunksize, dtype=dtypes):
+            with instrumentation.span("process.coerce_types"):
+                kline_store.coerce_kline_types(df)
+                df.dropna(how='all', inplace=True)
+            yield df
+
+    report = {}
+    with kline_store.StageWriter("processed") as writer:
+        for df in integrity.repair_chunks(typed_chunks(), interval, gap_policy, report=report):
+            if lean:
+                kline_store.downcast(df)
+            with instrumentation.span("process.write_parquet"):
+                writer.write(df)
+
+    print(f"✅ Successfully cleaned data.")
+    print(f"   Integrity: {integrity.summary(report)}")
+    print(f"   Rows: {writer.rows}")
+    print(f"   Saved to: {writer.path}")
+    return writer.rows
+
+def clean_store_data(symbols, interval="1m", start=None, end=None, lean=True, base_interval=None,
+                     gap_policy="ffill"):
+    """
+    Builds the processed stage from the partitioned kline store (see
+    data_fetcher.update_many) for many symbols, one month partition at a
+    time, so memory is bounded by a month of one symbol. Rows are stored
+    symbol by symbol with a categorical `symbol` column.
+    base_interval (e.g. "1m") builds `interval` candles from the stored
+    base klines instead (resample.py, cached), so one download serves
+    every timeframe.
+    The stored partitions are validated first (integrity.check_store,
+    unchanged months are skipped); gap_policy="refetch" downloads the
+    gaps into the store, and remaining ones are forward-filled (unless
+    "report") in the rows written, never in the store.
+    Returns the number of rows written.
+    """
+    symbols = [s.upper() for s in symbols]
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    source = f"resampled from {base_interval}" if base_interval and base_interval != interval else "kline store"
+    integrity._check_policy(gap_policy)
+    fill_policy = "report" if gap_policy == "report" else "ffill"
+    print(f"Building processed data for {len(symbols)} symbols ({interval}) from the {source}...")
+
+    report = {}
+    with kline_store.StageWriter("processed") as writer:
+        for symbol in symbols:
+            stored_interval = base_interval or interval
+            integrity.check_store(symbol, stored_interval,
+                                  policy="refetch" if gap_policy == "refetch" else "report")
+            if base_interval and base_interval != interval:
+                # Derived candles are base/step times fewer rows: one chunk per symbol
+                df = resample.resampled_klines(symbol, interval, base_interval, start=start, end=end)
+                if len(df):
+                    df, part = integrity.repair(df, interval, policy=fill_policy)
+                    integrity._add_report(report, part)
+                    df.insert(0, "symbol", pd.Categorical([symbol] * len(df), categories=symbols))
+                    if lean:
+                        kline_store.downcast(df)
+                    writer.write(df)
+                continue
+            for df in integrity.repair_chunks(_store_months(symbol, interval, start, end), interval,
+                                              fill_policy, report=report):
+                if df.empty:
+                    continue
+                # Fixed categories, so every chunk stores the same dictionary
+                df.insert(0, "symbol", pd.Categorical([symbol] * len(df), categories=symbols))
+                if lean:
+                    kline_store.downcast(df)
+                writer.write(df)
+
+    print(f"✅ Processed {writer.rows} rows to {writer.path}")
+    print(f"   Integrity: {integrity.summary(report)}")
+    return writer.rows
+
+def _store_months(symbol, interval, start, end):
+    # One month partition of the store at a time, clipped to [start, end)
+    for month in kline_store.list_months(symbol, interval):
+        lo, hi = pd.Period(month, "M").start_time, (pd.Period(month, "M") + 1).start_time
+        if (end is not None and lo >= end) or (start is not None and hi <= start):
+            continue
+        yield kline_store.read_klines(symbol, interval, start=max(lo, start) if start is not None else lo,
+                                      end=min(hi, end) if end is not None else hi)
+
 if __name__ == "__main__":
     clean_raw_data()
\ No newline at end of file
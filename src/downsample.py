@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+# Server-side chart reduction. A browser can draw a couple of thousand
+# candles smoothly; for long (minute) histories the visible range is cut
+# down here before it is sent to Plotly: candles by OHLC aggregation
+# (every bucket is an exact candle of its bars), lines by LTTB (keeps
+# their visual shape), signals by keeping the most confident one per
+# bucket.
+
+MAX_CANDLES = 1500
+MAX_LINE_POINTS = 3000
+
+
+def visible(df, start=None, end=None, time_col="open_time"):
+    """
+    Rows with start <= time <= end (df sorted by time), without copying
+    the frame. Also returns the position of the first row, so buckets can
+    stay aligned to the full history while the range moves.
+    """
+    times = df[time_col].to_numpy()
+    lo = np.searchsorted(times, np.datetime64(start), side="left") if start is not None else 0
+    hi = np.searchsorted(times, np.datetime64(end), side="right") if end is not None else len(df)
+    return df.iloc[lo:hi], int(lo)
+
+
+def bucket_starts(n, max_points, offset=0):
+    """
+    Start positions of fixed-size buckets covering n rows, at most about
+    max_points of them. Buckets are aligned to multiples of the step in
+    the full history (`offset` = position of row 0), so panning does not
+    reshuffle them.
+    """
+    step = max(1, int(np.ceil(n / max_points)))
+    first = (-offset) % step
+    starts = np.arange(first, n, step)
+    if first:
+        starts = np.concatenate([[0], starts])
+    return starts, step
+
+
+def ohlc_buckets(df, max_bars=MAX_CANDLES, offset=0, time_col="open_time"):
+    """
+    Aggregates consecutive candles into at most ~max_bars candles: first
+    open, highest high, lowest low, last close, summed volume, stamped
+    with the first bar's time. Small frames are returned unchanged.
+    """
+    n = len(df)
+    if n <= max_bars:
+        return df
+    starts, _ = bucket_starts(n, max_bars, offset)
+    ends = np.append(starts[1:], n) - 1
+    out = {
+        time_col: df[time_col].to_numpy()[starts],
+        "open": df["open"].to_numpy()[starts],
+        "high": np.maximum.reduceat(df["high"].to_numpy(), starts),
+        "low": np.minimum.reduceat(df["low"].to_numpy(), starts),
+        "close": df["close"].to_numpy()[ends],
+    }
+    if "volume" in df.columns:
+        out["volume"] = np.add.reduceat(df["volume"].to_numpy(), starts)
+    return pd.DataFrame(out)
+
+
+def lttb(x, y, n_out=MAX_LINE_POINTS):
+    """
+    Largest-Triangle-Three-Buckets: indices of n_out points that keep the
+    visual shape of the line (x, y), always including the first and last
+    point. x may be datetimes. NaN points are never picked while a bucket
+    has a real value.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x)
+    x = x.astype("datetime64[ns]").astype(np.int64).astype(np.float64) if np.issubdtype(x.dtype, np.datetime64) \
+        else x.astype(np.float64)
+
+    # n_out - 2 buckets [edges[i], edges[i+1]) between the fixed first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts = edges[:-1]
+    valid = ~np.isnan(y)
+    mean_x = np.add.reduceat(x[:n - 1], starts) / np.diff(edges)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_y = (np.add.reduceat(np.where(valid, y, 0.0)[:n - 1], starts)
+                  / np.add.reduceat(valid[:n - 1].astype(np.float64), starts))
+    # Third triangle corner for bucket i: the next bucket's mean, or the last point
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - next_x[i]) * (by - y[a]) - (x[a] - bx) * (next_y[i] - y[a]))
+        best = np.nanargmax(area) if not np.all(np.isnan(area)) else 0
+        a = lo + int(best)
+        picked[i + 1] = a
+    return picked
+
+
+def line(df, column, n_out=MAX_LINE_POINTS, time_col="open_time"):
+    """
+    (times, values) of one series reduced with LTTB.
+    """
+    idx = lttb(df[time_col].to_numpy(), df[column].to_numpy(), n_out)
+    return df[time_col].to_numpy()[idx], df[column].to_numpy()[idx]
+
+
+def thin_signals(df, max_points=MAX_CANDLES, offset=0, label_col="prediction_text", keep=("BUY", "SELL")):
+    """
+    Signal rows to mark on the chart: per bucket (same buckets as
+    ohlc_buckets) and label, only the most confident one.
+    """
+    signals = df[df[label_col].isin(keep)]
+    if len(df) <= max_points or signals.empty:
+        return signals
+    starts, _ = bucket_starts(len(df), max_points, offset)
+    positions = np.flatnonzero(df[label_col].isin(keep).to_numpy())
+    bucket = np.searchsorted(starts, positions, side="right") - 1
+    best = (pd.DataFrame({"bucket": bucket, "label": signals[label_col].to_numpy(),
+                          "confidence": signals["confidence"].to_numpy(), "pos": positions})
+            .sort_values("confidence", ascending=False, kind="stable")
+            .drop_duplicates(["bucket", "label"]))
+    return df.iloc[np.sort(best["pos"].to_numpy())]
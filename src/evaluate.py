@@ -1,34 +1,186 @@
-
-import pandas as pd
 import numpy as np
 import os
-import joblib
-import shutil
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import instrumentation
+import kline_store
+import features
+import predict
+import backtest
+import export
+from sklearn.metrics import accuracy_score, classification_report, confusion_matrix, log_loss
+from threadpoolctl import threadpool_limits
+
+CLASSES = [0, 1, 2]
+TARGET_NAMES = ['SELL', 'HOLD', 'BUY']
+
+# Bump when the metric set changes so old cache entries are ignored
+CACHE_VERSION = 1
+
+
+# --- RESULT CACHE ---
+# One entry per (model file hash, test data fingerprint): metrics as JSON
+# plus the predicted labels as .npy. Unchanged models are never rescored.
+
+def cache_dir():
+    return os.path.join(kline_store.data_dir(), 'eval_cache')
+
+
+def _sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def model_hash(path):
+    """
+    sha256 of a model file. Hashes are remembered per (mtime, size, inode),
+    so an untouched file is not read again.
+    """
+    index_path = os.path.join(cache_dir(), 'model_hashes.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = {}
+
+    st = os.stat(path)
+    signature = [st.st_mtime_ns, st.st_size, st.st_ino]
+    entry = index.get(path)
+    if entry and entry[:3] == signature:
+        return entry[3]
+
+    digest = _sha256(path)
+    index[path] = signature + [digest]
+    _write_json(index_path, index)
+    return digest
+
+
+def data_fingerprint(X_test, y_test, prices, **params):
+    """
+    Hash of everything a score depends on besides the model: the test
+    features, labels, prices and the evaluation parameters.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps({"version": CACHE_VERSION, "columns": list(X_test.columns), **params},
+                        sort_keys=True).encode())
+    for arr in (X_test.to_numpy(), y_test.to_numpy(), prices.to_numpy()):
+        arr = np.ascontiguousarray(arr)
+        h.update(str((arr.shape, arr.dtype.str)).encode())
+        h.update(arr.data)
+    return h.hexdigest()
+
+
+def _write_json(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def _cache_paths(key):
+    base = os.path.join(cache_dir(), key)
+    return base + '.json', base + '.npy'
+
+
+def load_cached(key):
+    json_path, preds_path = _cache_paths(key)
+    try:
+        with open(json_path) as f:
+            metrics = json.load(f)
+        return metrics, np.load(preds_path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def store_cached(key, metrics, preds):
+    json_path, preds_path = _cache_paths(key)
+    os.makedirs(cache_dir(), exist_ok=True)
+    tmp_path = f"{preds_path}.tmp.{os.getpid()}.npy"
+    np.save(tmp_path, np.asarray(preds, dtype=np.int8))
+    os.replace(tmp_path, preds_path)
+    # The JSON is written last: its presence marks a complete entry
+    _write_json(json_path, metrics)
+
+
+# --- SCORING ---
+
+_test = {}
 
-def evaluate_models():
-    # --- 1. SETUP ---
-    current_script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(current_script_dir)
 
-    data_path = os.path.join(project_root, 'data', 'labeled', 'labeled_data.csv')
-    model_dir = os.path.join(project_root, 'models')
+def _init_worker(X_test, y_test, prices, ppy, fee, slippage, n_threads):
+    _test.update(X=X_test, y=y_test, prices=prices, ppy=ppy, fee=fee, slippage=slippage, threads=n_threads)
+
+
+def score_model(model_name):
+    """
+    Full metric set for one model on the test window held in _test:
+    accuracy, log-loss, per-class report, confusion matrix and the
+    after-cost backtest. Returns (metrics, predicted labels).
+    """
+    with threadpool_limits(limits=_test["threads"]):
+        model = predict.load_model(model_name, use_cache=False)
+        preds, confidence, probs = predict.score_matrix(model, _test["X"])
+
+    y_test = _test["y"]
+    scored = _test["prices"].assign(predicted_label=preds, confidence=confidence)
+    bt = backtest.sweep(scored, fees=[_test["fee"]], slippages=[_test["slippage"]], ppy=_test["ppy"]).iloc[0]
+
+    metrics = {
+        "accuracy": float(accuracy_score(y_test, preds)),
+        "log_loss": float(log_loss(y_test, probs, labels=CLASSES)),
+        "report": classification_report(y_test, preds, labels=CLASSES, target_names=TARGET_NAMES,
+                                        output_dict=True, zero_division=0),
+        "confusion_matrix": confusion_matrix(y_test, preds, labels=CLASSES).tolist(),
+        "sharpe": float(bt['sharpe']),
+        "max_drawdown": float(bt['max_drawdown']),
+        "total_return": float(bt['total_return']),
+    }
+    return metrics, preds
+
+
+def _score_worker(model_name):
+    try:
+        metrics, preds = score_model(model_name)
+        return model_name, metrics, preds, None
+    except Exception as e:
+        return model_name, None, None, f"{type(e).__name__}: {e}"
+
+
+@instrumentation.timed("stage.evaluate")
+def evaluate_models(rank_by="accuracy", fee=0.001, slippage=0.0005, use_cache=True, max_workers=None):
+    """
+    Scores every saved model on the last 15% of the data and publishes the
+    winner. rank_by="sharpe" picks the model with the best after-cost
+    Sharpe ratio (see backtest.py) instead of the best accuracy.
+
+    Results are cached on disk by model hash + test data fingerprint, so
+    only new or retrained models are scored; those run in parallel, one
+    process per model.
+    """
+    # --- 1. SETUP ---
+    model_dir = predict._model_dir()
 
     print(" Starting Model Evaluation Arena...")
 
     # --- 2. PREPARE TEST DATA ---
-    if not os.path.exists(data_path):
-        print(f" Error: Data not found at {data_path}")
+    # Same columns (and so the same NaN rows) as train.labeled_model_columns
+    feature_cols = features.MODEL_COLUMNS + [c for c in kline_store.stage_columns("labeled") or []
+                                             if features.timeframe_column(c) is not None]
+    df = kline_store.read_stage("labeled", columns=['open_time'] + feature_cols + ['label'])
+    if df is None:
+        print(f" Error: Data not found at {kline_store.stage_path('labeled')}")
         # FIX: Return 3 Nones so the notebook doesn't crash
         return None, None, None
 
-    df = pd.read_csv(data_path)
     df.dropna(inplace=True)
 
-    drop_cols = ['open_time', 'close_time', 'ignore', 'future_return', 'label', 'threshold_buy', 'threshold_sell']
-    feature_cols = [c for c in df.columns if c not in drop_cols]
+    # Fixed column order shared with serving (see features.py); each
+    # model takes its own columns from the frame (predict.model_columns)
 
     X = df[feature_cols]
     y = df['label']
@@ -36,68 +188,113 @@ def evaluate_models():
     test_start = int(len(df) * 0.85)
     X_test = X.iloc[test_start:]
     y_test = y.iloc[test_start:]
+    prices = df.iloc[test_start:][['open', 'close']]
+    ppy = backtest.periods_per_year(df)
 
     print(f"   Testing on {len(X_test)} rows (Last 15%)\n")
 
-    # --- 3. EVALUATION LOOP ---
-    best_acc = -1
-    best_model_name = None
-    best_preds = None
-
     # Check if directory exists
     if not os.path.exists(model_dir):
         print(f" Error: Models folder not found at {model_dir}")
         return None, None, None
 
-    model_files = [f for f in os.listdir(model_dir) if f.endswith('.pkl') and f != 'best_crypto_model.pkl']
+    model_files = sorted(f for f in os.listdir(model_dir) if f.endswith('.pkl') and f != 'best_crypto_model.pkl')
 
     if not model_files:
         print(" No models found! Run train.py first.")
         # FIX: Return 3 Nones
         return None, None, None
 
-    print(f"{'MODEL':<20} | {'ACCURACY':<10}")
-    print("-" * 35)
-
+    # --- 3. CACHE LOOKUP ---
+    fingerprint = data_fingerprint(X_test, y_test, prices, fee=fee, slippage=slippage, ppy=ppy)
+    results, keys, pending = {}, {}, []
     for filename in model_files:
         model_name = filename.replace('.pkl', '')
-        model_path = os.path.join(model_dir, filename)
+        keys[model_name] = f"{model_hash(os.path.join(model_dir, filename))[:32]}-{fingerprint[:32]}"
+        cached = load_cached(keys[model_name]) if use_cache else None
+        if cached is not None:
+            results[model_name] = cached
+        else:
+            pending.append(model_name)
+
+    print(f"   {len(results)} cached, {len(pending)} to score")
+
+    # --- 4. SCORE NEW / CHANGED MODELS ---
+    cores = os.cpu_count() or 1
+    workers = min(len(pending), max_workers or cores)
+    errors = {}
+
+    def collect(model_name, metrics, preds, error):
+        if error:
+            errors[model_name] = error
+            return
+        results[model_name] = (metrics, preds)
+        store_cached(keys[model_name], metrics, preds)
+
+    if workers > 1:
+        initargs = (X_test, y_test, prices, ppy, fee, slippage, max(1, cores // workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+            for future in as_completed([pool.submit(_score_worker, name) for name in pending]):
+                collect(*future.result())
+    elif pending:
+        _init_worker(X_test, y_test, prices, ppy, fee, slippage, cores)
+        for model_name in pending:
+            collect(*_score_worker(model_name))
 
-        try:
-            model = joblib.load(model_path)
-            preds = model.predict(X_test)
-            acc = accuracy_score(y_test, preds)
+    # --- 5. LEADERBOARD ---
+    print(f"\n{'MODEL':<20} | {'ACCURACY':<10} | {'LOG-LOSS':<9} | {'SHARPE':<8} | {'MAX DD':<8}")
+    print("-" * 69)
 
-            print(f"{model_name:<20} | {acc:.4f}")
+    best_score = -np.inf
+    best_acc = -1
+    best_model_name = None
+    best_preds = None
 
-            if acc > best_acc:
-                best_acc = acc
-                best_model_name = model_name
-                best_preds = preds
+    for model_name in (n.replace('.pkl', '') for n in model_files):
+        if model_name in errors:
+            print(f" Error evaluating {model_name}: {errors[model_name]}")
+            continue
+        metrics, preds = results[model_name]
+        print(f"{model_name:<20} | {metrics['accuracy']:<10.4f} | {metrics['log_loss']:<9.4f} | "
+              f"{metrics['sharpe']:<8.2f} | {metrics['max_drawdown']:<8.2%}")
 
-        except Exception as e:
-            print(f" Error loading {model_name}: {e}")
+        score = metrics['sharpe'] if rank_by == "sharpe" else metrics['accuracy']
+        if score > best_score:
+            best_score = score
+            best_acc = metrics['accuracy']
+            best_model_name = model_name
+            best_preds = preds
 
-    # --- 4. SHOW WINNER ---
+    # --- 6. SHOW WINNER ---
     if best_model_name is None:
         print(" No valid models could be evaluated.")
         return None, None, None
 
-    print("-" * 35)
-    print(f" WINNER: {best_model_name} (Accuracy: {best_acc:.4f})")
+    print("-" * 69)
+    if rank_by == "sharpe":
+        print(f" WINNER: {best_model_name} (Sharpe: {best_score:.2f}, Accuracy: {best_acc:.4f})")
+    else:
+        print(f" WINNER: {best_model_name} (Accuracy: {best_acc:.4f})")
 
-    # --- 5. SAVE BEST MODEL ---
-    src_file = os.path.join(model_dir, f"{best_model_name}.pkl")
-    dst_file = os.path.join(model_dir, "best_crypto_model.pkl")
+    # --- 7. SAVE BEST MODEL ---
     try:
-        shutil.copyfile(src_file, dst_file)
+        # Atomic replace: the app/service never load a half-copied file
+        dst_file = predict.publish_model(best_model_name, "best_crypto_model")
         print(f" Copied winner to: {dst_file}")
     except Exception as e:
         print(f" Could not copy best model: {e}")
 
-    # --- 6. TEXT REPORT ---
+    # Portable array copy for fast loading / per-row scoring (see export.py),
+    # kept only if it scores the test rows like the pickle
+    try:
+        npz_file, parity = export.export_verified("best_crypto_model", X_test)
+        print(f" Exported winner to: {npz_file} (max prob. diff {parity['max_abs_diff']:.2g})")
+    except Exception as e:
+        print(f" Could not export best model (serving the pickle): {e}")
+
+    # --- 8. TEXT REPORT ---
     print("\n Classification Report (Winner):")
-    print(classification_report(y_test, best_preds, target_names=['SELL', 'HOLD', 'BUY']))
+    print(classification_report(y_test, best_preds, labels=CLASSES, target_names=TARGET_NAMES, zero_division=0))
 
     return best_model_name, y_test, best_preds
 
@@ -105,6 +302,9 @@ if __name__ == "__main__":
     winner_name, y_true, y_pred = evaluate_models()
 
     if winner_name is not None:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         print("\n Generating Confusion Matrix Plot...")
         cm = confusion_matrix(y_true, y_pred)
         plt.figure(figsize=(7, 5))
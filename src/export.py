@@ -0,0 +1,452 @@
+import json
+import os
+import time
+
+import numpy as np
+
+import features
+import predict
+
+# Portable inference format: every supported model is flattened into
+# plain NumPy arrays saved as models/<name>.npz, and evaluated here with
+# vectorized array code. Loading is a few np.load calls instead of an
+# unpickle, no ML library has to be installed (or match versions) at
+# serving time, and there is no per-call Python object overhead.
+#
+#   trees      binary trees (RandomForest, XGBoost, LightGBM): one flat
+#              node table, leaves loop onto themselves
+#   oblivious  symmetric trees (CatBoost): one split per level
+#   linear     LogisticRegression
+
+FORMAT_VERSION = 1
+
+# Rows x trees evaluated per step; bounds the evaluator's temporaries
+CHUNK_CELLS = 1 << 20
+
+
+def _softmax(z):
+    z = z - z.max(axis=1, keepdims=True)
+    np.exp(z, out=z)
+    z /= z.sum(axis=1, keepdims=True)
+    return z
+
+
+# --- EVALUATOR ---
+
+class ExportedModel:
+    """
+    Array-based model with the sklearn prediction interface
+    (predict_proba / predict / classes_), so predict.score_matrix and
+    everything built on it work unchanged.
+    """
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self.kind = meta["kind"]
+        self.output = meta["output"]
+        self.classes_ = np.asarray(arrays["classes"])
+        self.feature_names_in_ = np.asarray(meta["feature_names"], dtype=object)
+        self.n_features_in_ = len(meta["feature_names"])
+
+    # Storage
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.{os.getpid()}.npz"
+        np.savez(tmp_path, meta=np.array(json.dumps(self.meta)), **self.arrays)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as data:
+            arrays = {k: data[k] for k in data.files if k != "meta"}
+            meta = json.loads(str(data["meta"]))
+        if meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported export format: {meta.get('format_version')}")
+        return cls(arrays, meta)
+
+    # Inference
+
+    def decision_function(self, X):
+        X = np.asarray(getattr(X, "values", X), dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        if self.kind == "linear":
+            return X.astype(np.float64) @ self.arrays["coef"].T + self.arrays["intercept"]
+        return self._raw(X) + self.arrays["bias"]
+
+    def predict_proba(self, X):
+        z = self.decision_function(X)
+        if self.output == "softmax":
+            return _softmax(z)
+        if self.output == "ovr":
+            p = 1.0 / (1.0 + np.exp(-z))
+            return p / p.sum(axis=1, keepdims=True)
+        # "mean": the trees already hold averaged class probabilities
+        return z
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def _raw(self, X):
+        return self._trees(X) if self.kind == "trees" else self._oblivious(X)
+
+    def _trees(self, X):
+        a = self.arrays
+        roots, strict = a["roots"], self.meta["strict"]
+        feature, threshold, left, right = a["feature"], a["threshold"], a["left"], a["right"]
+        is_leaf = left == np.arange(len(left))
+        n_trees, n_features = len(roots), X.shape[1]
+        out = np.zeros((len(X), a["value"].shape[1]))
+        step = max(1, CHUNK_CELLS // max(1, n_trees))
+
+        for start in range(0, len(X), step):
+            x = X[start:start + step].astype(np.float64)
+            has_nan = bool(np.isnan(x).any())
+            x = x.ravel()
+            # One cell per (row, tree); only cells not yet at a leaf move on
+            node = np.tile(roots, len(x) // n_features)
+            offset = np.repeat(np.arange(0, len(x), n_features), n_trees)
+            active = np.flatnonzero(~is_leaf[node])
+            while active.size:
+                n = node[active]
+                v = x[offset[active] + feature[n]]
+                if has_nan:
+                    missing = np.isnan(v)
+                    v = np.where(missing & a["nan_as_zero"][n], 0.0, v)
+                go_left = (v < threshold[n]) if strict else (v <= threshold[n])
+                if has_nan:
+                    go_left = np.where(missing & ~a["nan_as_zero"][n], a["default_left"][n], go_left)
+                n = np.where(go_left, left[n], right[n])
+                node[active] = n
+                active = active[~is_leaf[n]]
+            # value rows are zero except in the column the tree votes for
+            out[start:start + step] = a["value"][node].reshape(-1, n_trees, out.shape[1]).sum(axis=1)
+        return out
+
+    def _oblivious(self, X):
+        a = self.arrays
+        feature, border, leaves = a["split_feature"], a["border"], a["leaf_values"]
+        n_trees, depth = feature.shape
+        weights = (1 << np.arange(depth)).astype(np.int64)
+        out = np.zeros((len(X), leaves.shape[2]))
+        step = max(1, CHUNK_CELLS // max(1, n_trees * depth))
+        trees = np.arange(n_trees)
+
+        for start in range(0, len(X), step):
+            x = X[start:start + step]
+            bits = x[:, feature] > border
+            index = bits.astype(np.int64) @ weights
+            out[start:start + step] = leaves[trees, index].sum(axis=1)
+        return out * self.meta.get("scale", 1.0)
+
+
+# --- CONVERTERS ---
+
+def _flatten_nodes(trees, n_out):
+    """
+    Stacks per-tree node lists (dicts with feature, threshold, left,
+    right, default_left, nan_as_zero, value, class) into one table with
+    global indices. Leaves point at themselves.
+    """
+    cols = {k: [] for k in ("feature", "threshold", "left", "right", "default_left", "nan_as_zero")}
+    values, roots = [], []
+    max_depth = 0
+    for nodes, depth in trees:
+        base = len(values)
+        roots.append(base)
+        max_depth = max(max_depth, depth)
+        for i, n in enumerate(nodes):
+            leaf = n["left"] < 0
+            cols["feature"].append(0 if leaf else n["feature"])
+            cols["threshold"].append(0.0 if leaf else n["threshold"])
+            cols["left"].append(base + (i if leaf else n["left"]))
+            cols["right"].append(base + (i if leaf else n["right"]))
+            cols["default_left"].append(bool(n.get("default_left", False)))
+            cols["nan_as_zero"].append(bool(n.get("nan_as_zero", False)))
+            row = np.zeros(n_out)
+            if leaf:
+                if n.get("class") is None:
+                    row[:] = n["value"]
+                else:
+                    row[n["class"]] = n["value"]
+            values.append(row)
+    return {
+        "roots": np.asarray(roots, dtype=np.int32),
+        "feature": np.asarray(cols["feature"], dtype=np.int32),
+        "threshold": np.asarray(cols["threshold"], dtype=np.float64),
+        "left": np.asarray(cols["left"], dtype=np.int32),
+        "right": np.asarray(cols["right"], dtype=np.int32),
+        "default_left": np.asarray(cols["default_left"], dtype=bool),
+        "nan_as_zero": np.asarray(cols["nan_as_zero"], dtype=bool),
+        "value": np.asarray(values, dtype=np.float64),
+    }, max_depth
+
+
+def _depth(left, right, node=0):
+    if left[node] < 0:
+        return 0
+    return 1 + max(_depth(left, right, left[node]), _depth(left, right, right[node]))
+
+
+def _convert_random_forest(model):
+    n_out = len(model.classes_)
+    trees = []
+    for est in model.estimators_:
+        t = est.tree_
+        proba = t.value[:, 0, :] / t.value[:, 0, :].sum(axis=1, keepdims=True)
+        missing_left = getattr(t, "missing_go_to_left", np.zeros(t.node_count, dtype=bool))
+        nodes = [{
+            "feature": int(t.feature[i]), "threshold": float(t.threshold[i]),
+            "left": int(t.children_left[i]), "right": int(t.children_right[i]),
+            "default_left": bool(missing_left[i]),
+            "value": proba[i] / len(model.estimators_), "class": None,
+        } for i in range(t.node_count)]
+        trees.append((nodes, int(t.max_depth)))
+    arrays, depth = _flatten_nodes(trees, n_out)
+    arrays["bias"] = np.zeros(n_out)
+    return arrays, {"kind": "trees", "output": "mean", "strict": False, "max_depth": depth}
+
+
+def _convert_xgboost(model):
+    booster = model.get_booster()
+    dump = json.loads(booster.save_raw("json"))["learner"]["gradient_booster"]["model"]
+    n_out = len(model.classes_)
+    trees = []
+    for tree, cls in zip(dump["trees"], dump["tree_info"]):
+        left, right = tree["left_children"], tree["right_children"]
+        nodes = [{
+            "feature": int(tree["split_indices"][i]), "threshold": float(np.float32(tree["split_conditions"][i])),
+            "left": int(left[i]), "right": int(right[i]), "default_left": bool(tree["default_left"][i]),
+            # On leaves split_conditions holds the leaf value
+            "value": float(tree["split_conditions"][i]), "class": int(cls),
+        } for i in range(len(left))]
+        trees.append((nodes, _depth(left, right)))
+    arrays, depth = _flatten_nodes(trees, n_out)
+    return arrays, {"kind": "trees", "output": "softmax", "strict": True, "max_depth": depth}
+
+
+def _convert_lightgbm(model):
+    dump = model.booster_.dump_model()
+    n_out = len(model.classes_)
+    per_iter = dump["num_tree_per_iteration"]
+    trees = []
+    for k, info in enumerate(dump["tree_info"]):
+        nodes = []
+
+        def visit(n):
+            i = len(nodes)
+            nodes.append(None)
+            if "leaf_value" in n or "split_feature" not in n:
+                nodes[i] = {"left": -1, "right": -1, "value": float(n.get("leaf_value", 0.0)),
+                            "class": k % per_iter}
+                return i, 0
+            if n["decision_type"] != "<=" or n.get("missing_type") == "Zero":
+                raise NotImplementedError("Categorical / zero-as-missing splits are not supported")
+            left, dl = visit(n["left_child"])
+            right, dr = visit(n["right_child"])
+            nodes[i] = {"feature": int(n["split_feature"]), "threshold": float(n["threshold"]),
+                        "left": left, "right": right, "default_left": bool(n["default_left"]),
+                        # missing_type None: LightGBM reads NaN as 0.0
+                        "nan_as_zero": n.get("missing_type") == "None"}
+            return i, 1 + max(dl, dr)
+
+        _, depth = visit(info["tree_structure"])
+        trees.append((nodes, depth))
+    arrays, depth = _flatten_nodes(trees, n_out)
+    return arrays, {"kind": "trees", "output": "softmax", "strict": False, "max_depth": depth}
+
+
+def _convert_catboost(model, tmp_dir):
+    path = os.path.join(tmp_dir, f".catboost_export.{os.getpid()}.json")
+    model.save_model(path, format="json")
+    try:
+        with open(path) as f:
+            dump = json.load(f)
+    finally:
+        os.remove(path)
+
+    flat = {f["feature_index"]: f["flat_feature_index"] for f in dump["features_info"]["float_features"]}
+    n_out = len(model.classes_)
+    trees = dump["oblivious_trees"]
+    depth = max(len(t["splits"]) for t in trees)
+
+    feature = np.zeros((len(trees), depth), dtype=np.int32)
+    # Padding levels compare against +inf, so their bit is always 0
+    border = np.full((len(trees), depth), np.inf, dtype=np.float32)
+    leaves = np.zeros((len(trees), 1 << depth, n_out))
+    for t, tree in enumerate(trees):
+        for d, split in enumerate(tree["splits"]):
+            if split.get("split_type", "FloatFeature") != "FloatFeature":
+                raise NotImplementedError("Only float feature splits are supported")
+            feature[t, d] = flat[split["float_feature_index"]]
+            border[t, d] = split["border"]
+        values = np.asarray(tree["leaf_values"], dtype=np.float64).reshape(-1, n_out)
+        leaves[t, :len(values)] = values
+
+    scale = float(dump.get("scale_and_bias", [1.0])[0])
+    arrays = {"split_feature": feature, "border": border, "leaf_values": leaves}
+    return arrays, {"kind": "oblivious", "output": "softmax", "max_depth": depth, "scale": scale}
+
+
+def _convert_logistic_regression(model):
+    output = "ovr" if getattr(model, "multi_class", None) == "ovr" else "softmax"
+    arrays = {"coef": np.asarray(model.coef_, dtype=np.float64),
+              "intercept": np.asarray(model.intercept_, dtype=np.float64)}
+    return arrays, {"kind": "linear", "output": output}
+
+
+def _raw_margin(model, X):
+    """
+    The library's own untransformed score, used to recover the constant
+    base margin (base_score, init scores, bias) whatever version wrote it.
+    """
+    name = type(model).__name__
+    if name == "XGBClassifier":
+        return model.predict(X, output_margin=True)
+    if name == "LGBMClassifier":
+        return model.predict(X, raw_score=True)
+    return model.predict(X, prediction_type="RawFormulaVal")
+
+
+def convert(model, tmp_dir="."):
+    """
+    Converts a fitted model into an ExportedModel. Supports
+    RandomForestClassifier, XGBClassifier, LGBMClassifier,
+    CatBoostClassifier and LogisticRegression (multi-class).
+    """
+    name = type(model).__name__
+    if name == "RandomForestClassifier":
+        arrays, meta = _convert_random_forest(model)
+    elif name == "XGBClassifier":
+        arrays, meta = _convert_xgboost(model)
+    elif name == "LGBMClassifier":
+        arrays, meta = _convert_lightgbm(model)
+    elif name == "CatBoostClassifier":
+        arrays, meta = _convert_catboost(model, tmp_dir)
+    elif name == "LogisticRegression":
+        arrays, meta = _convert_logistic_regression(model)
+    else:
+        raise NotImplementedError(f"No exporter for {name}")
+
+    if len(model.classes_) < 3:
+        raise NotImplementedError("Only multi-class models are supported")
+
+    arrays["classes"] = np.asarray(model.classes_)
+    meta.update({
+        "format_version": FORMAT_VERSION,
+        "source": name,
+        "feature_names": list(predict.model_columns(model)),
+    })
+    exported = ExportedModel(arrays, meta)
+
+    if meta["kind"] in ("trees", "oblivious") and meta["output"] == "softmax":
+        # Probe one row: bias = library margin - sum of the exported trees
+        probe = np.zeros((1, exported.n_features_in_), dtype=np.float32)
+        raw = exported._raw(probe)
+        exported.arrays["bias"] = np.asarray(_raw_margin(model, _as_frame(model, probe)),
+                                             dtype=np.float64).reshape(1, -1)[0] - raw[0]
+    return exported
+
+
+def _as_frame(model, X):
+    names = getattr(model, "feature_names_in_", None)
+    if names is None:
+        return X
+    import pandas as pd
+    return pd.DataFrame(X, columns=list(names))
+
+
+# --- PUBLIC API ---
+
+def export_path(model_name):
+    return os.path.splitext(predict._model_path(model_name))[0] + ".npz"
+
+
+def export_model(model_name="best_crypto_model"):
+    """
+    Converts models/<name>.pkl into models/<name>.npz (loaded with
+    predict.load_model("<name>.npz") or predict.load_fast_model).
+    """
+    model = predict.load_model(model_name, use_cache=False)
+    exported = convert(model, tmp_dir=os.path.dirname(export_path(model_name)))
+    exported.meta["exported_from"] = os.path.basename(predict._model_path(model_name))
+    return exported.save(export_path(model_name))
+
+
+def export_verified(model_name, X, atol=1e-6):
+    """
+    export_model() followed by check_parity() on X. A failing export is
+    deleted again (so load_fast_model keeps serving the pickle) and the
+    AssertionError re-raised. Returns (path, parity).
+    """
+    path = export_model(model_name)
+    try:
+        parity = check_parity(model_name, X, atol)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return path, parity
+
+
+def check_parity(model_name, X, atol=1e-6):
+    """
+    Compares the exported model with the pickle on X. Returns the max
+    absolute probability difference and the label agreement rate;
+    raises AssertionError beyond atol.
+    """
+    reference = predict.load_model(model_name, use_cache=False)
+    exported = ExportedModel.load(export_path(model_name))
+    _, _, p_ref = predict.score_matrix(reference, X)
+    _, _, p_exp = predict.score_matrix(exported, X)
+    diff = float(np.abs(p_ref - p_exp).max()) if len(X) else 0.0
+    agreement = float((p_ref.argmax(axis=1) == p_exp.argmax(axis=1)).mean()) if len(X) else 1.0
+    if diff > atol:
+        raise AssertionError(f"{model_name}: exported probabilities differ by {diff:.3g} (> {atol})")
+    return {"max_abs_diff": diff, "label_agreement": agreement}
+
+
+def benchmark(model_name, X, repeats=200):
+    """
+    Load time, single-row latency and batch latency (ms, median) of the
+    pickle vs the exported model.
+    """
+    def median_ms(fn, n):
+        times = []
+        for _ in range(n):
+            started = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - started) * 1000)
+        return round(float(np.median(times)), 4)
+
+    pkl_path, npz_path = predict._model_path(model_name), export_path(model_name)
+    import joblib
+    models = {"pickle": joblib.load(pkl_path), "exported": ExportedModel.load(npz_path)}
+    loaders = {"pickle": lambda: joblib.load(pkl_path), "exported": lambda: ExportedModel.load(npz_path)}
+
+    results = {}
+    for kind, model in models.items():
+        results[kind] = {
+            "load_ms": median_ms(loaders[kind], 5),
+            "single_row_ms": median_ms(lambda: predict.score_matrix(model, X[:1]), repeats),
+            "batch_ms": median_ms(lambda: predict.score_matrix(model, X), max(3, repeats // 20)),
+            "batch_rows": len(X),
+            "file_kb": round(os.path.getsize(pkl_path if kind == "pickle" else npz_path) / 1024, 1),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    import kline_store
+
+    df = kline_store.read_stage("labeled")
+    if df is None:
+        raise SystemExit(f"Parity check needs data: {kline_store.stage_path('labeled')}")
+    X = features.feature_matrix(df.dropna())
+    path, parity = export_verified("best_crypto_model", X)
+    print(f" Exported best_crypto_model -> {path}")
+    print(f" Parity: {parity}")
+    for kind, stats in benchmark("best_crypto_model", X).items():
+        print(f"   {kind:<9} {stats}")
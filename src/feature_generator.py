@@ -1,95 +1,119 @@
-import pandas as pd
-import ta
-import os
+import numpy as np
+import instrumentation
+import kline_store
+import features
+import resample
 
-def feature_generator():
+@instrumentation.timed("stage.features")
+def feature_generator(chunksize=None, lean=False, timeframes=None):
     """
-    Loads processed data, adds technical indicators, and saves 
-    to 'data/feature_engineered/'.
-    
+    Loads processed data, adds technical indicators, and saves
+    to 'data/feature_engineered/' as Parquet.
+
     DOES NOT generate labels (that is now handled by labeler.py).
+
+    chunksize: stream the processed data this many rows at a time (out
+    of core); returns the number of rows written. lean: float32
+    features (see kline_store.downcast).
+    timeframes (e.g. ("4h", "1d")): also add higher-timeframe features
+    (<feature>_<interval>, see resample.add_timeframe_features), built
+    from the same bars without lookahead. Needs the in-memory path.
     """
-    # --- 1. ROBUST PATH SETUP ---
-    # Get the folder where THIS script is (src/)
-    current_script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(current_script_dir)
-    
-    # INPUT: We try to load the CLEANED data first
-    input_path = os.path.join(project_root, 'data', 'processed', 'processed_data.csv')
-    
-    # OUTPUT: Feature Engineered folder
-    output_dir = os.path.join(project_root, 'data', 'feature_engineered')
-    output_path = os.path.join(output_dir, 'feature_engineered_data.csv')
+    if timeframes and chunksize:
+        raise ValueError("timeframes needs whole series per symbol; run without chunksize")
 
+    # --- 1. LOAD DATA ---
     print(f" Starting feature engineering...")
-    print(f"  Reading from: {input_path}")
-    
-    if not os.path.exists(input_path):
-        print(f" Error: File not found at {input_path}")
-        print("   Please run processed_data.py first.")
+    print(f"  Reading from: {kline_store.stage_path('processed')}")
+
+    # Only the OHLCV columns (+ symbol for multi-symbol histories) are needed
+    columns = ["open_time", "open", "high", "low", "close", "volume"]
+    if "symbol" in (kline_store.stage_columns("processed") or []):
+        columns.append("symbol")
+
+    if chunksize:
+        return _features_chunked(columns, chunksize, lean)
+
+    # Parquet keeps their dtypes
+    df = kline_store.read_stage("processed", columns=columns)
+    if df is None:
+        print(f" Error: Processed data not found in {kline_store.data_dir()}")
+        print("   Please run data_processor.py first.")
         return None
-        
-    df = pd.read_csv(input_path)
-    
-    # --- 2. PREP DATA (Fix Types) ---
-    # Even though we cleaned it, CSVs lose datetime format, so we fix it again.
-    if 'open_time' in df.columns:
-        df["open_time"] = pd.to_datetime(df["open_time"])
-    
-    # Ensure numeric
-    numeric_cols = ["open", "high", "low", "close", "volume"]
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    # Keep only OHLCV for calculation
-    df = df[["open_time", "open", "high", "low", "close", "volume"]]
-
-    # --- 3. CALCULATE INDICATORS ---
+
+    # --- 2. CALCULATE INDICATORS ---
     print("   Calculating technical indicators...")
-    
-    # RSI
-    df["rsi"] = ta.momentum.RSIIndicator(df["close"], window=14).rsi()
-    
-    # MACD
-    macd = ta.trend.MACD(df["close"])
-    df["macd"] = macd.macd()
-    df["macd_signal"] = macd.macd_signal()
-    df["macd_hist"] = macd.macd_diff()
-    
-    # Moving Averages
-    df["sma_20"] = ta.trend.SMAIndicator(df["close"], window=20).sma_indicator()
-    df["sma_50"] = ta.trend.SMAIndicator(df["close"], window=50).sma_indicator()
-    df["sma_200"] = ta.trend.SMAIndicator(df["close"], window=200).sma_indicator()
-    
-    # Bollinger Bands
-    bb = ta.volatility.BollingerBands(df["close"], window=20, window_dev=2)
-    df["bb_high"] = bb.bollinger_hband()
-    df["bb_low"] = bb.bollinger_lband()
-    
-    # Volatility (Rolling Std Dev)
-    df["volatility"] = df["close"].pct_change().rolling(window=20).std()
-    
-    # Returns (Features for the model, NOT targets)
-    df["pct_change_1d"] = df["close"].pct_change()
-    df["pct_change_7d"] = df["close"].pct_change(periods=7)
-
-    # --- 4. CLEANUP & SAVE ---
-    # We drop NaNs created by the indicators (like the first 200 rows for SMA200)
-    
+
+    # RSI, MACD, SMAs, Bollinger Bands, volatility & returns are all
+    # defined once in features.py (shared with app.py and predict.py)
     initial_len = len(df)
-    df.dropna(inplace=True)
+    if timeframes:
+        # Built from every bar (before the warm-up rows go); the
+        # higher-timeframe warm-up stays NaN instead of dropping more rows
+        print(f"   Adding {', '.join(timeframes)} features...")
+        df = resample.add_timeframe_features(df, timeframes)
+    if "symbol" in df.columns:
+        # Same chunked path, one state per symbol, in a single chunk
+        df = _add_features_by_symbol(df, {}, lean)
+    else:
+        df = features.add_features(df, dropna=True, dtype=np.float32 if lean else None)
+    if lean:
+        kline_store.downcast(df)
     dropped_rows = initial_len - len(df)
-    
-    # Create output directory
-    os.makedirs(output_dir, exist_ok=True)
-    
-    df.to_csv(output_path, index=False)
+
+    # --- 3. CLEANUP & SAVE ---
+    # NaN warm-up rows (like the first 200 rows for SMA200) were dropped above
+    output_path = kline_store.write_stage(df, "feature_engineered")
     print(f" Features generated.")
     print(f"   Dropped {dropped_rows} rows (warmup for indicators).")
     print(f"   Saved to: {output_path}")
-    
+
     return df
 
+def _add_features_by_symbol(chunk, engines, lean):
+    """
+    Features for one chunk of rows; each symbol's rows continue that
+    symbol's ChunkedFeatures state (`engines`), so any chunking gives the
+    values of one pass per symbol. Warm-up rows are dropped.
+    """
+    dtype = np.float32 if lean else np.float64
+    values = {name: np.empty(len(chunk), dtype=dtype) for name in features.FEATURE_COLUMNS}
+    if "symbol" in chunk.columns:
+        groups = chunk.groupby("symbol", observed=True, sort=False).indices
+    else:
+        groups = {None: np.arange(len(chunk))}
+
+    for symbol, idx in groups.items():
+        engine = engines.setdefault(symbol, features.ChunkedFeatures())
+        part = engine.update({c: chunk[c].to_numpy()[idx] for c in features.OHLCV_COLUMNS})
+        for name, v in part.items():
+            values[name][idx] = v
+
+    out = chunk.assign(**values)
+    return out.dropna(subset=features.OHLCV_COLUMNS + features.FEATURE_COLUMNS)
+
+def _features_chunked(columns, chunksize, lean):
+    print(f"   Calculating technical indicators in chunks of {chunksize:,} rows...")
+    engines = {}
+    read_rows = 0
+    with kline_store.StageWriter("feature_engineered") as writer:
+        for chunk in kline_store.iter_stage("processed", columns=columns, batch_rows=chunksize):
+            read_rows += len(chunk)
+            out = _add_features_by_symbol(chunk, engines, lean)
+            if lean:
+                kline_store.downcast(out)
+            if len(out):
+                writer.write(out)
+
+    if not read_rows:
+        print(f" Error: Processed data not found in {kline_store.data_dir()}")
+        print("   Please run data_processor.py first.")
+        return None
+
+    print(f" Features generated.")
+    print(f"   Dropped {read_rows - writer.rows} rows (warmup for indicators).")
+    print(f"   Saved to: {writer.path}")
+    return writer.rows
+
 if __name__ == "__main__":
-    feature_generator()
\ No newline at end of file
+    feature_generator()
@@ -0,0 +1,354 @@
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.inspection import permutation_importance
+from sklearn.metrics import accuracy_score, log_loss
+from threadpoolctl import threadpool_limits
+
+import features
+import kline_store
+import predict
+import train
+
+warnings.filterwarnings('ignore')
+
+CLASSES = [0, 1, 2]
+
+# Feature pruning between feature_generator and train: every model input
+# gets a compute cost (indicator time, batch and per tick) and an
+# importance (permutation importance of the trained models on the
+# validation window). Reduced column lists are retrained and scored, and
+# the Pareto front over (log-loss, compute cost, inference latency) is
+# saved to models/feature_sets.json, where train.py can pin one.
+# Splits match train.py / evaluate.py: fit on the first 70%, score on
+# the next 15%; the last 15% (evaluate's test set) is never looked at.
+
+
+def feature_sets_path():
+    return os.path.join(predict._model_dir(), 'feature_sets.json')
+
+
+def _split(df):
+    train_end, val_end = int(len(df) * 0.70), int(len(df) * 0.85)
+    return df.iloc[:train_end], df.iloc[train_end:val_end]
+
+
+def _inputs(df):
+    # OHLCV as float64 arrays, plus open_time for the higher-timeframe columns
+    inputs = {c: df[c].to_numpy(dtype=np.float64) for c in features.OHLCV_COLUMNS}
+    if 'open_time' in df.columns:
+        inputs['open_time'] = df['open_time'].to_numpy()
+    return inputs
+
+
+def _median_seconds(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return float(np.median(times))
+
+
+# --- COSTS ---
+
+def compute_cost(inputs, columns, repeats=5):
+    """
+    Median seconds to compute the indicators among `columns` (with their
+    intermediates) from OHLCV arrays. Higher-timeframe columns are
+    resampled from the bars, which needs an "open_time" input. Raw OHLCV
+    columns are free.
+    """
+    needed = [c for c in columns if c in features.FEATURES]
+    timeframe = [c for c in columns if features.timeframe_column(c) is not None]
+    if not needed and not timeframe:
+        return 0.0
+    if timeframe and 'open_time' not in inputs:
+        raise ValueError(f"Costing {timeframe} needs the bars' open_time")
+    frame = pd.DataFrame({c: inputs[c] for c in ['open_time'] + features.OHLCV_COLUMNS}) if timeframe else None
+
+    def run():
+        if needed:
+            features.compute_feature_arrays(inputs, needed)
+        if timeframe:
+            features.feature_matrix(frame, timeframe)
+    return _median_seconds(run, repeats)
+
+
+def feature_costs(df, repeats=5, columns=None):
+    """
+    Compute cost of each model input (default: MODEL_COLUMNS) on its own,
+    in ms per 1,000 bars (batch) and per tick (one update over a
+    WARMUP_BARS window, as the chunked / recompute paths do).
+    """
+    inputs = _inputs(df)
+    tick = {c: v[-(features.WARMUP_BARS + 1):] for c, v in inputs.items()}
+    rows = []
+    for name in columns or features.MODEL_COLUMNS:
+        rows.append({
+            "feature": name,
+            "batch_ms": round(compute_cost(inputs, [name], repeats) * 1000 * 1000 / len(df), 4),
+            "tick_ms": round(compute_cost(tick, [name], repeats * 4) * 1000, 4),
+        })
+    return pd.DataFrame(rows).set_index("feature")
+
+
+def inference_cost(model, X, repeats=20):
+    """
+    predict_proba latency: one row (ms) and a batch (ms per 1,000 rows).
+    """
+    row = np.ascontiguousarray(X[:1])
+    single = _median_seconds(lambda: model.predict_proba(row), repeats)
+    batch = _median_seconds(lambda: model.predict_proba(X), max(3, repeats // 5))
+    return round(single * 1000, 4), round(batch * 1000 * 1000 / len(X), 4)
+
+
+# --- IMPORTANCE ---
+
+def importances(df, model_names=None, n_repeats=5, seed=42, columns=None):
+    """
+    Permutation importance of every model input (default: MODEL_COLUMNS)
+    for each trained model (mean rise in validation log-loss when the
+    column is shuffled), plus their mean. Model-agnostic, so the linear model and the tree
+    ensembles are ranked on the same scale.
+    """
+    _, val = _split(df)
+    names = model_names or [n for n in predict.list_models() if n != 'best_crypto_model']
+    table = {}
+    for name in names:
+        model = predict.load_model(name)
+        columns = predict.model_columns(model)
+        with threadpool_limits(limits=1):
+            result = permutation_importance(model, val[columns], val['label'], scoring='neg_log_loss',
+                                            n_repeats=n_repeats, random_state=seed)
+        table[name] = pd.Series(result.importances_mean, index=columns)
+        print(f"   Importance from {name} ({len(columns)} columns)")
+    out = pd.DataFrame(table).reindex(columns or features.MODEL_COLUMNS)
+    out["mean"] = out.mean(axis=1)
+    return out.sort_values("mean", ascending=False)
+
+
+# --- CANDIDATES ---
+
+def candidate_sets(importance, costs, sizes=None, columns=None):
+    """
+    Nested column lists to try: the top-k by importance, and the top-k
+    by importance per ms of per-tick compute (cheap inputs first, raw
+    OHLCV is free). Duplicates are dropped; the full list (`columns`,
+    default MODEL_COLUMNS) comes first.
+    """
+    columns = list(columns or features.MODEL_COLUMNS)
+    ranked = list(importance.index)
+    cost = costs["tick_ms"].reindex(ranked).fillna(0.0)
+    # Inputs that don't help (importance <= 0) sort last in both orders
+    gain = importance.clip(lower=0)
+    floor = cost[cost > 0].min() if (cost > 0).any() else 1.0
+    value = (gain / (cost + floor)).sort_values(ascending=False)
+    orders = {"top": ranked, "cheap": list(value.index)}
+
+    sizes = sizes or range(len(ranked) - 1, 2, -1)
+    candidates = {"all": columns}
+    seen = {frozenset(columns)}
+    for k in sizes:
+        for prefix, order in orders.items():
+            chosen = set(order[:k])
+            if frozenset(chosen) in seen:
+                continue
+            seen.add(frozenset(chosen))
+            # Model order stays `columns` order
+            candidates[f"{prefix}{k}"] = [c for c in columns if c in chosen]
+    return candidates
+
+
+def evaluate_set(df, columns, model_name, params=None, inputs=None):
+    """
+    Fits `model_name` on the training window with only `columns` and
+    scores it on the validation window: log-loss, accuracy, compute cost
+    and inference latency.
+    """
+    train_df, val = _split(df)
+    with threadpool_limits(limits=1):
+        model = train.build_model(model_name, n_threads=1, params=params)
+        model.fit(train_df[columns], train_df['label'])
+        probs = model.predict_proba(val[columns])
+        X_val = np.ascontiguousarray(val[columns].to_numpy(dtype=np.float32))
+        single_ms, batch_ms = inference_cost(model, X_val)
+    inputs = inputs or _inputs(df)
+    tick = {c: v[-(features.WARMUP_BARS + 1):] for c, v in inputs.items()}
+    return {
+        "columns": list(columns),
+        "n_columns": len(columns),
+        "indicators": len([c for c in columns if c not in features.OHLCV_COLUMNS]),
+        "log_loss": float(log_loss(val['label'], probs, labels=CLASSES)),
+        "accuracy": float(accuracy_score(val['label'], np.asarray(model.classes_)[probs.argmax(axis=1)])),
+        "tick_ms": round(compute_cost(tick, columns, repeats=20) * 1000, 4),
+        "batch_ms": round(compute_cost(inputs, columns) * 1000 * 1000 / len(df), 4),
+        "inference_ms": single_ms,
+        "inference_batch_ms": batch_ms,
+    }
+
+
+def pareto_front(results, objectives=("log_loss", "tick_ms", "inference_ms")):
+    """
+    Names of the results no other result beats on every objective (all
+    minimised) while being strictly better on at least one.
+    """
+    names = list(results)
+    values = np.array([[results[n][o] for o in objectives] for n in names])
+    front = []
+    for i, name in enumerate(names):
+        others = np.delete(values, i, axis=0)
+        dominated = np.any(np.all(others <= values[i], axis=1) & np.any(others < values[i], axis=1))
+        if not dominated:
+            front.append(name)
+    return front
+
+
+# --- PUBLIC API ---
+
+def select(model_name=None, sizes=None, tolerance=0.005, n_repeats=5, save=True):
+    """
+    Runs the whole selection on the labeled data: costs, importance,
+    candidate retraining and the Pareto front. `model_name` is the model
+    type the candidates are fitted with (default: the current winner's).
+
+    A set is "no_loss" when its validation log-loss is within `tolerance`
+    of the full set's and its accuracy is not lower by more than that;
+    the cheapest (per-tick compute, then inference) no-loss Pareto set is
+    recommended. Higher-timeframe columns in the labeled stage
+    (feature_generator(timeframes=...)) are candidates too.
+    Returns the saved report.
+    """
+    print(" Starting feature selection...")
+    # Same columns and rows as train.py
+    columns = train.labeled_model_columns()
+    df = train._read_labeled()
+    if df is None:
+        print(f" Error: File not found at {kline_store.stage_path('labeled')}")
+        return None
+
+    model_name = model_name or _winner_name()
+    params = train.load_tuned_params().get(model_name)
+    print(f"   Candidates are fitted as {model_name} on {int(len(df) * 0.70)} rows")
+
+    costs = feature_costs(df, columns=columns)
+    importance = importances(df, n_repeats=n_repeats, columns=columns)
+    candidates = candidate_sets(importance["mean"], costs, sizes, columns)
+
+    inputs = _inputs(df)
+    results = {}
+    for name, columns in candidates.items():
+        results[name] = evaluate_set(df, columns, model_name, params, inputs)
+        r = results[name]
+        print(f"      - {name:<8} {r['n_columns']:>2} cols  log-loss {r['log_loss']:.4f}  acc {r['accuracy']:.3f}  "
+              f"tick {r['tick_ms']:.3f} ms  inference {r['inference_ms']:.3f} ms")
+
+    base = results["all"]
+    for r in results.values():
+        r["no_loss"] = bool(r["log_loss"] <= base["log_loss"] + tolerance
+                            and r["accuracy"] >= base["accuracy"] - tolerance)
+    front = pareto_front(results)
+    eligible = [n for n in front if results[n]["no_loss"]] or ["all"]
+    recommended = min(eligible, key=lambda n: (results[n]["tick_ms"], results[n]["inference_ms"],
+                                               results[n]["n_columns"]))
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "model": model_name,
+        "tolerance": tolerance,
+        "costs": costs.to_dict(orient="index"),
+        "importance": importance["mean"].round(6).to_dict(),
+        "pareto": front,
+        # The full set is kept for reference even when it is dominated
+        "sets": {n: results[n] for n in dict.fromkeys(front + ["all"])},
+        "recommended": recommended,
+        "pinned": _load().get("pinned"),
+    }
+    print(f"\n Pareto front: {', '.join(front)}")
+    print(f"   Recommended: {recommended} ({results[recommended]['n_columns']} columns, "
+          f"tick {results[recommended]['tick_ms']:.3f} ms vs {base['tick_ms']:.3f} ms)")
+
+    if save:
+        if report["pinned"] not in report["sets"]:
+            report["pinned"] = None
+        _write(report)
+        print(f"   Saved to: {feature_sets_path()}  (pin one with feature_selection.pin(name))")
+    return report
+
+
+def _winner_name():
+    # Model type of best_crypto_model, matched against train.MODEL_NAMES
+    try:
+        winner = type(predict.load_model('best_crypto_model')).__name__
+    except FileNotFoundError:
+        return "XGBoost"
+    for name in train.MODEL_NAMES:
+        if type(train.build_model(name)).__name__ == winner:
+            return name
+    return "XGBoost"
+
+
+def _load():
+    try:
+        with open(feature_sets_path()) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write(report):
+    path = feature_sets_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def pin(name):
+    """
+    Pins a saved set ("recommended" = the recommended one, None unpins);
+    train_models(feature_set="pinned") then trains on it.
+    """
+    report = _load()
+    if name == "recommended":
+        name = report.get("recommended")
+    if name is not None and name not in report.get("sets", {}):
+        raise KeyError(f"Unknown feature set: {name}")
+    report["pinned"] = name
+    _write(report)
+    return name
+
+
+def resolve(feature_set):
+    """
+    Column list for train.py: a list is used as is (in MODEL_COLUMNS
+    order, then its higher-timeframe columns such as "rsi_4h" in the
+    given order; feature_generator(timeframes=...) must have written
+    them), a name is looked up in feature_sets.json ("pinned" = the
+    pinned set, all columns if none is pinned).
+    """
+    if not isinstance(feature_set, str):
+        unknown = [c for c in feature_set if not features.is_model_column(c)]
+        if unknown:
+            raise ValueError(f"Unknown feature columns: {unknown}")
+        return [c for c in features.MODEL_COLUMNS if c in set(feature_set)] \
+            + list(dict.fromkeys(c for c in feature_set if c not in features.MODEL_COLUMNS))
+
+    report = _load()
+    name = report.get("pinned") if feature_set == "pinned" else feature_set
+    if feature_set == "pinned" and name is None:
+        return features.MODEL_COLUMNS
+    if name == "recommended":
+        name = report.get("recommended")
+    if name not in report.get("sets", {}):
+        raise KeyError(f"Unknown feature set: {feature_set} (run feature_selection.select() first)")
+    return report["sets"][name]["columns"]
+
+
+if __name__ == "__main__":
+    select()
@@ -0,0 +1,398 @@
+import math
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+import instrumentation
+
+# The single definition of the model's inputs. feature_generator.py,
+# app.py and predict.py all go through this module, so training and
+# serving always see the same columns in the same order.
+
+OHLCV_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+
+# --- NUMPY KERNELS ---
+# All kernels work along the last axis, so a (symbols, bars) matrix is
+# processed in one call. Warm-up positions are NaN, like pandas/ta.
+
+def _nan_like(x):
+    return np.full(x.shape, np.nan, dtype=np.float64)
+
+
+def pct_change(x, periods=1):
+    out = _nan_like(x)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[..., periods:] = x[..., periods:] / x[..., :-periods] - 1
+    return out
+
+
+def ema(x, alpha, min_periods=1, state=None):
+    """
+    Exponential moving average, same recursion as pandas
+    `ewm(alpha=alpha, adjust=False)`: y[t] = (1 - alpha) * y[t-1] + alpha * x[t].
+    Leading NaNs are skipped; min_periods counts valid observations.
+
+    The recursion is unrolled block by block in closed form
+    (y[t] = d^t * (d * y0 + alpha * cumsum(x[j] / d^j))), so the Python loop
+    runs once per block instead of once per bar.
+
+    `state` (a dict, initially empty) carries the recursion across calls
+    on consecutive chunks of the same series: the last value and the
+    observation count are read from it and written back.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = x.shape[-1]
+    out = _nan_like(x)
+    if n == 0:
+        return out
+
+    flat = x.reshape(-1, n)
+    res = out.reshape(-1, n)
+    valid = ~np.isnan(flat)
+    first = np.where(valid.any(axis=1), valid.argmax(axis=1), n)
+
+    # Back-fill the leading NaNs with the first value; a constant prefix
+    # leaves the average at exactly that value when real data starts
+    filled = flat.copy()
+    rows = np.arange(flat.shape[0])
+    has_data = first < n
+    lead = (np.arange(n) < first[:, None]) & has_data[:, None]
+    filled[lead] = np.repeat(flat[rows[has_data], first[has_data]], first[has_data])
+
+    decay = 1.0 - alpha
+    # Keep d^-block below e^300 so nothing overflows
+    block = int(max(1, min(1024, 300 / -math.log(decay)))) if decay > 0 else 1
+    level = filled[:, 0].copy()
+    seen = np.zeros(flat.shape[0])
+    if state is not None and "last" in state:
+        # Continue from the previous chunk where it had data
+        carried = ~np.isnan(state["last"])
+        level[carried] = state["last"][carried]
+        seen = state["nobs"]
+
+    for start in range(0, n, block):
+        chunk = filled[:, start:start + block]
+        k = np.arange(chunk.shape[1])
+        inv = decay ** -k
+        acc = np.cumsum(chunk * inv, axis=1)
+        powers = decay ** k
+        y = powers * (decay * level[:, None] + alpha * acc)
+        res[:, start:start + block] = y
+        level = y[:, -1]
+
+    if state is not None:
+        state["last"] = level.copy()
+        state["nobs"] = seen + valid.sum(axis=1)
+
+    # Mask warm-up: min_periods valid observations after the first one
+    ready = np.arange(n) >= (first + max(min_periods, 1) - 1 - seen)[:, None]
+    res[~ready] = np.nan
+    return out
+
+
+def _span_alpha(span):
+    return 2.0 / (span + 1.0)
+
+
+def rolling_mean(x, window):
+    x = np.asarray(x, dtype=np.float64)
+    out = _nan_like(x)
+    if x.shape[-1] >= window:
+        view = np.lib.stride_tricks.sliding_window_view(x, window, axis=-1)
+        out[..., window - 1:] = view.mean(axis=-1)
+    return out
+
+
+def rolling_std(x, window, ddof=1, chunk_rows=1 << 20):
+    """
+    Two-pass windowed standard deviation. Rows are processed in chunks so
+    the (bars, window) temporary stays bounded on long histories.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = x.shape[-1]
+    out = _nan_like(x)
+    if n < window:
+        return out
+
+    view = np.lib.stride_tricks.sliding_window_view(x, window, axis=-1)
+    dest = out[..., window - 1:]
+    step = max(1, chunk_rows // window)
+    for start in range(0, view.shape[-2], step):
+        part = view[..., start:start + step, :]
+        centred = part - part.mean(axis=-1, keepdims=True)
+        dest[..., start:start + step] = np.sqrt(
+            np.einsum('...i,...i->...', centred, centred) / (window - ddof)
+        )
+    return out
+
+
+# --- REGISTRY ---
+
+FEATURES = OrderedDict()   # emitted columns, in model order
+INTERMEDIATES = {}         # shared building blocks, never emitted
+
+
+def feature(name):
+    """
+    Registers a model feature. Registration order is column order.
+    """
+    def wrap(fn):
+        FEATURES[name] = fn
+        return fn
+    return wrap
+
+
+def intermediate(name):
+    """
+    Registers a shared intermediate array (computed at most once per call).
+    """
+    def wrap(fn):
+        INTERMEDIATES[name] = fn
+        return fn
+    return wrap
+
+
+class FeatureContext:
+    """
+    Lazily evaluates features/intermediates on demand and memoises them,
+    so anything used by several features (returns, SMA 20, EMAs) is
+    computed once.
+    """
+
+    def __init__(self, arrays, state=None, offset=0):
+        self._values = dict(arrays)
+        self.state = state
+        self.offset = offset
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            fn = FEATURES.get(name) or INTERMEDIATES.get(name)
+            if fn is None:
+                raise KeyError(f"Unknown feature or input: {name}")
+            with instrumentation.span(f"feature.{name}"):
+                self._values[name] = fn(self)
+        return self._values[name]
+
+    def ema(self, key, x, alpha, min_periods=1):
+        """
+        ema() for a feature. In a chunked run (see ChunkedFeatures) the
+        recursion continues from the previous chunk's state under `key`,
+        and only the bars after `offset` (the new ones) are fed to it.
+        """
+        if self.state is None:
+            return ema(x, alpha, min_periods)
+        out = _nan_like(x)
+        out[..., self.offset:] = ema(x[..., self.offset:], alpha, min_periods, self.state.setdefault(key, {}))
+        return out
+
+
+@intermediate("ema_12")
+def _ema_12(ctx):
+    return ctx.ema("ema_12", ctx["close"], _span_alpha(12), min_periods=12)
+
+
+@intermediate("ema_26")
+def _ema_26(ctx):
+    return ctx.ema("ema_26", ctx["close"], _span_alpha(26), min_periods=26)
+
+
+@intermediate("std_20")
+def _std_20(ctx):
+    return rolling_std(ctx["close"], 20, ddof=0)
+
+
+@feature("rsi")
+def _rsi(ctx):
+    close = ctx["close"]
+    diff = np.zeros_like(close)
+    # ta treats the undefined first move as 0, so the averages start at bar 0
+    diff[..., 1:] = np.diff(close, axis=-1)
+    up = ctx.ema("rsi_up", np.where(diff > 0, diff, 0.0), 1 / 14, min_periods=14)
+    down = ctx.ema("rsi_down", np.where(diff < 0, -diff, 0.0), 1 / 14, min_periods=14)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(down == 0, 100.0, 100 - (100 / (1 + up / down)))
+
+
+@feature("macd")
+def _macd(ctx):
+    return ctx["ema_12"] - ctx["ema_26"]
+
+
+@feature("macd_signal")
+def _macd_signal(ctx):
+    return ctx.ema("macd_signal", ctx["macd"], _span_alpha(9), min_periods=9)
+
+
+@feature("macd_hist")
+def _macd_hist(ctx):
+    return ctx["macd"] - ctx["macd_signal"]
+
+
+@feature("sma_20")
+def _sma_20(ctx):
+    return rolling_mean(ctx["close"], 20)
+
+
+@feature("sma_50")
+def _sma_50(ctx):
+    return rolling_mean(ctx["close"], 50)
+
+
+@feature("sma_200")
+def _sma_200(ctx):
+    return rolling_mean(ctx["close"], 200)
+
+
+@feature("bb_high")
+def _bb_high(ctx):
+    return ctx["sma_20"] + 2 * ctx["std_20"]
+
+
+@feature("bb_low")
+def _bb_low(ctx):
+    return ctx["sma_20"] - 2 * ctx["std_20"]
+
+
+@feature("volatility")
+def _volatility(ctx):
+    return rolling_std(ctx["pct_change_1d"], 20, ddof=1)
+
+
+@feature("pct_change_1d")
+def _pct_change_1d(ctx):
+    return pct_change(ctx["close"], 1)
+
+
+@feature("pct_change_7d")
+def _pct_change_7d(ctx):
+    return pct_change(ctx["close"], 7)
+
+
+FEATURE_COLUMNS = list(FEATURES)
+MODEL_COLUMNS = OHLCV_COLUMNS + FEATURE_COLUMNS
+
+# Longest look-back of any feature (sma_200)
+WARMUP_BARS = 200
+
+# Higher-timeframe copies of the features (resample.add_timeframe_features):
+# <feature>_<interval>, e.g. rsi_4h. They live in the feature stage and a
+# model can be trained on them (feature_selection.resolve), but they need
+# the longer history, so they are never part of MODEL_COLUMNS.
+_TIMEFRAME_COLUMN = re.compile(r"^(?P<feature>.+)_(?P<interval>\d+[smhdwM])$")
+
+
+def timeframe_column(name):
+    """
+    (feature, interval) for a higher-timeframe column such as "rsi_4h",
+    None for anything else.
+    """
+    if name in FEATURES:
+        return None
+    match = _TIMEFRAME_COLUMN.match(name)
+    if match is None or match["feature"] not in FEATURES:
+        return None
+    return match["feature"], match["interval"]
+
+
+def is_model_column(name):
+    """
+    Whether a model may be fitted on this column: MODEL_COLUMNS or a
+    higher-timeframe feature.
+    """
+    return name in MODEL_COLUMNS or timeframe_column(name) is not None
+
+
+# --- PUBLIC API ---
+
+def compute_feature_arrays(inputs, columns=None):
+    """
+    Computes the requested features from raw OHLCV arrays. Inputs may be
+    2D (symbols, bars): every symbol is processed in the same kernel call.
+    Returns {name: float64 array shaped like the inputs}.
+    """
+    ctx = FeatureContext(inputs)
+    return {name: ctx[name] for name in (columns or FEATURE_COLUMNS)}
+
+
+def compute_features(df, columns=None):
+    """
+    Computes the requested features (default: all) from a DataFrame's
+    OHLCV columns. Returns {name: float64 array}.
+    """
+    inputs = {c: df[c].to_numpy(dtype=np.float64) for c in OHLCV_COLUMNS if c in df.columns}
+    return compute_feature_arrays(inputs, columns)
+
+
+class ChunkedFeatures:
+    """
+    Features of one series delivered in consecutive chunks (oldest
+    first), equal to a single pass over the whole series. Windowed
+    features see the last WARMUP_BARS bars of the previous chunk; the
+    EMAs (RSI, MACD) carry their state, since they never fully forget.
+    Memory stays O(chunk) however long the series is.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = list(columns or FEATURE_COLUMNS)
+        self.state = {}
+        self.tail = None
+
+    def update(self, inputs):
+        """
+        Next chunk's OHLCV arrays -> {feature: float64 array} for its bars.
+        """
+        inputs = {c: np.asarray(v, dtype=np.float64) for c, v in inputs.items()}
+        offset = 0
+        if self.tail is not None:
+            offset = len(self.tail["close"])
+            inputs = {c: np.concatenate([self.tail[c], inputs[c]]) for c in inputs}
+        ctx = FeatureContext(inputs, self.state, offset)
+        values = {name: ctx[name][offset:] for name in self.columns}
+        self.tail = {c: v[-WARMUP_BARS:] for c, v in inputs.items()}
+        return values
+
+
+def add_features(df, dropna=True, dtype=None):
+    """
+    Returns a copy of df with every registered feature attached.
+    With dropna=True the indicator warm-up rows are removed, exactly
+    like the training data. dtype (e.g. np.float32) downcasts the new
+    columns.
+    """
+    values = compute_features(df)
+    if dtype is not None:
+        values = {name: v.astype(dtype, copy=False) for name, v in values.items()}
+    out = df.assign(**values)
+    if dropna:
+        out = out.dropna(subset=OHLCV_COLUMNS + FEATURE_COLUMNS)
+    return out
+
+
+def feature_matrix(df, columns=None):
+    """
+    Model input as a float32, C-contiguous (rows, features) array in
+    MODEL_COLUMNS order. Features missing from df are computed on the fly
+    (higher-timeframe ones from df's own bars, see resample.py).
+    """
+    columns = columns or MODEL_COLUMNS
+    missing = [c for c in columns if c not in df.columns and c not in OHLCV_COLUMNS]
+    timeframes = {}
+    for c in missing:
+        if timeframe_column(c) is not None:
+            feature, interval = timeframe_column(c)
+            timeframes.setdefault(interval, []).append(feature)
+    own = [c for c in missing if timeframe_column(c) is None]
+    computed = compute_features(df, own) if own else {}
+    if timeframes:
+        # Only models pinned to these columns pay for the resample imports
+        import resample
+        for interval, names in timeframes.items():
+            extra = resample.add_timeframe_features(df[["open_time"] + OHLCV_COLUMNS], [interval], columns=names)
+            computed.update({f"{n}_{interval}": extra[f"{n}_{interval}"].to_numpy() for n in names})
+
+    X = np.empty((len(df), len(columns)), dtype=np.float32)
+    for j, name in enumerate(columns):
+        X[:, j] = computed[name] if name in computed else df[name].to_numpy()
+    return X
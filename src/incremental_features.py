@@ -0,0 +1,318 @@
+import math
+from collections import deque
+
+import joblib
+import numpy as np
+
+from features import FEATURE_COLUMNS as FEATURE_COLS
+
+NAN = float("nan")
+
+
+# --- ROLLING STATE ---
+# Each accumulator replays the exact floating-point steps of the pandas
+# kernels `ta` is built on, so the incremental values match the batch path.
+
+class EMAState:
+    """
+    Exponential moving average, as pandas `ewm(adjust=False).mean()`.
+    """
+
+    def __init__(self, alpha=None, span=None, min_periods=0):
+        # pandas converts alpha/span to a centre of mass and back
+        if span is not None:
+            com = (span - 1) / 2.0
+        else:
+            com = 1.0 / alpha - 1.0
+        self.alpha = 1.0 / (1.0 + com)
+        self.min_periods = max(min_periods, 1)
+        self.weighted = NAN
+        self.nobs = 0
+
+    def update(self, value):
+        is_observation = value == value
+        self.nobs += is_observation
+
+        if self.weighted == self.weighted:
+            if is_observation and self.weighted != value:
+                old_wt = 1.0 - self.alpha
+                self.weighted = (old_wt * self.weighted + self.alpha * value) / (old_wt + self.alpha)
+        elif is_observation:
+            self.weighted = value
+
+        return self.weighted if self.nobs >= self.min_periods else NAN
+
+
+class RollingMeanState:
+    """
+    Fixed-window mean over a ring buffer, as pandas `rolling(w).mean()`
+    (Kahan-compensated running sum).
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.buffer = deque(maxlen=window)
+        self.nobs = 0
+        self.sum_x = 0.0
+        self.neg_ct = 0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.num_consecutive_same_value = 0
+        self.prev_value = NAN
+        self.started = False
+
+    def update(self, value):
+        if not self.started:
+            self.prev_value = value
+            self.started = True
+        elif len(self.buffer) == self.window:
+            self._remove(self.buffer[0])
+        self.buffer.append(value)
+        self._add(value)
+        return self._value()
+
+    def _add(self, val):
+        if val != val:
+            return
+        self.nobs += 1
+        y = val - self.compensation_add
+        t = self.sum_x + y
+        self.compensation_add = t - self.sum_x - y
+        self.sum_x = t
+        if math.copysign(1.0, val) < 0:
+            self.neg_ct += 1
+        if val == self.prev_value:
+            self.num_consecutive_same_value += 1
+        else:
+            self.num_consecutive_same_value = 1
+        self.prev_value = val
+
+    def _remove(self, val):
+        if val != val:
+            return
+        self.nobs -= 1
+        y = -val - self.compensation_remove
+        t = self.sum_x + y
+        self.compensation_remove = t - self.sum_x - y
+        self.sum_x = t
+        if math.copysign(1.0, val) < 0:
+            self.neg_ct -= 1
+
+    def _value(self):
+        if self.nobs < self.window:
+            return NAN
+        result = self.sum_x / self.nobs
+        if self.num_consecutive_same_value >= self.nobs:
+            result = self.prev_value
+        elif self.neg_ct == 0 and result < 0:
+            result = 0.0
+        elif self.neg_ct == self.nobs and result > 0:
+            result = 0.0
+        return result
+
+
+class RollingStdState:
+    """
+    Fixed-window standard deviation over a ring buffer, as pandas
+    `rolling(w).std(ddof)` (Welford running variance with Kahan compensation).
+    """
+
+    def __init__(self, window, ddof=1):
+        self.window = window
+        self.ddof = ddof
+        self.buffer = deque(maxlen=window)
+        self.nobs = 0
+        self.mean_x = 0.0
+        self.ssqdm_x = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.num_consecutive_same_value = 0
+        self.prev_value = NAN
+        self.started = False
+
+    def update(self, value):
+        if not self.started:
+            self.prev_value = value
+            self.started = True
+        elif len(self.buffer) == self.window:
+            self._remove(self.buffer[0])
+        self.buffer.append(value)
+        self._add(value)
+        return self._value()
+
+    def _add(self, val):
+        if val != val:
+            return
+        self.nobs += 1
+        if val == self.prev_value:
+            self.num_consecutive_same_value += 1
+        else:
+            self.num_consecutive_same_value = 1
+        self.prev_value = val
+
+        prev_mean = self.mean_x - self.compensation_add
+        y = val - self.compensation_add
+        t = y - self.mean_x
+        self.compensation_add = t + self.mean_x - y
+        self.mean_x = self.mean_x + t / self.nobs
+        self.ssqdm_x = self.ssqdm_x + (val - prev_mean) * (val - self.mean_x)
+
+        # A window of identical values restarts from an exact zero variance
+        if self.num_consecutive_same_value >= self.nobs:
+            self.mean_x = val
+            self.ssqdm_x = 0.0
+
+    def _remove(self, val):
+        if val != val:
+            return
+        self.nobs -= 1
+        if self.nobs:
+            prev_mean = self.mean_x - self.compensation_remove
+            y = val - self.compensation_remove
+            t = y - self.mean_x
+            self.compensation_remove = t + self.mean_x - y
+            self.mean_x = self.mean_x - t / self.nobs
+            self.ssqdm_x = self.ssqdm_x - (val - prev_mean) * (val - self.mean_x)
+        else:
+            self.mean_x = 0.0
+            self.ssqdm_x = 0.0
+
+    def _value(self):
+        if self.nobs < self.window or self.nobs <= self.ddof:
+            return NAN
+        if self.nobs == 1 or self.num_consecutive_same_value >= self.nobs:
+            return 0.0
+        var = self.ssqdm_x / (self.nobs - self.ddof)
+        return math.sqrt(var) if var > 0 else 0.0
+
+
+# --- ENGINE ---
+
+class IncrementalFeatureEngine:
+    """
+    Stateful version of feature_generator's indicators. Each new candle
+    costs O(1), so appending N candles costs O(N) instead of a full
+    recompute. Output matches the `ta` batch path value for value
+    (warm-up rows are NaN, exactly like before dropna).
+
+    The whole engine pickles, so it can be checkpointed and restored.
+    """
+
+    def __init__(self):
+        # RSI (Wilder smoothing of gains/losses)
+        self.rsi_up = EMAState(alpha=1 / 14, min_periods=14)
+        self.rsi_down = EMAState(alpha=1 / 14, min_periods=14)
+
+        # MACD (12/26/9)
+        self.ema_fast = EMAState(span=12, min_periods=12)
+        self.ema_slow = EMAState(span=26, min_periods=26)
+        self.macd_signal = EMAState(span=9, min_periods=9)
+
+        # Moving averages & Bollinger Bands (sma_20 doubles as the BB mid line)
+        self.sma_20 = RollingMeanState(20)
+        self.sma_50 = RollingMeanState(50)
+        self.sma_200 = RollingMeanState(200)
+        self.bb_std = RollingStdState(20, ddof=0)
+
+        # Volatility of 1-step returns
+        self.volatility = RollingStdState(20, ddof=1)
+
+        # Last 7 closes for the pct_change features
+        self.closes = deque(maxlen=7)
+        self.last_open_time = None
+
+    def update_one(self, close, open_time=None):
+        """
+        Feeds one closed candle and returns its features as a dict.
+        """
+        prev_close = self.closes[-1] if self.closes else NAN
+        close_7 = self.closes[0] if len(self.closes) == 7 else NAN
+
+        # RSI: the first diff is NaN, which ta turns into a 0.0 move
+        diff = close - prev_close
+        up = diff if diff > 0 else 0.0
+        down = -(diff if diff < 0 else 0.0)
+        ema_up = self.rsi_up.update(up)
+        ema_down = self.rsi_down.update(down)
+        if ema_down == 0:
+            rsi = 100.0
+        else:
+            rsi = 100 - (100 / (1 + ema_up / ema_down))
+
+        fast = self.ema_fast.update(close)
+        slow = self.ema_slow.update(close)
+        macd = fast - slow
+        signal = self.macd_signal.update(macd)
+
+        sma_20 = self.sma_20.update(close)
+        sma_50 = self.sma_50.update(close)
+        sma_200 = self.sma_200.update(close)
+        std_20 = self.bb_std.update(close)
+
+        pct_1 = close / prev_close - 1
+        pct_7 = close / close_7 - 1
+        volatility = self.volatility.update(pct_1)
+
+        self.closes.append(close)
+        if open_time is not None:
+            self.last_open_time = open_time
+
+        return {
+            "rsi": rsi,
+            "macd": macd,
+            "macd_signal": signal,
+            "macd_hist": macd - signal,
+            "sma_20": sma_20,
+            "sma_50": sma_50,
+            "sma_200": sma_200,
+            "bb_high": sma_20 + 2 * std_20,
+            "bb_low": sma_20 - 2 * std_20,
+            "volatility": volatility,
+            "pct_change_1d": pct_1,
+            "pct_change_7d": pct_7,
+        }
+
+    def update(self, df):
+        """
+        Feeds new candles (open_time + OHLCV, oldest first) and returns them
+        with the feature columns attached. Candles at or before the last
+        processed open_time are skipped so overlapping batches are safe.
+        """
+        if self.last_open_time is not None and "open_time" in df.columns:
+            df = df[df["open_time"] > self.last_open_time]
+
+        out = np.full((len(df), len(FEATURE_COLS)), np.nan)
+        closes = df["close"].to_numpy(dtype="float64")
+        times = df["open_time"].tolist() if "open_time" in df.columns else [None] * len(df)
+
+        for i, (close, open_time) in enumerate(zip(closes.tolist(), times)):
+            row = self.update_one(close, open_time)
+            out[i] = [row[c] for c in FEATURE_COLS]
+
+        result = df.copy()
+        result[FEATURE_COLS] = out
+        return result
+
+    @property
+    def is_warm(self):
+        """
+        True once every indicator (including sma_200) has a value.
+        """
+        return self.sma_200.nobs >= 200 and self.volatility.nobs >= 20
+
+    def checkpoint(self, path):
+        """
+        Saves the full rolling state to disk.
+        """
+        joblib.dump(self, path)
+        return path
+
+    @staticmethod
+    def restore(path):
+        """
+        Loads an engine saved with checkpoint().
+        """
+        engine = joblib.load(path)
+        if not isinstance(engine, IncrementalFeatureEngine):
+            raise TypeError(f"{path} does not contain an IncrementalFeatureEngine")
+        return engine
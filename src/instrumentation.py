@@ -0,0 +1,397 @@
+import contextvars
+import functools
+import math
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+# Lightweight metrics for the hot paths: timing spans, counters and
+# histograms, a Prometheus text exporter and a sampling profiler.
+#
+# Metrics are off unless CRYPTO_INSTRUMENT=1 (or enable() is called).
+# While off, span() returns a shared no-op object and incr()/observe()
+# return at once, so the calls can stay in the hot paths. A trace()
+# block records the spans opened inside it even when metrics are off
+# (the app uses it for its per-request timing breakdown).
+
+_enabled = os.environ.get("CRYPTO_INSTRUMENT", "").lower() in ("1", "true", "yes")
+_lock = threading.Lock()
+_counters = {}     # (name, labels) -> value
+_histograms = {}   # (name, labels) -> Histogram
+_trace = contextvars.ContextVar("crypto_trace", default=None)
+
+# Latency buckets in seconds (Prometheus client defaults, extended both ways)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+# Row-count buckets (batch sizes)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536, math.inf)
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+
+def is_enabled():
+    return _enabled
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+# --- COUNTERS & HISTOGRAMS ---
+
+class Histogram:
+    """
+    Fixed-bucket histogram (Prometheus style): per-bucket counts, sum and
+    count. Quantiles are estimated from the buckets.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[min(bisect_left(self.buckets, value), len(self.buckets) - 1)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile (None if empty).
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+def incr(name, value=1, **labels):
+    """
+    Adds `value` to a counter. No-op while metrics are disabled.
+    """
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=BUCKETS, **labels):
+    """
+    Records one value in a histogram. No-op while metrics are disabled.
+    """
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = Histogram(buckets)
+        hist.observe(value)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot():
+    """
+    Current metrics as plain dicts: counters by name and label string,
+    histograms with count, sum, mean and bucket-estimated p50/p99.
+    """
+    with _lock:
+        counters = {_label_name(n, labels): v for (n, labels), v in _counters.items()}
+        histograms = {
+            _label_name(n, labels): {"count": h.count, "sum": round(h.sum, 6),
+                                "mean": round(h.sum / h.count, 6) if h.count else None,
+                                "p50": h.quantile(0.5), "p99": h.quantile(0.99)}
+            for (n, labels), h in _histograms.items()
+        }
+    return {"enabled": _enabled, "counters": counters, "histograms": histograms}
+
+
+def _label_name(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+# --- SPANS & TRACES ---
+
+class Trace:
+    """
+    Spans opened inside a trace() block, in start order. Each span is
+    [name, seconds, depth, labels]; nested spans are included in their
+    parent's time.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.depth = 0
+        self.seconds = None
+
+    def table(self):
+        """
+        The spans as rows for display (name indented by depth, ms).
+        """
+        return [{"span": "  " * depth + name, "ms": round(seconds * 1000, 3) if seconds is not None else None,
+                 **labels}
+                for name, seconds, depth, labels in self.spans]
+
+
+class _Span:
+    __slots__ = ("name", "labels", "trace", "started", "index")
+
+    def __init__(self, name, labels, trace):
+        self.name = name
+        self.labels = labels
+        self.trace = trace
+
+    def __enter__(self):
+        trace = self.trace
+        if trace is not None:
+            self.index = len(trace.spans)
+            trace.spans.append([self.name, None, trace.depth, self.labels])
+            trace.depth += 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        if self.trace is not None:
+            self.trace.spans[self.index][1] = elapsed
+            self.trace.depth -= 1
+        if _enabled:
+            observe("span_seconds", elapsed, span=self.name, **self.labels)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, **labels):
+    """
+    Times a block: `with span("predict_proba", model="XGBoost"): ...`.
+    The duration goes to the span_seconds histogram (when enabled) and to
+    the active trace, if any.
+    """
+    trace = _trace.get()
+    if not _enabled and trace is None:
+        return _NOOP
+    return _Span(name, labels, trace)
+
+
+def timed(name=None):
+    """
+    Decorator form of span(); the span name defaults to module.function.
+    """
+    def wrap(fn):
+        label = name or f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+@contextmanager
+def trace():
+    """
+    Collects every span opened in this context (same thread / task):
+
+        with instrumentation.trace() as t:
+            ...
+        t.table()
+    """
+    t = Trace()
+    token = _trace.set(t)
+    started = time.perf_counter()
+    try:
+        yield t
+    finally:
+        t.seconds = time.perf_counter() - started
+        _trace.reset(token)
+
+
+# --- PROMETHEUS ---
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _bound_text(bound):
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+
+def prometheus_text(prefix="crypto_"):
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+    Counters get a _total suffix; histograms export cumulative buckets.
+    """
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, (h.buckets, list(h.counts), h.sum, h.count)) for k, h in _histograms.items())
+
+    lines = []
+    typed = set()
+    for (name, labels), value in counters:
+        metric = f"{prefix}{name}_total"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} counter")
+            typed.add(metric)
+        lines.append(f"{metric}{_labels_text(labels)} {value}")
+
+    for (name, labels), (buckets, counts, total, count) in histograms:
+        metric = f"{prefix}{name}"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} histogram")
+            typed.add(metric)
+        cumulative = 0
+        for bound, n in zip(buckets, counts):
+            cumulative += n
+            lines.append(f"{metric}_bucket{_labels_text(labels, [('le', _bound_text(bound))])} {cumulative}")
+        lines.append(f"{metric}_sum{_labels_text(labels)} {total}")
+        lines.append(f"{metric}_count{_labels_text(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# --- SAMPLING PROFILER ---
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a background thread snapshots the Python stacks
+    of the other threads every `interval` seconds and counts them.
+    Nothing is hooked into the profiled code, so the cost is a few stack
+    walks per interval and zero while stopped.
+
+        with SamplingProfiler() as prof:
+            ...
+        prof.top(20)
+    """
+
+    def __init__(self, interval=0.005, thread_ids=None, max_depth=64):
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids else None
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own or (self.thread_ids is not None and tid not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.samples[tuple(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def top(self, n=20):
+        """
+        The n functions seen most often: self samples (the function was
+        running) and total samples (it was anywhere on the stack), as
+        fractions of all samples.
+        """
+        own, total = Counter(), Counter()
+        samples = sum(self.samples.values()) or 1
+        for stack, count in self.samples.items():
+            if not stack:
+                continue
+            own[stack[-1]] += count
+            for fn in set(stack):
+                total[fn] += count
+        return [{"function": fn, "self": round(own[fn] / samples, 4), "total": round(count / samples, 4)}
+                for fn, count in total.most_common(n)]
+
+    def collapsed(self):
+        """
+        Stacks in the folded format ("a;b;c count") read by flamegraph.pl
+        and speedscope.
+        """
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.samples.most_common())
+
+
+_profiler = None
+
+
+def start_profiler(interval=0.005, thread_ids=None):
+    """
+    Turns the process-wide sampling profiler on (no-op if already running).
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(interval, thread_ids).start()
+    return _profiler
+
+
+def stop_profiler():
+    """
+    Turns the profiler off and returns it (None if it was not running).
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
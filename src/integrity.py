@@ -0,0 +1,429 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import data_fetcher
+import kline_store
+import resample
+
+# Kline integrity at ingest: overlapping fetches leave duplicate candles,
+# exchange outages and failed pages leave holes, and both silently shift
+# the rolling windows in feature_generator. Everything here is one pass
+# over a sorted open_time column (a sort only happens when rows arrive
+# out of order). Gaps are handled by policy:
+#   "refetch"  download the missing range (needs the symbol), then
+#              forward-fill whatever the exchange does not have either
+#   "ffill"    insert flat candles: OHLC = previous close, zero volume
+#   "report"   leave the rows as they are, only count the gaps
+# Store partitions get a _integrity.json manifest, so months that have
+# not changed since they were checked are skipped on later runs.
+
+POLICIES = ("refetch", "ffill", "report")
+
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+
+
+def _check_policy(policy):
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown gap policy: {policy} (use one of {POLICIES})")
+
+
+def _new_report():
+    return {"rows": 0, "invalid": 0, "duplicates": 0, "out_of_order": 0, "irregular": 0,
+            "gaps": 0, "missing": 0, "refetched": 0, "filled": 0}
+
+
+def _add_report(total, part):
+    for key, value in part.items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+
+# --- DETECTION ---
+
+def dedupe(df):
+    """
+    Sorts klines by open_time (only when they are out of order) and drops
+    duplicate open_times, keeping the last row of each, and rows without
+    an open_time. Returns (df, report).
+    """
+    report = _new_report()
+    valid = df["open_time"].notna().to_numpy()
+    if not valid.all():
+        report["invalid"] = int((~valid).sum())
+        df = df[valid]
+    ms = resample._to_ms(df["open_time"])
+
+    report["out_of_order"] = int((np.diff(ms) < 0).sum())
+    if report["out_of_order"]:
+        order = np.argsort(ms, kind="stable")
+        df, ms = df.iloc[order], ms[order]
+
+    # Last row of every run of equal open_times
+    keep = np.r_[ms[1:] != ms[:-1], True] if len(ms) else np.ones(0, dtype=bool)
+    report["duplicates"] = int(len(ms) - keep.sum())
+    if report["duplicates"]:
+        df = df[keep]
+    report["rows"] = len(df)
+    return df.reset_index(drop=True), report
+
+
+def find_gaps(open_ms, interval):
+    """
+    Missing candles in a sorted, duplicate-free open_time series (ms):
+    a list of {"start", "end", "missing"} with the first and last missing
+    open time (ms, inclusive) and the number of candles in between.
+    """
+    step = resample.step_ms(interval)
+    diffs = np.diff(open_ms)
+    at = np.flatnonzero(diffs > step)
+    return [{"start": int(open_ms[i] + step), "end": int(open_ms[i + 1] - step),
+             "missing": int((diffs[i] - 1) // step)} for i in at]
+
+
+def _irregular(open_ms, interval):
+    # Bars off the interval grid (wrong interval mixed in, shifted candles)
+    return int((resample.bucket_start(open_ms, interval) != open_ms).sum())
+
+
+# --- REPAIR ---
+
+def fill_gaps(df, interval):
+    """
+    Inserts a flat candle (OHLC = previous close, zero volumes and
+    trades) for every missing open time of a sorted, deduplicated
+    series. Other columns (e.g. symbol) repeat the previous row.
+    Returns (df, number of candles inserted).
+    """
+    step = resample.step_ms(interval)
+    ms = resample._to_ms(df["open_time"])
+    missing = np.maximum((np.diff(ms) - 1) // step, 0) if len(ms) > 1 else np.zeros(0, dtype=np.int64)
+    total = int(missing.sum())
+    if not total:
+        return df, 0
+
+    # Synthetic candle k copies row src[k] and sits offset[k] steps after it
+    src = np.repeat(np.arange(len(missing)), missing)
+    before = np.cumsum(missing) - missing
+    offset = np.arange(total) - np.repeat(before, missing) + 1
+    new_ms = ms[src] + offset * step
+
+    close = df["close"].iloc[src].reset_index(drop=True)
+    filled = {}
+    for col in df.columns:
+        if col == "open_time":
+            filled[col] = pd.Series(pd.to_datetime(new_ms, unit="ms")).astype(df[col].dtype) \
+                if pd.api.types.is_datetime64_any_dtype(df[col]) else pd.Series(new_ms, dtype=df[col].dtype)
+        elif col == "close_time":
+            values = new_ms + step - 1
+            filled[col] = pd.Series(pd.to_datetime(values, unit="ms")).astype(df[col].dtype) \
+                if pd.api.types.is_datetime64_any_dtype(df[col]) else pd.Series(values, dtype=df[col].dtype)
+        elif col in PRICE_COLUMNS:
+            filled[col] = close
+        elif col in resample.SUM_COLUMNS:
+            filled[col] = pd.Series(np.zeros(total, dtype=df[col].dtype))
+        else:
+            filled[col] = df[col].iloc[src].reset_index(drop=True)
+    filled = pd.DataFrame(filled)
+
+    # Final positions, so the merge is a take instead of a sort
+    pos_orig = np.arange(len(df)) + np.r_[0, np.cumsum(missing)]
+    pos_new = pos_orig[src] + offset
+    order = np.empty(len(df) + total, dtype=np.int64)
+    order[pos_orig] = np.arange(len(df))
+    order[pos_new] = len(df) + np.arange(total)
+    out = pd.concat([df.reset_index(drop=True), filled], ignore_index=True).iloc[order]
+    return out.reset_index(drop=True), total
+
+
+def refetch(symbol, interval, gaps, session=None):
+    """
+    Downloads the candles of `gaps` (see find_gaps) from Binance.
+    Returns typed klines (possibly fewer than missing: the exchange has
+    outages of its own).
+    """
+    frames = []
+    for gap in gaps:
+        df = data_fetcher.fetch_klines(symbol, interval, start_time=gap["start"], end_time=gap["end"],
+                                       session=session)
+        if not df.empty:
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=data_fetcher.KLINE_COLUMNS)
+    return kline_store.coerce_kline_types(pd.concat(frames, ignore_index=True))
+
+
+def repair(df, interval=None, policy="ffill", symbol=None, session=None):
+    """
+    Dedupes one kline series, then handles its gaps by policy (see the
+    module notes). interval defaults to the series' bar spacing.
+    Returns (df, report) with the counts of every fix.
+    """
+    _check_policy(policy)
+    if policy == "refetch" and symbol is None:
+        raise ValueError("The refetch policy needs a symbol")
+    df, report = dedupe(df)
+    if len(df) < 2:
+        return df, report
+    interval = interval or resample.infer_interval(df["open_time"])
+
+    ms = resample._to_ms(df["open_time"])
+    gaps = find_gaps(ms, interval)
+    report["irregular"] = _irregular(ms, interval)
+    report["gaps"] = len(gaps)
+    report["missing"] = sum(g["missing"] for g in gaps)
+
+    if gaps and policy == "refetch":
+        fetched = refetch(symbol, interval, gaps, session)
+        if len(fetched):
+            columns = [c for c in df.columns if c in fetched.columns]
+            df, _ = dedupe(pd.concat([df, fetched[columns]], ignore_index=True))
+            report["refetched"] = len(df) - report["rows"]
+    if policy in ("refetch", "ffill"):
+        df, report["filled"] = fill_gaps(df, interval)
+    report["rows"] = len(df)
+    return df, report
+
+
+def repair_chunks(chunks, interval=None, policy="ffill", symbol=None, report=None):
+    """
+    repair() over consecutive chunks (out of core): the last row of each
+    chunk is carried into the next, so gaps and duplicates across chunk
+    boundaries are caught too. Rows older than the previous chunk's last
+    can't be re-sorted into it and are dropped (counted as out_of_order).
+    Counts are added to `report` if given. Yields DataFrames.
+    """
+    report = report if report is not None else {}
+    carry = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if carry is not None:
+            late = (chunk["open_time"] <= carry["open_time"].iloc[0]).to_numpy()
+            late_rows = int(late.sum())
+            if late_rows:
+                # Equal open_times are ordinary duplicates, the rest arrived late
+                same = int((chunk["open_time"] == carry["open_time"].iloc[0]).sum())
+                _add_report(report, {"duplicates": same, "out_of_order": late_rows - same})
+                chunk = chunk[~late]
+            if chunk.empty:
+                continue
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if interval is None and len(chunk) > 1:
+            interval = resample.infer_interval(chunk["open_time"])
+        fixed, part = repair(chunk, interval, policy, symbol)
+        carry_rows = 1 if carry is not None else 0
+        part["rows"] -= carry_rows
+        _add_report(report, part)
+        carry = fixed.iloc[-1:]
+        yield fixed.iloc[carry_rows:]
+
+
+def summary(report):
+    """
+    One-line description of a repair report.
+    """
+    parts = [f"{report.get(k, 0)} {k.replace('_', ' ')}" for k in
+             ("duplicates", "out_of_order", "invalid", "irregular") if report.get(k)]
+    if report.get("gaps"):
+        parts.append(f"{report['gaps']} gaps ({report['missing']} candles)")
+    for k in ("refetched", "filled"):
+        if report.get(k):
+            parts.append(f"{report[k]} {k}")
+    return ", ".join(parts) if parts else "clean"
+
+
+# --- STORE PARTITIONS ---
+
+def manifest_path(symbol, interval, month):
+    return os.path.join(kline_store.partition_dir(symbol, interval, month), "_integrity.json")
+
+
+def load_manifest(symbol, interval, month):
+    try:
+        with open(manifest_path(symbol, interval, month)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save_manifest(manifest):
+    path = manifest_path(manifest["symbol"], manifest["interval"], manifest["month"])
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _fingerprint(files, start_ms, end_ms):
+    # Part files (name, size, mtime) + the expected range they were checked against
+    stats = [[os.path.basename(f), os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in files]
+    return {"files": stats, "expected": [int(start_ms), int(end_ms)]}
+
+
+def _read_open_ms(files):
+    # Only the open_time column, in part-file order
+    if not files:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate([resample._to_ms(pq.read_table(f, columns=["open_time"]).column("open_time")
+                                           .to_pandas()) for f in files])
+
+
+def _iso(ms):
+    return pd.Timestamp(int(ms), unit="ms").isoformat()
+
+
+def _ms(iso):
+    return pd.Timestamp(iso).value // 1_000_000
+
+
+def _refetched_gaps(manifest):
+    # Older manifests only recorded that the month's gaps had been asked for
+    if "refetched_gaps" in manifest:
+        return manifest["refetched_gaps"]
+    if manifest.get("refetch_attempted"):
+        return [{"start": g["start"], "end": g["end"]} for g in manifest["gaps"]]
+    return []
+
+
+def check_partition(symbol, interval, month, start_ms, end_ms, force=False):
+    """
+    Validates one month partition against the candles expected in
+    [start_ms, end_ms): duplicates and out-of-order rows are fixed in
+    place (the month is rewritten sorted, newest part wins), gaps are
+    recorded. The result is saved as the partition's manifest; an
+    unchanged partition (same files, same expected range) is not read
+    again unless force. What was already refetched for the month is kept
+    across re-checks. Returns the manifest.
+    """
+    files = kline_store._part_files(symbol, interval, [month])
+    fingerprint = _fingerprint(files, start_ms, end_ms)
+    previous = load_manifest(symbol, interval, month)
+    if not force and previous is not None and previous.get("fingerprint") == fingerprint:
+        return previous
+    previous = previous or {}
+
+    ms = _read_open_ms(files)
+    diffs = np.diff(ms)
+    out_of_order = int((diffs < 0).sum())
+    if out_of_order:
+        ms = np.sort(ms, kind="stable")
+    duplicates = int((np.diff(ms) == 0).sum())
+    if out_of_order or duplicates:
+        kline_store.compact(symbol, interval, month, dedupe=True)
+        files = kline_store._part_files(symbol, interval, [month])
+        fingerprint = _fingerprint(files, start_ms, end_ms)
+        ms = np.unique(ms)
+
+    step = resample.step_ms(interval)
+    # Sentinels at both ends turn leading/trailing holes into ordinary gaps
+    bounded = np.r_[start_ms - step, ms, end_ms]
+    gaps = find_gaps(bounded, interval)
+    manifest = {
+        "symbol": symbol,
+        "interval": interval,
+        "month": month,
+        "checked_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "fingerprint": fingerprint,
+        "rows": len(ms),
+        "first": _iso(ms[0]) if len(ms) else None,
+        "last": _iso(ms[-1]) if len(ms) else None,
+        "duplicates": duplicates,
+        "out_of_order": out_of_order,
+        "irregular": _irregular(ms, interval),
+        "gaps": [{"start": _iso(g["start"]), "end": _iso(g["end"]), "missing": g["missing"]} for g in gaps],
+        "missing": sum(g["missing"] for g in gaps),
+        "refetched": previous.get("refetched", 0),
+        # Gaps already asked for (see check_store), never asked for again
+        "refetched_gaps": _refetched_gaps(previous),
+    }
+    manifest["status"] = "ok" if not gaps and not manifest["irregular"] else "gaps"
+    _save_manifest(manifest)
+    return manifest
+
+
+def _expected_ranges(symbol, interval):
+    # [start, end) per stored month: from the first stored candle (the
+    # listing) to the newest one, up to the next stored month, so a month
+    # missing entirely shows up as a trailing gap of the one before
+    months = kline_store.list_months(symbol, interval)
+    first, last = kline_store.first_open_time(symbol, interval), kline_store.last_open_time(symbol, interval)
+    if not months or first is None:
+        return {}
+    step = resample.step_ms(interval)
+
+    def month_start(month):
+        ms = pd.Period(month, "M").start_time.value // 1_000_000
+        # First grid candle opening in the month (weeks/3d don't start on the 1st)
+        aligned = int(resample.bucket_start(np.array([ms]), interval)[0])
+        return aligned if aligned >= ms else aligned + step
+
+    ranges = {}
+    for i, month in enumerate(months):
+        start = first.value // 1_000_000 if i == 0 else month_start(month)
+        end = month_start(months[i + 1]) if i + 1 < len(months) else last.value // 1_000_000 + step
+        ranges[month] = (start, end)
+    return ranges
+
+
+def check_store(symbol, interval, policy="report", force=False, session=None):
+    """
+    Validates every month partition of a symbol/interval in the kline
+    store (see check_partition), skipping the ones already checked.
+    policy="refetch" downloads the gaps found and merges them into the
+    store (kline_store.append_klines(merge=True)); gaps the exchange has
+    no data for stay recorded and are not asked for again, even after the
+    partition changes. Synthetic candles are never written to the store:
+    "ffill" is applied where the store is read
+    (data_processor.clean_store_data).
+    Returns {month: manifest}.
+    """
+    _check_policy(policy)
+    symbol = symbol.upper()
+    manifests = {}
+    attempted = []  # [start, end] ms of every gap asked for in this run
+    for month, (start, end) in _expected_ranges(symbol, interval).items():
+        manifest = check_partition(symbol, interval, month, start, end, force=force)
+        pending = [g for g in manifest["gaps"]
+                   if {"start": g["start"], "end": g["end"]} not in _refetched_gaps(manifest)]
+        if pending and policy == "refetch":
+            gaps = [{"start": _ms(g["start"]), "end": _ms(g["end"])} for g in pending]
+            fetched = refetch(symbol, interval, gaps, session)
+            if len(fetched):
+                kline_store.append_klines(fetched, symbol, interval, merge=True)
+            attempted += [(g["start"], g["end"]) for g in gaps]
+            manifest = check_partition(symbol, interval, month, start, end, force=True)
+            manifest["refetched"] += len(fetched)
+            manifest["refetched_gaps"] += [{"start": g["start"], "end": g["end"]} for g in pending]
+            _save_manifest(manifest)
+        manifests[month] = manifest
+
+    if attempted:
+        # Fetched rows may have filled months that were missing entirely,
+        # which also moves the expected range of the month before them.
+        # What is still missing inside a range just asked for counts as refetched.
+        for month, (start, end) in _expected_ranges(symbol, interval).items():
+            manifest = check_partition(symbol, interval, month, start, end)
+            done = _refetched_gaps(manifest)
+            new = [{"start": g["start"], "end": g["end"]} for g in manifest["gaps"]
+                   if {"start": g["start"], "end": g["end"]} not in done
+                   and any(lo <= _ms(g["start"]) and _ms(g["end"]) <= hi for lo, hi in attempted)]
+            if new:
+                manifest["refetched_gaps"] = done + new
+                _save_manifest(manifest)
+            manifests[month] = manifest
+
+    bad = {m: v for m, v in manifests.items() if v["status"] != "ok"}
+    missing = sum(v["missing"] for v in bad.values())
+    print(f"   {symbol} {interval}: {len(manifests)} partitions checked, "
+          + (f"{missing} candles missing in {len(bad)}" if bad else "no gaps"))
+    return manifests
+
+
+if __name__ == "__main__":
+    for symbol in ("BTCUSDT",):
+        check_store(symbol, "1m")
@@ -0,0 +1,426 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+def data_dir():
+    """
+    Root data folder. Defaults to <project_root>/data and can be pointed
+    elsewhere with the CRYPTO_DATA_DIR environment variable.
+    """
+    override = os.environ.get("CRYPTO_DATA_DIR")
+    if override:
+        return override
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_script_dir)
+    return os.path.join(project_root, 'data')
+
+
+# --- TYPES ---
+
+TIME_COLS = ["open_time", "close_time"]
+FLOAT_COLS = [
+    "open", "high", "low", "close", "volume",
+    "quote_asset_volume", "taker_base_volume", "taker_quote_volume"
+]
+INT_COLS = ["num_trades", "ignore"]
+
+# Memory-lean dtypes (downcast): float32 carries ~7 significant digits,
+# plenty for prices, indicators and model inputs
+LEAN_INT_DTYPES = {"num_trades": np.int32, "ignore": np.int32, "label": np.int8}
+
+KLINE_SCHEMA = pa.schema(
+    [("open_time", pa.timestamp("ms"))]
+    + [(c, pa.float64()) for c in ["open", "high", "low", "close", "volume"]]
+    + [("close_time", pa.timestamp("ms")), ("quote_asset_volume", pa.float64()),
+       ("num_trades", pa.int64()), ("taker_base_volume", pa.float64()),
+       ("taker_quote_volume", pa.float64()), ("ignore", pa.int64())]
+)
+
+
+def coerce_kline_types(df):
+    """
+    Converts raw Binance klines (ms timestamps, string prices) to typed
+    columns in place: datetimes for the time columns, floats for prices
+    and volumes. Columns that are missing are skipped.
+    """
+    for col in TIME_COLS:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            if pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_datetime(df[col], unit='ms')
+            else:
+                df[col] = pd.to_datetime(df[col])
+
+    for col in FLOAT_COLS + INT_COLS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    return df
+
+
+def downcast(df):
+    """
+    Switches df to memory-lean dtypes in place: float32 for every float
+    column, int32/int8 for counts and labels, and a categorical symbol
+    column. The mapping is fixed, so every chunk of a chunked run gets
+    the same schema.
+    """
+    for col in df.columns:
+        dtype = df[col].dtype
+        if col == "symbol":
+            if not isinstance(dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("category")
+        elif pd.api.types.is_float_dtype(dtype):
+            if dtype != np.float32:
+                df[col] = df[col].astype(np.float32)
+        elif col in LEAN_INT_DTYPES and pd.api.types.is_integer_dtype(dtype):
+            df[col] = df[col].astype(LEAN_INT_DTYPES[col])
+    return df
+
+
+# --- STAGE HAND-OFF ---
+
+# Each pipeline stage writes one typed Parquet file that the next stage reads
+STAGES = {
+    "processed": ("processed", "processed_data"),
+    "feature_engineered": ("feature_engineered", "feature_engineered_data"),
+    "labeled": ("labeled", "labeled_data"),
+    "label_sweep": ("labeled", "label_sweep"),
+}
+
+
+def stage_path(stage, ext="parquet"):
+    folder, name = STAGES[stage]
+    return os.path.join(data_dir(), folder, f"{name}.{ext}")
+
+
+def write_stage(df, stage):
+    """
+    Saves a stage output as Parquet (dtypes preserved, no re-parsing downstream).
+    Returns the path written.
+    """
+    path = stage_path(stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_parquet(path, index=False)
+    return path
+
+
+class StageWriter:
+    """
+    Writes a stage chunk by chunk with a Parquet writer, for data that
+    does not fit in memory at once. The first chunk fixes the schema
+    (categoricals are stored as int32-indexed dictionaries, so chunks
+    with different category sets still match). Rows go to a temp file
+    that replaces the stage on close; on error the temp file is removed.
+
+        with StageWriter("processed") as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, stage, row_group_size=1_000_000):
+        self.path = stage_path(stage)
+        self.tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+
+    def write(self, df):
+        if self._writer is None:
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            for i, field in enumerate(schema):
+                if pa.types.is_dictionary(field.type):
+                    schema = schema.set(i, field.with_type(pa.dictionary(pa.int32(), field.type.value_type)))
+            self._schema = schema
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._writer = pq.ParquetWriter(self.tmp_path, schema)
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is None:
+            return None
+        self._writer.close()
+        self._writer = None
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def iter_stage(stage, columns=None, batch_rows=1_000_000):
+    """
+    Yields a stage output as DataFrames of at most batch_rows rows, so it
+    can be processed out of core. Falls back to the legacy CSV like
+    read_stage. Yields nothing if neither exists.
+    """
+    path = stage_path(stage)
+    if os.path.exists(path):
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    csv_path = stage_path(stage, "csv")
+    if os.path.exists(csv_path):
+        for df in pd.read_csv(csv_path, usecols=columns, chunksize=batch_rows):
+            for col in TIME_COLS:
+                if col in df.columns:
+                    df[col] = pd.to_datetime(df[col])
+            yield df
+
+
+def stage_columns(stage):
+    """
+    Column names of a stage's Parquet output (read from the footer), or
+    None if it has not been written.
+    """
+    path = stage_path(stage)
+    if not os.path.exists(path):
+        return None
+    return pq.ParquetFile(path).schema_arrow.names
+
+
+def stage_exists(stage):
+    return os.path.exists(stage_path(stage)) or os.path.exists(stage_path(stage, "csv"))
+
+
+def read_stage(stage, columns=None):
+    """
+    Loads a stage output, reading only `columns` if given.
+    Falls back to the legacy CSV (re-typing the time columns) when no
+    Parquet file has been written yet. Returns None if neither exists.
+    """
+    path = stage_path(stage)
+    if os.path.exists(path):
+        return pd.read_parquet(path, columns=columns, memory_map=True)
+
+    csv_path = stage_path(stage, "csv")
+    if os.path.exists(csv_path):
+        df = pd.read_csv(csv_path, usecols=columns)
+        for col in TIME_COLS:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col])
+        return df
+
+    return None
+
+
+# --- PARTITIONED KLINE STORE ---
+# Layout: data/store/klines/symbol=<S>/interval=<I>/month=<YYYY-MM>/part-<first_open_ms>.parquet
+
+def _klines_root():
+    return os.path.join(data_dir(), 'store', 'klines')
+
+
+def partition_dir(symbol, interval, month=None):
+    path = os.path.join(_klines_root(), f"symbol={symbol}", f"interval={interval}")
+    if month is not None:
+        path = os.path.join(path, f"month={month}")
+    return path
+
+
+def list_months(symbol, interval):
+    """
+    Sorted 'YYYY-MM' partitions stored for a symbol/interval.
+    """
+    root = partition_dir(symbol, interval)
+    if not os.path.isdir(root):
+        return []
+    months = [d.split("=", 1)[1] for d in os.listdir(root) if d.startswith("month=")]
+    return sorted(months)
+
+
+def _part_files(symbol, interval, months):
+    files = []
+    for month in months:
+        files.extend(sorted(glob.glob(os.path.join(partition_dir(symbol, interval, month), "part-*.parquet"))))
+    return files
+
+
+def _month_key(ts):
+    return pd.Timestamp(ts).strftime("%Y-%m")
+
+
+def _open_time_bound(symbol, interval, newest):
+    # Footer statistics of the files in the newest (oldest) month partition
+    months = list_months(symbol, interval)
+    while months:
+        files = _part_files(symbol, interval, [months.pop() if newest else months.pop(0)])
+        bound = None
+        for path in files:
+            meta = pq.ParquetFile(path).metadata
+            col = meta.schema.to_arrow_schema().get_field_index("open_time")
+            for rg in range(meta.num_row_groups):
+                stats = meta.row_group(rg).column(col).statistics
+                if stats is not None and stats.has_min_max:
+                    value = stats.max if newest else stats.min
+                    bound = value if bound is None else (max(bound, value) if newest else min(bound, value))
+        if bound is not None:
+            return pd.Timestamp(bound)
+    return None
+
+
+def last_open_time(symbol, interval):
+    """
+    Newest stored open_time as a Timestamp, or None. Only reads the
+    footer statistics of the files in the newest month partition.
+    """
+    return _open_time_bound(symbol, interval, newest=True)
+
+
+def first_open_time(symbol, interval):
+    """
+    Oldest stored open_time as a Timestamp, or None (footer statistics
+    of the oldest month partition).
+    """
+    return _open_time_bound(symbol, interval, newest=False)
+
+
+def append_klines(df, symbol, interval, row_group_size=100_000, merge=False):
+    """
+    Appends klines to the store. Rows at or before the newest stored
+    open_time are ignored, so the store stays append-only and sorted.
+    Each call writes one new part file per touched month.
+    merge=True merges those older rows into their month partitions
+    instead (e.g. refetched gaps, see integrity.py); a stored row with
+    the same open_time is replaced.
+    Returns the number of rows written.
+    """
+    df = coerce_kline_types(df.copy())
+    df = df.sort_values("open_time").drop_duplicates("open_time", keep="last")
+
+    last = last_open_time(symbol, interval)
+    merged = 0
+    if last is not None:
+        if merge:
+            merged = merge_klines(df[df["open_time"] <= last], symbol, interval)
+        df = df[df["open_time"] > last]
+    if df.empty:
+        return merged
+
+    columns = [f.name for f in KLINE_SCHEMA if f.name in df.columns]
+    schema = pa.schema([KLINE_SCHEMA.field(c) for c in columns])
+    months = df["open_time"].dt.strftime("%Y-%m")
+
+    for month, chunk in df.groupby(months, sort=True):
+        out_dir = partition_dir(symbol, interval, month)
+        os.makedirs(out_dir, exist_ok=True)
+        first_ms = int(chunk["open_time"].iloc[0].value // 1_000_000)
+        table = pa.Table.from_pandas(chunk[columns], schema=schema, preserve_index=False)
+
+        # Write then rename so readers never see a half-written part
+        final_path = os.path.join(out_dir, f"part-{first_ms}.parquet")
+        tmp_path = final_path + ".tmp"
+        pq.write_table(table, tmp_path, row_group_size=row_group_size)
+        os.replace(tmp_path, final_path)
+
+    return merged + len(df)
+
+
+def read_klines(symbol, interval, start=None, end=None, columns=None):
+    """
+    Reads klines for one symbol/interval with column projection and
+    time-range pushdown: month partitions outside [start, end) are never
+    opened, and row groups are filtered on their open_time statistics.
+    """
+    months = list_months(symbol, interval)
+    if start is not None:
+        start = pd.Timestamp(start)
+        months = [m for m in months if m >= _month_key(start)]
+    if end is not None:
+        end = pd.Timestamp(end)
+        months = [m for m in months if m <= _month_key(end)]
+
+    files = _part_files(symbol, interval, months)
+    if not files:
+        return pd.DataFrame(columns=columns or [f.name for f in KLINE_SCHEMA])
+
+    dataset = ds.dataset(files, format="parquet")
+    expr = None
+    if start is not None:
+        expr = ds.field("open_time") >= pa.scalar(start.value // 1_000_000, pa.timestamp("ms"))
+    if end is not None:
+        upper = ds.field("open_time") < pa.scalar(end.value // 1_000_000, pa.timestamp("ms"))
+        expr = upper if expr is None else expr & upper
+
+    table = dataset.to_table(columns=columns, filter=expr)
+    df = table.to_pandas()
+    if "open_time" in df.columns:
+        df = df.sort_values("open_time", kind="stable").reset_index(drop=True)
+    return df
+
+
+def _rewrite_month(symbol, interval, month, extra=None):
+    # One sorted file per month, duplicate open_times dropped: the row
+    # from the newest part wins, `extra` rows win over stored ones
+    files = _part_files(symbol, interval, [month])
+    tables = [pq.read_table(f) for f in files]
+    if extra is not None:
+        columns = [f.name for f in KLINE_SCHEMA if f.name in extra.columns]
+        schema = pa.schema([KLINE_SCHEMA.field(c) for c in columns])
+        tables.append(pa.Table.from_pandas(extra[columns], schema=schema, preserve_index=False))
+    if not tables:
+        return 0
+    table = pa.concat_tables(tables, promote_options="default")
+    df = table.to_pandas()
+    df = df.sort_values("open_time", kind="stable").drop_duplicates("open_time", keep="last")
+    table = pa.Table.from_pandas(df, schema=table.schema, preserve_index=False)
+
+    out_dir = partition_dir(symbol, interval, month)
+    os.makedirs(out_dir, exist_ok=True)
+    first_ms = int(df["open_time"].iloc[0].value // 1_000_000)
+    final_path = os.path.join(out_dir, f"part-{first_ms}.parquet")
+    tmp_path = final_path + ".tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, final_path)
+    for f in files:
+        if f != final_path:
+            os.remove(f)
+    return len(df)
+
+
+def merge_klines(df, symbol, interval):
+    """
+    Merges klines of any age into the store: every touched month is
+    rewritten as one sorted file without duplicate open_times (the new
+    rows win). Returns the number of rows merged.
+    """
+    if df.empty:
+        return 0
+    df = coerce_kline_types(df.copy())
+    for month, chunk in df.groupby(df["open_time"].dt.strftime("%Y-%m"), sort=True):
+        _rewrite_month(symbol, interval, month, extra=chunk)
+    return len(df)
+
+
+def compact(symbol, interval, month, dedupe=False):
+    """
+    Merges all part files of one month into a single file (sorted,
+    duplicate open_times dropped). dedupe=True also rewrites a single
+    file, e.g. one written with duplicates by an older version.
+    """
+    files = _part_files(symbol, interval, [month])
+    if len(files) < (1 if dedupe else 2):
+        return
+    _rewrite_month(symbol, interval, month)
@@ -1,8 +1,25 @@
 
 import pandas as pd
 import numpy as np
-import os
+import instrumentation
+import kline_store
+from numpy.lib.stride_tricks import sliding_window_view
 
+# Marks bars that cannot be labeled in a sweep (no future bars left)
+NO_LABEL = -1
+
+
+def _volatility(df):
+    # Check if volatility exists, if not re-calculate
+    if 'volatility' in df.columns:
+        volatility = df['volatility']
+    else:
+        volatility = df['close'].pct_change().rolling(window=20).std()
+    # We fill NaNs with the mean so we don't lose data
+    return volatility.fillna(volatility.mean())
+
+
+@instrumentation.timed("stage.label")
 def create_labels(method='dynamic', threshold=0.02, sensitivity=0.5):
     '''
     Generates labels for Buy/Sell/Hold.
@@ -15,33 +32,24 @@ def create_labels(method='dynamic', threshold=0.02, sensitivity=0.5):
                              Lower = More signals (Fixes Imbalance).
                              Higher = Fewer signals (More precise).
     '''
-    # --- PATH SETUP ---
-    current_script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(current_script_dir)
-    input_path = os.path.join(project_root, 'data', 'feature_engineered', 'feature_engineered_data.csv')
-    output_dir = os.path.join(project_root, 'data', 'labeled')
-    output_path = os.path.join(output_dir, 'labeled_data.csv')
-
     print(f" Starting Smart Labeling ({method} mode)...")
 
-    if not os.path.exists(input_path):
-        print(f" Error: File not found at {input_path}")
+    df = kline_store.read_stage("feature_engineered")
+    if df is None:
+        print(f" Error: File not found at {kline_store.stage_path('feature_engineered')}")
         return None
 
-    df = pd.read_csv(input_path)
-
     # 1. Calculate Future Return (The Target)
-    df['future_return'] = df['close'].pct_change().shift(-1)
+    if 'symbol' in df.columns:
+        # Multi-symbol history: never look across into the next symbol
+        df['future_return'] = df.groupby('symbol', observed=True)['close'].shift(-1) / df['close'] - 1
+    else:
+        df['future_return'] = df['close'].pct_change().shift(-1)
 
     # 2. Define Thresholds
     if method == 'dynamic':
-        # Check if volatility exists, if not re-calculate
-        if 'volatility' not in df.columns:
-            df['volatility'] = df['close'].pct_change().rolling(window=20).std()
-
         # Dynamic: Threshold changes every day based on market noise
-        # We fill NaNs with the mean so we don't lose data
-        volatility = df['volatility'].fillna(df['volatility'].mean())
+        volatility = _volatility(df)
 
         df['threshold_buy'] = volatility * sensitivity
         df['threshold_sell'] = -volatility * sensitivity
@@ -62,11 +70,163 @@ def create_labels(method='dynamic', threshold=0.02, sensitivity=0.5):
     # 4. Cleanup & Save
     df = df.dropna(subset=['future_return'])
 
-    os.makedirs(output_dir, exist_ok=True)
-    df.to_csv(output_path, index=False)
+    output_path = kline_store.write_stage(df, "labeled")
 
     print(f" Labels Generated. Saved to: {output_path}")
     print("--- Class Distribution ---")
     print(df['label'].value_counts().sort_index())
 
     return df
+
+
+# --- LABEL SWEEP ---
+# Every (threshold, horizon) setting is one row of an int8 label matrix.
+# The future-return rows are broadcast against a column of thresholds, so
+# a whole grid costs one pass over the data instead of one
+# read-label-write round trip per setting.
+
+def future_returns(close, horizons=(1,)):
+    '''
+    (len(horizons), bars) forward returns close[t+h] / close[t] - 1,
+    NaN where t+h runs past the last bar.
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full((len(horizons), len(close)), np.nan)
+    for i, h in enumerate(horizons):
+        if h < len(close):
+            out[i, :len(close) - h] = close[h:] / close[:-h] - 1
+    return out
+
+
+def label_matrix(future_return, threshold_buy, threshold_sell):
+    '''
+    Same rule as create_labels (2 = BUY, 0 = SELL, 1 = HOLD), for any
+    shapes that broadcast, e.g. returns (bars,) against thresholds
+    (settings, 1) or (settings, bars). Missing returns get NO_LABEL.
+    '''
+    future_return = np.asarray(future_return, dtype=np.float64)
+    labels = np.where(future_return > threshold_buy, np.int8(2),
+                      np.where(future_return < threshold_sell, np.int8(0), np.int8(1)))
+    labels[np.broadcast_to(np.isnan(future_return), labels.shape)] = NO_LABEL
+    return labels
+
+
+def barrier_labels(close, threshold_buy, threshold_sell, horizon, max_bytes=64 << 20):
+    '''
+    Triple-barrier labels: BUY if the close path rises above +threshold_buy
+    within `horizon` bars before it falls below threshold_sell, SELL for
+    the opposite, HOLD if neither barrier is hit (or both on the same bar).
+    Thresholds are (settings, bars) or (settings, 1). Bars without a full
+    horizon ahead get NO_LABEL. Works on chunks of bars so the
+    (settings, bars, horizon) hit masks stay under max_bytes.
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    buy = np.broadcast_to(np.asarray(threshold_buy, dtype=np.float64), (np.shape(threshold_buy)[0], n))
+    sell = np.broadcast_to(np.asarray(threshold_sell, dtype=np.float64), buy.shape)
+    labels = np.full(buy.shape, NO_LABEL, dtype=np.int8)
+    complete = n - horizon
+    if complete <= 0:
+        return labels
+
+    # paths[t, j] = close[t+j+1] / close[t] - 1
+    paths = sliding_window_view(close[1:], horizon)[:complete] / close[:complete, None] - 1
+    step = max(1, int(max_bytes // (len(buy) * horizon * 2)))
+    for start in range(0, complete, step):
+        stop = min(start + step, complete)
+        window = paths[None, start:stop]
+        up = window > buy[:, start:stop, None]
+        down = window < sell[:, start:stop, None]
+        # First bar each barrier is hit; `horizon` if never
+        first_up = np.where(up.any(axis=-1), up.argmax(axis=-1), horizon)
+        first_down = np.where(down.any(axis=-1), down.argmax(axis=-1), horizon)
+        labels[:, start:stop] = np.where(first_up < first_down, np.int8(2),
+                                         np.where(first_down < first_up, np.int8(0), np.int8(1)))
+    return labels
+
+
+def class_distribution(labels, names=None):
+    '''
+    Per-row SELL/HOLD/BUY counts and shares of a label matrix (NO_LABEL
+    ignored), plus `balance`: the normalised entropy of the shares
+    (1 = equal classes, 0 = a single class).
+    '''
+    labels = np.atleast_2d(labels)
+    counts = np.stack([(labels == c).sum(axis=-1) for c in (0, 1, 2)], axis=-1)
+    total = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(total > 0, counts / total, 0.0)
+        entropy = -np.where(shares > 0, shares * np.log(shares), 0.0).sum(axis=-1)
+    table = pd.DataFrame({
+        "bars": total[:, 0],
+        "sell": counts[:, 0], "hold": counts[:, 1], "buy": counts[:, 2],
+        "sell_pct": shares[:, 0], "hold_pct": shares[:, 1], "buy_pct": shares[:, 2],
+        "balance": entropy / np.log(3),
+    })
+    if names is not None:
+        table.insert(0, "column", list(names))
+    return table
+
+
+@instrumentation.timed("stage.label_sweep")
+def sweep_labels(sensitivities=(0.25, 0.5, 0.75, 1.0), thresholds=(0.01, 0.02, 0.03), horizons=(1,),
+                 barrier=False, save=True):
+    '''
+    Labels the feature_engineered data for every setting at once:
+    'dynamic' labels for each sensitivity and 'fixed' labels for each
+    threshold, at each horizon (bars ahead). barrier=True uses
+    triple-barrier labels (first barrier hit within the horizon) instead
+    of the return at the horizon.
+
+    The labels are saved as int8 columns (label_<method>_<value>_h<horizon>,
+    NO_LABEL where the horizon runs past the data) next to the labeled
+    stage. Returns (labels DataFrame, class distribution per setting).
+    '''
+    print(f" Sweeping {len(sensitivities) + len(thresholds)} thresholds x {len(horizons)} horizons...")
+
+    df = kline_store.read_stage("feature_engineered")
+    if df is None:
+        print(f" Error: File not found at {kline_store.stage_path('feature_engineered')}")
+        return None, None
+
+    close = df['close'].to_numpy(dtype=np.float64)
+    settings = [("dynamic", float(s)) for s in sensitivities] + [("fixed", float(t)) for t in thresholds]
+    # (settings, bars) thresholds: volatility-scaled rows and constant rows
+    buy = np.empty((len(settings), len(close)))
+    if len(sensitivities):
+        volatility = _volatility(df).to_numpy(dtype=np.float64)
+        buy[:len(sensitivities)] = np.asarray(sensitivities, dtype=np.float64)[:, None] * volatility[None, :]
+    buy[len(sensitivities):] = np.asarray(thresholds, dtype=np.float64)[:, None]
+
+    # Multi-symbol history (symbols stored one after another): a bar whose
+    # horizon crosses into the next symbol has no label
+    codes = pd.factorize(df['symbol'])[0] if 'symbol' in df.columns else None
+
+    blocks, rows = [], []
+    returns = None if barrier else future_returns(close, horizons)
+    for i, h in enumerate(horizons):
+        if barrier:
+            block = barrier_labels(close, buy, -buy, h)
+        else:
+            block = label_matrix(returns[i][None, :], buy, -buy)
+        if codes is not None and h < len(codes):
+            block[:, :len(codes) - h][:, codes[h:] != codes[:-h]] = NO_LABEL
+        blocks.append(block)
+        rows += [(method, value, h) for method, value in settings]
+    matrix = np.concatenate(blocks)
+
+    names = [f"label_{method}_{value:g}_h{h}" for method, value, h in rows]
+    labels = pd.DataFrame(dict(zip(names, matrix)))
+    labels.insert(0, 'open_time', df['open_time'].to_numpy())
+
+    distribution = class_distribution(matrix, names)
+    distribution.insert(1, "method", [r[0] for r in rows])
+    distribution.insert(2, "value", [r[1] for r in rows])
+    distribution.insert(3, "horizon", [r[2] for r in rows])
+
+    if save:
+        output_path = kline_store.write_stage(labels, "label_sweep")
+        print(f" Label sweep saved to: {output_path}")
+    print("--- Class Distribution per Setting ---")
+    print(distribution.drop(columns="column").to_string(index=False, float_format="{:.3f}".format))
+    return labels, distribution
@@ -0,0 +1,312 @@
+import json
+import math
+import multiprocessing
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+from sklearn.metrics import accuracy_score, log_loss
+from threadpoolctl import threadpool_limits
+
+import features
+import kline_store
+import train
+
+warnings.filterwarnings('ignore')
+
+CLASSES = [0, 1, 2]
+
+# Hyperparameter grids searched for each model
+SEARCH_SPACES = {
+    "LogisticRegression": {"C": [0.01, 0.1, 1.0, 10.0]},
+    "RandomForest": {"max_depth": [4, 6, 10, 14], "min_samples_leaf": [1, 5, 20], "max_features": ["sqrt", 0.5]},
+    "XGBoost": {"learning_rate": [0.02, 0.05, 0.1], "max_depth": [3, 5, 7], "subsample": [0.7, 1.0],
+                "colsample_bytree": [0.7, 1.0]},
+    "LightGBM": {"learning_rate": [0.02, 0.05, 0.1], "num_leaves": [15, 31, 63], "min_child_samples": [10, 20, 50],
+                 "subsample": [0.7, 1.0], "subsample_freq": [1]},
+    "CatBoost": {"learning_rate": [0.02, 0.05, 0.1], "depth": [4, 6, 8], "l2_leaf_reg": [1, 3, 10]},
+}
+
+# The budget successive halving hands out: trees / iterations per model
+RESOURCE_PARAM = {
+    "LogisticRegression": "max_iter",
+    "RandomForest": "n_estimators",
+    "XGBoost": "n_estimators",
+    "LightGBM": "n_estimators",
+    "CatBoost": "iterations",
+}
+
+BOOSTED = {"XGBoost", "LightGBM", "CatBoost"}
+
+
+# --- SPLITS ---
+
+def walk_forward_splits(n_samples, n_splits=5, test_size=None, purge=1, embargo=0,
+                        expanding=True, max_train_size=None):
+    """
+    Walk-forward folds: each test window follows its training window in
+    time. `purge` samples before the test window are dropped from training
+    (labels look `purge` bars ahead), and `embargo` adds a further gap.
+    Returns [(train_indices, test_indices)].
+    """
+    test_size = test_size or n_samples // (n_splits + 1)
+    gap = purge + embargo
+    splits = []
+    for k in range(n_splits):
+        test_start = n_samples - (n_splits - k) * test_size
+        train_end = test_start - gap
+        if train_end <= 0:
+            continue
+        train_start = 0 if expanding else max(0, train_end - test_size * 2)
+        if max_train_size:
+            train_start = max(train_start, train_end - max_train_size)
+        splits.append((np.arange(train_start, train_end), np.arange(test_start, test_start + test_size)))
+    return splits
+
+
+def purged_kfold_splits(n_samples, n_splits=5, purge=1, embargo=0):
+    """
+    Purged K-fold: contiguous test blocks; training uses everything else
+    except `purge` samples before each block and `embargo` samples after it.
+    """
+    bounds = np.linspace(0, n_samples, n_splits + 1, dtype=int)
+    splits = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        keep = np.ones(n_samples, dtype=bool)
+        keep[max(0, start - purge):min(n_samples, end + embargo)] = False
+        splits.append((np.flatnonzero(keep), np.arange(start, end)))
+    return splits
+
+
+# --- SHARED FEATURE MATRIX ---
+# The matrix is copied into shared memory once; workers map it instead
+# of receiving a pickled copy per trial.
+
+class SharedArray:
+    """
+    Owns a numpy array placed in a SharedMemory block.
+    """
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.shape, self.dtype = array.shape, array.dtype.str
+        np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf)[...] = array
+
+    @property
+    def spec(self):
+        return (self.shm.name, self.shape, self.dtype)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+_worker = {}
+
+
+def _open_shared(name, untrack):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if untrack:
+            # Python < 3.13 with spawned workers: each worker has its own
+            # resource tracker, which would unlink the parent's block on exit
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _attach(x_spec, y_spec, splits, n_threads, untrack):
+    for key, (name, shape, dtype) in (("X", x_spec), ("y", y_spec)):
+        shm = _open_shared(name, untrack)
+        _worker[key + "_shm"] = shm
+        _worker[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _worker["splits"] = splits
+    _worker["threads"] = n_threads
+
+
+# --- TRIALS ---
+
+def _fit(name, params, X_tr, y_tr, n_threads, early_stopping_rounds):
+    """
+    Fits one model. Boosted models carve an inner validation tail off the
+    training window and stop early on it; returns (model, rounds used).
+    """
+    model = train.build_model(name, n_threads, params)
+
+    if name not in BOOSTED or early_stopping_rounds is None or len(X_tr) < 50:
+        model.fit(X_tr, y_tr)
+        return model, params.get(RESOURCE_PARAM[name])
+
+    cut = int(len(X_tr) * 0.85)
+    X_fit, y_fit, X_val, y_val = X_tr[:cut], y_tr[:cut], X_tr[cut:], y_tr[cut:]
+
+    if name == "XGBoost":
+        model.set_params(early_stopping_rounds=early_stopping_rounds)
+        model.fit(X_fit, y_fit, eval_set=[(X_val, y_val)], verbose=False)
+        return model, int(model.best_iteration) + 1
+    if name == "LightGBM":
+        import lightgbm
+        model.fit(X_fit, y_fit, eval_set=[(X_val, y_val)],
+                  callbacks=[lightgbm.early_stopping(early_stopping_rounds, verbose=False)])
+        return model, int(model.best_iteration_ or params.get("n_estimators"))
+    model.fit(X_fit, y_fit, eval_set=(X_val, y_val), early_stopping_rounds=early_stopping_rounds)
+    return model, int(model.get_best_iteration()) + 1
+
+
+def _take(a, idx):
+    # Contiguous folds (walk-forward) become views of the shared block
+    if len(idx) and idx[-1] - idx[0] + 1 == len(idx):
+        return a[idx[0]:idx[-1] + 1]
+    return a[idx]
+
+
+def _run_trial(name, params, fold, early_stopping_rounds):
+    X, y = _worker["X"], _worker["y"]
+    train_idx, test_idx = _worker["splits"][fold]
+    started = time.perf_counter()
+    with threadpool_limits(limits=_worker["threads"]):
+        model, rounds = _fit(name, params, _take(X, train_idx), _take(y, train_idx),
+                             _worker["threads"], early_stopping_rounds)
+        probs = model.predict_proba(_take(X, test_idx))
+    y_test = _take(y, test_idx)
+    return {
+        "log_loss": float(log_loss(y_test, probs, labels=CLASSES)),
+        "accuracy": float(accuracy_score(y_test, probs.argmax(axis=1))),
+        "rounds": rounds,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def _sample_configs(space, n_trials, rng):
+    keys = sorted(space)
+    grid_size = math.prod(len(space[k]) for k in keys)
+    picks = rng.choice(grid_size, size=min(n_trials, grid_size), replace=False)
+    configs = []
+    for flat in picks:
+        config = {}
+        for k in keys:
+            flat, i = divmod(int(flat), len(space[k]))
+            config[k] = space[k][i]
+        configs.append(config)
+    return configs
+
+
+def successive_halving(pool, name, n_folds, n_trials=27, eta=3, min_resource=50, max_resource=800,
+                       early_stopping_rounds=30, seed=42):
+    """
+    Successive halving over SEARCH_SPACES[name]: every surviving config is
+    scored on all folds at the current budget (in parallel), the best
+    1/eta advance and the budget grows by eta.
+    """
+    rng = np.random.default_rng(seed)
+    configs = _sample_configs(SEARCH_SPACES[name], n_trials, rng)
+    resource = min_resource
+    history = []
+
+    while True:
+        trials = [dict(c, **{RESOURCE_PARAM[name]: int(resource)}) for c in configs]
+        futures = {
+            pool.submit(_run_trial, name, params, fold, early_stopping_rounds): (i, fold)
+            for i, params in enumerate(trials) for fold in range(n_folds)
+        }
+        scores = [[] for _ in trials]
+        for future in as_completed(futures):
+            i, _ = futures[future]
+            try:
+                scores[i].append(future.result())
+            except Exception as e:
+                scores[i].append({"log_loss": math.inf, "accuracy": 0.0, "rounds": None,
+                                  "seconds": 0.0, "error": str(e)})
+
+        rung = []
+        for params, folds in zip(trials, scores):
+            rung.append({
+                "params": params,
+                "log_loss": float(np.mean([f["log_loss"] for f in folds])),
+                "accuracy": float(np.mean([f["accuracy"] for f in folds])),
+                "rounds": [f["rounds"] for f in folds],
+            })
+        rung.sort(key=lambda r: r["log_loss"])
+        history.append({"resource": int(resource), "trials": rung})
+        print(f"      {name:<20} budget {int(resource):>5}: {len(rung):>3} configs, "
+              f"best log-loss {rung[0]['log_loss']:.4f} (acc {rung[0]['accuracy']:.4f})")
+
+        if len(rung) <= 1 or resource >= max_resource:
+            break
+        keep = max(1, len(rung) // eta)
+        configs = [{k: v for k, v in r["params"].items() if k != RESOURCE_PARAM[name]} for r in rung[:keep]]
+        resource = min(max_resource, resource * eta)
+
+    best = history[-1]["trials"][0]
+    params = dict(best["params"])
+    # Boosted models: pin the budget to the rounds early stopping settled on
+    rounds = [r for r in best["rounds"] if r]
+    if name in BOOSTED and rounds:
+        params[RESOURCE_PARAM[name]] = int(np.median(rounds))
+    return {"params": params, "log_loss": best["log_loss"], "accuracy": best["accuracy"], "history": history}
+
+
+# --- ENTRY POINT ---
+
+def search(model_names=None, n_splits=5, purge=1, embargo=0, scheme="walk_forward", n_trials=27, eta=3,
+           max_workers=None, save=True):
+    """
+    Tunes each model with purged time-series CV + successive halving.
+    Folds and trials run in parallel on a process pool that shares one
+    copy of the feature matrix. Best params are written to
+    models/best_params.json (used by train_models(use_tuned_params=True)).
+    """
+    print(" Starting hyperparameter search...")
+    df = kline_store.read_stage("labeled", columns=features.MODEL_COLUMNS + ["label"])
+    if df is None:
+        print(f" Error: File not found at {kline_store.stage_path('labeled')}")
+        return None
+    df = df.dropna()
+
+    # Search only on the training window; the last 30% stays untouched for evaluate.py
+    train_end = int(len(df) * 0.70)
+    X = features.feature_matrix(df.iloc[:train_end])
+    y = df['label'].to_numpy(dtype=np.int64)[:train_end]
+
+    if scheme == "walk_forward":
+        splits = walk_forward_splits(len(X), n_splits=n_splits, purge=purge, embargo=embargo)
+    else:
+        splits = purged_kfold_splits(len(X), n_splits=n_splits, purge=purge, embargo=embargo)
+    print(f"   {len(X)} rows, {len(splits)} {scheme} folds (purge={purge}, embargo={embargo})")
+
+    max_workers = max_workers or os.cpu_count() or 1
+    shared_X, shared_y = SharedArray(X), SharedArray(y)
+    results = {}
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach,
+                                 initargs=(shared_X.spec, shared_y.spec, splits, 1,
+                                           multiprocessing.get_start_method() != "fork")) as pool:
+            for name in (model_names or train.MODEL_NAMES):
+                started = time.perf_counter()
+                results[name] = successive_halving(pool, name, len(splits), n_trials=n_trials, eta=eta)
+                results[name]["seconds"] = round(time.perf_counter() - started, 2)
+    finally:
+        shared_X.close()
+        shared_y.close()
+
+    print(f"\n{'MODEL':<20} | {'LOG-LOSS':<9} | {'ACCURACY':<9} | BEST PARAMS")
+    print("-" * 80)
+    for name, r in results.items():
+        print(f"{name:<20} | {r['log_loss']:<9.4f} | {r['accuracy']:<9.4f} | {r['params']}")
+
+    if save:
+        path = train.best_params_path()
+        with open(path, "w") as f:
+            json.dump({name: r["params"] for name, r in results.items()}, f, indent=2)
+        print(f"\n Saved best params to {path}")
+    return results
+
+
+if __name__ == "__main__":
+    search()
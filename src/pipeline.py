@@ -0,0 +1,314 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import data_fetcher
+import data_processor
+import evaluate
+import feature_generator
+import feature_selection
+import kline_store
+import labeler
+import predict
+import train
+
+# The pipeline as a DAG of stages. Each stage gets a fingerprint: its
+# code, its parameters and the hashes of its upstream outputs. A stage
+# whose fingerprint matches the last successful run (and whose outputs
+# are still on disk, unchanged) is skipped. Ready stages run in parallel
+# in worker processes. State lives in data/pipeline_manifest.json.
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+    """
+    One pipeline step. `fn(**params)` produces `outputs` (file paths);
+    fn=None marks an external input whose files are only hashed. `code`
+    lists the source files whose changes invalidate the stage.
+    """
+
+    def __init__(self, name, fn, deps=(), params=None, code=(), outputs=()):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+        self.params = dict(params or {})
+        self.code = list(code)
+        self.outputs = list(outputs)
+
+
+# --- STAGE FUNCTIONS ---
+# Wrappers turn the scripts' "print and return None" failures into
+# exceptions, so the runner can tell a failed stage from a finished one.
+
+def _fetch(symbol, interval, limit, as_of):
+    if data_fetcher.fetch_binance_data(symbol=symbol, interval=interval, limit=limit) is None:
+        raise RuntimeError("fetch failed")
+
+
+def _process(chunksize, lean, gap_policy="ffill", interval=None):
+    if data_processor.clean_raw_data(chunksize=chunksize, lean=lean, gap_policy=gap_policy,
+                                     interval=interval) is None:
+        raise RuntimeError("processing failed")
+
+
+def _features(chunksize, lean, timeframes=None):
+    if feature_generator.feature_generator(chunksize=chunksize, lean=lean, timeframes=timeframes) is None:
+        raise RuntimeError("feature generation failed")
+
+
+def _label(method, threshold, sensitivity):
+    if labeler.create_labels(method=method, threshold=threshold, sensitivity=sensitivity) is None:
+        raise RuntimeError("labeling failed")
+
+
+def _train(model_name, total_cores, use_tuned_params, feature_set=None):
+    results = train.train_models(parallel=False, total_cores=total_cores, model_names=[model_name],
+                                 use_tuned_params=use_tuned_params, feature_set=feature_set)
+    if not results or results[0]["error"]:
+        raise RuntimeError(results[0]["error"] if results else "training failed")
+
+
+def _evaluate(rank_by, models):
+    winner, _, _ = evaluate.evaluate_models(rank_by=rank_by)
+    if winner is None:
+        raise RuntimeError("evaluation failed")
+
+
+def build_pipeline(symbol="BTCUSDT", interval="1d", limit=1000, fetch=True, as_of=None,
+                   method="dynamic", threshold=0.02, sensitivity=0.5,
+                   models=None, use_tuned_params=False, rank_by="accuracy", total_cores=None,
+                   chunksize=None, lean=False, feature_set=None, timeframes=None, gap_policy="ffill"):
+    """
+    The standard fetch -> process -> features -> label -> train (one
+    branch per model) -> evaluate DAG.
+
+    chunksize / lean run the process and features stages out of core
+    with float32 columns (for multi-year minute histories). feature_set
+    trains on a saved feature_selection.py set (e.g. "pinned").
+    timeframes adds higher-timeframe features (e.g. ("4h", "1d")) to the
+    feature stage. gap_policy ("ffill" / "report") decides what the
+    process stage does with missing candles (see integrity.py).
+
+    The fetch stage is keyed on the current candle (`as_of`, default: the
+    open time of the running candle), so it re-downloads once per new
+    candle; fetch=False uses the raw file already on disk.
+    """
+    raw_path = os.path.join(kline_store.data_dir(), 'raw', 'raw_data.csv')
+    models = list(models or train.MODEL_NAMES)
+    budgets = train.thread_budgets(models, total_cores)
+
+    if fetch:
+        if as_of is None:
+            step = data_fetcher.INTERVAL_MS.get(interval, 86_400_000)
+            as_of = int(time.time() * 1000) // step * step
+        fetch_stage = Stage("fetch", _fetch, params={"symbol": symbol, "interval": interval, "limit": limit,
+                                                     "as_of": as_of},
+                            code=["data_fetcher.py"], outputs=[raw_path])
+    else:
+        fetch_stage = Stage("fetch", None, outputs=[raw_path])
+
+    stages = [
+        fetch_stage,
+        Stage("process", _process, deps=["fetch"], params={"chunksize": chunksize, "lean": lean,
+                                                        "gap_policy": gap_policy, "interval": interval if fetch else None},
+              code=["data_processor.py", "integrity.py", "kline_store.py", "resample.py"],
+              outputs=[kline_store.stage_path("processed")]),
+        Stage("features", _features, deps=["process"],
+              params={"chunksize": chunksize, "lean": lean, "timeframes": list(timeframes) if timeframes else None},
+              code=["feature_generator.py", "features.py", "kline_store.py", "resample.py"],
+              outputs=[kline_store.stage_path("feature_engineered")]),
+        Stage("label", _label, deps=["features"],
+              params={"method": method, "threshold": threshold, "sensitivity": sensitivity},
+              code=["labeler.py", "kline_store.py"], outputs=[kline_store.stage_path("labeled")]),
+    ]
+    tuned = [train.best_params_path()] if use_tuned_params and os.path.exists(train.best_params_path()) else []
+    if feature_set is not None and not isinstance(feature_set, str):
+        feature_set = list(feature_set)
+    # A named set is read from feature_sets.json, so re-pinning retrains
+    sets = [feature_selection.feature_sets_path()] \
+        if isinstance(feature_set, str) and os.path.exists(feature_selection.feature_sets_path()) else []
+    for name in models:
+        stages.append(Stage(f"train:{name}", _train, deps=["label"],
+                            params={"model_name": name, "total_cores": budgets[name],
+                                    "use_tuned_params": use_tuned_params, "feature_set": feature_set},
+                            code=["train.py", "features.py", "feature_selection.py", "kline_store.py",
+                                  "predict.py"] + tuned + sets,
+                            outputs=[predict._model_path(name)]))
+    stages.append(Stage("evaluate", _evaluate, deps=[f"train:{name}" for name in models],
+                        params={"rank_by": rank_by, "models": models},
+                        code=["evaluate.py", "backtest.py", "export.py", "predict.py"],
+                        outputs=[predict._model_path("best_crypto_model")]))
+    return stages
+
+
+# --- MANIFEST & HASHING ---
+
+def manifest_path():
+    return os.path.join(kline_store.data_dir(), 'pipeline_manifest.json')
+
+
+def load_manifest():
+    try:
+        with open(manifest_path()) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"stages": {}, "files": {}}
+
+
+def save_manifest(manifest):
+    path = manifest_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def file_hash(path, manifest):
+    """
+    sha256 of a file, or None if it is missing. Hashes are remembered in
+    the manifest per (mtime, size, inode), so untouched files are not
+    re-read.
+    """
+    if not os.path.isabs(path):
+        path = os.path.join(SRC_DIR, path)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    signature = [st.st_mtime_ns, st.st_size, st.st_ino]
+    known = manifest["files"].get(path)
+    if known and known[:3] == signature:
+        return known[3]
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    manifest["files"][path] = signature + [h.hexdigest()]
+    return h.hexdigest()
+
+
+def fingerprint(stage, manifest):
+    payload = {
+        "stage": stage.name,
+        "params": stage.params,
+        "code": {c: file_hash(c, manifest) for c in stage.code},
+        "inputs": {d: manifest["stages"].get(d, {}).get("outputs") for d in stage.deps},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _outputs_unchanged(stage, manifest):
+    recorded = manifest["stages"].get(stage.name, {}).get("outputs") or {}
+    return all(recorded.get(p) is not None and recorded.get(p) == file_hash(p, manifest) for p in stage.outputs)
+
+
+# --- RUNNER ---
+
+def _execute(fn, params):
+    started = time.perf_counter()
+    fn(**params)
+    return time.perf_counter() - started
+
+
+def run_pipeline(stages=None, force=(), max_workers=None, dry_run=False):
+    """
+    Runs the DAG: skips stages whose fingerprint is unchanged, runs the
+    rest as soon as their dependencies finish (independent branches in
+    parallel) and prints per-stage timings. `force` names stages to
+    re-run regardless. Returns {stage: report dict}.
+    """
+    stages = stages or build_pipeline()
+    by_name = {s.name: s for s in stages}
+    manifest = load_manifest()
+    report = {}
+    pending = list(by_name)
+    running = {}
+    started_all = time.perf_counter()
+
+    print(f" Running pipeline ({len(stages)} stages)...")
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as pool:
+        while pending or running:
+            progressed = False
+            for name in list(pending):
+                stage = by_name[name]
+                dep_status = [report.get(d, {}).get("status") for d in stage.deps]
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    report[name] = {"status": "blocked", "seconds": 0.0}
+                    pending.remove(name)
+                    progressed = True
+                    continue
+                if any(s is None for s in dep_status):
+                    continue
+
+                pending.remove(name)
+                progressed = True
+                fp = fingerprint(stage, manifest)
+                previous = manifest["stages"].get(name, {})
+
+                if stage.fn is None:
+                    outputs = {p: file_hash(p, manifest) for p in stage.outputs}
+                    missing = [p for p, h in outputs.items() if h is None]
+                    status = "failed" if missing else "input"
+                    report[name] = {"status": status, "seconds": 0.0, "fingerprint": fp,
+                                    "error": f"missing input: {missing}" if missing else None}
+                    if not missing:
+                        manifest["stages"][name] = {"fingerprint": fp, "outputs": outputs}
+                    continue
+
+                upstream_changes = "would run" in dep_status
+                if (name not in force and not upstream_changes and previous.get("fingerprint") == fp
+                        and _outputs_unchanged(stage, manifest)):
+                    report[name] = {"status": "skipped", "seconds": 0.0, "fingerprint": fp}
+                    continue
+                if dry_run:
+                    report[name] = {"status": "would run", "seconds": 0.0, "fingerprint": fp}
+                    continue
+
+                running[pool.submit(_execute, stage.fn, stage.params)] = (name, fp)
+
+            if running and not progressed:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, fp = running.pop(future)
+                    stage = by_name[name]
+                    try:
+                        seconds = future.result()
+                        outputs = {p: file_hash(p, manifest) for p in stage.outputs}
+                        missing = [p for p, h in outputs.items() if h is None]
+                        if missing:
+                            raise RuntimeError(f"outputs not written: {missing}")
+                        manifest["stages"][name] = {"fingerprint": fp, "outputs": outputs,
+                                                    "seconds": round(seconds, 3), "finished_at": time.time()}
+                        save_manifest(manifest)
+                        report[name] = {"status": "ran", "seconds": seconds, "fingerprint": fp}
+                    except Exception as e:
+                        manifest["stages"].pop(name, None)
+                        report[name] = {"status": "failed", "seconds": 0.0, "fingerprint": fp,
+                                        "error": f"{type(e).__name__}: {e}"}
+            elif not running and not progressed:
+                # Nothing runnable and nothing running: unresolved deps
+                for name in pending:
+                    report[name] = {"status": "blocked", "seconds": 0.0}
+                pending.clear()
+
+    if not dry_run:
+        save_manifest(manifest)
+
+    print(f"\n{'STAGE':<28} | {'STATUS':<9} | {'SECONDS':>8} | FINGERPRINT")
+    print("-" * 70)
+    for name in by_name:
+        r = report[name]
+        print(f"{name:<28} | {r['status']:<9} | {r['seconds']:>8.2f} | {r.get('fingerprint', '')[:12]}")
+        if r.get("error"):
+            print(f"   ❌ {r['error']}")
+    print(f"\n Pipeline finished in {time.perf_counter() - started_all:.2f}s")
+    return report
+
+
+if __name__ == "__main__":
+    run_pipeline()
@@ -1,64 +1,410 @@
-import joblib
+import filecmp
 import os
-import pandas as pd
 import numpy as np
+import warnings
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import features
+import instrumentation
 
-def load_model(model_name):
-    """
-    Helper function to load a model.
-    """
+# Imports stay light (numpy + features): joblib, pandas and the model
+# libraries a pickle needs are only loaded when a pickle is actually read,
+# so exported (.npz) models start without them (see runtime.py).
+
+LABEL_MAP = {0: 'SELL', 1: 'HOLD', 2: 'BUY'}
+
+# --- MODEL CACHE ---
+# Process-wide LRU of unpickled models. Entries are keyed by name and
+# validated against the file's (mtime, size, inode) on every call, so a
+# model replaced on disk is reloaded on the next request.
+
+MODEL_CACHE_SIZE = int(os.environ.get("MODEL_CACHE_SIZE", 8))
+
+_model_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_load_locks = {}
+_cache_stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0, "load_seconds": {}}
+
+def _model_dir():
+    # CRYPTO_MODEL_DIR points training/evaluation at another folder (e.g. benchmarks)
+    override = os.environ.get("CRYPTO_MODEL_DIR")
+    if override:
+        return override
     current_script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(current_script_dir)
-    
-    # We add .pkl if the user forgot it
-    if not model_name.endswith('.pkl'):
+    return os.path.join(project_root, 'models')
+
+def _model_path(model_name):
+    # We add .pkl if the user forgot it (.npz = exported model, see export.py)
+    if not model_name.endswith(('.pkl', '.npz')):
         model_name = f"{model_name}.pkl"
-        
-    model_path = os.path.join(project_root, 'models', model_name)
+    return os.path.join(_model_dir(), model_name)
+
+def _read_model(f, model_path):
+    if model_path.endswith('.npz'):
+        import export
+        return export.ExportedModel.load(f)
+    import joblib
+    return joblib.load(f)
 
-    if not os.path.exists(model_path):
+def _signature(st):
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def load_model(model_name, use_cache=True):
+    """
+    Helper function to load a model.
+    Cached models are reused until the file on disk changes.
+    """
+    model_path = _model_path(model_name)
+
+    try:
+        st = os.stat(model_path)
+    except FileNotFoundError:
         raise FileNotFoundError(f"Model not found: {model_path}")
-        
-    return joblib.load(model_path)
 
-def predict_from_dataframe(input_df, model_name="best_crypto_model"):
+    if not use_cache:
+        with open(model_path, 'rb') as f:
+            return _read_model(f, model_path)
+
+    with _cache_lock:
+        entry = _model_cache.get(model_path)
+        if entry is not None and entry[0] == _signature(st):
+            _model_cache.move_to_end(model_path)
+            _cache_stats["hits"] += 1
+            instrumentation.incr("model_cache", result="hit")
+            return entry[1]
+        load_lock = _load_locks.setdefault(model_path, threading.Lock())
+
+    # One loader per file; concurrent callers wait and then hit the cache
+    with load_lock:
+        with _cache_lock:
+            entry = _model_cache.get(model_path)
+            if entry is not None and entry[0] == _signature(os.stat(model_path)):
+                _model_cache.move_to_end(model_path)
+                _cache_stats["hits"] += 1
+                instrumentation.incr("model_cache", result="hit")
+                return entry[1]
+
+        started = time.perf_counter()
+        # Signature comes from the open file, so it always matches the bytes we load
+        with instrumentation.span("model.load", model=os.path.basename(model_path)), open(model_path, 'rb') as f:
+            signature = _signature(os.fstat(f.fileno()))
+            model = _read_model(f, model_path)
+        elapsed = time.perf_counter() - started
+        instrumentation.incr("model_cache", result="miss")
+
+        with _cache_lock:
+            _cache_stats["misses"] += 1
+            if model_path in _model_cache:
+                _cache_stats["reloads"] += 1
+            _cache_stats["load_seconds"][os.path.basename(model_path)] = round(elapsed, 4)
+            _model_cache[model_path] = (signature, model)
+            _model_cache.move_to_end(model_path)
+            while len(_model_cache) > MODEL_CACHE_SIZE:
+                _model_cache.popitem(last=False)
+                _cache_stats["evictions"] += 1
+
+    return model
+
+def load_fast_model(model_name="best_crypto_model"):
+    """
+    The exported array model (<name>.npz, see export.py) if there is one
+    at least as new as the pickle, otherwise the pickle.
+    """
+    base = model_name[:-4] if model_name.endswith(('.pkl', '.npz')) else model_name
+    npz_path, pkl_path = _model_path(f"{base}.npz"), _model_path(base)
+    if os.path.exists(npz_path) and (not os.path.exists(pkl_path)
+                                     or os.stat(npz_path).st_mtime_ns >= os.stat(pkl_path).st_mtime_ns):
+        return load_model(f"{base}.npz")
+    return load_model(base)
+
+def warm_model(model_name="best_crypto_model"):
+    """
+    Loads a model the fast way (load_fast_model) and scores one row of
+    zeros, so lazy library init and first-call allocations happen now
+    rather than on the first request. Returns the model.
+    """
+    model = load_fast_model(model_name)
+    score_matrix(model, np.zeros((1, len(model_columns(model))), dtype=np.float32))
+    return model
+
+def model_cache_stats():
+    """
+    Hit/miss/reload/eviction counters, last load time per model (seconds)
+    and the names currently cached.
+    """
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["load_seconds"] = dict(_cache_stats["load_seconds"])
+        stats["cached"] = [os.path.basename(p) for p in _model_cache]
+    return stats
+
+def clear_model_cache():
+    with _cache_lock:
+        _model_cache.clear()
+
+def save_model(model, model_name):
+    """
+    Saves a model atomically (write to a temp file, then rename), so
+    readers never see a half-written pickle.
+    """
+    model_path = _model_path(model_name)
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    tmp_path = f"{model_path}.tmp.{os.getpid()}"
+    import joblib
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, model_path)
+    return model_path
+
+def publish_model(src_name, dst_name="best_crypto_model"):
+    """
+    Atomically copies one saved model over another (e.g. promoting the
+    evaluation winner to best_crypto_model.pkl).
+    """
+    src_path = _model_path(src_name)
+    dst_path = _model_path(dst_name)
+    tmp_path = f"{dst_path}.tmp.{os.getpid()}"
+    shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+def list_models():
+    """
+    Names of every saved model in models/ (without the .pkl extension).
+    """
+    model_dir = _model_dir()
+    if not os.path.isdir(model_dir):
+        return []
+    return sorted(f[:-4] for f in os.listdir(model_dir) if f.endswith('.pkl'))
+
+def model_columns(model):
+    """
+    The feature columns a model was fitted on, in order: a pinned subset
+    (see feature_selection.py, possibly with higher-timeframe columns) or
+    MODEL_COLUMNS for models that don't record their input names.
+    """
+    for attr in ('feature_names_in_', 'feature_names_', 'feature_name_'):
+        names = getattr(model, attr, None)
+        if names is not None and len(names) and all(features.is_model_column(n) for n in names):
+            return list(names)
+    return features.MODEL_COLUMNS
+
+def _select_columns(model, X):
+    # A frame (any columns) or a full MODEL_COLUMNS matrix is cut down to
+    # the model's own columns
+    columns = model_columns(model)
+    if hasattr(X, 'columns'):
+        return X if list(X.columns) == columns else X[columns]
+    if columns == features.MODEL_COLUMNS or X.shape[1] != len(features.MODEL_COLUMNS):
+        return X
+    extra = [c for c in columns if c not in features.MODEL_COLUMNS]
+    if extra:
+        raise ValueError(f"Model uses higher-timeframe columns {extra}: pass a DataFrame that has them")
+    return X[:, [features.MODEL_COLUMNS.index(c) for c in columns]]
+
+def score_matrix(model, X):
+    """
+    Scores a feature matrix (MODEL_COLUMNS order, or the model's own
+    columns) with one predict_proba call.
+    Returns (labels, confidence, probabilities).
+    """
+    X = _select_columns(model, X)
+    with warnings.catch_warnings():
+        # Models fitted on DataFrames warn about the bare array
+        warnings.filterwarnings('ignore', message='X does not have valid feature names')
+        with instrumentation.span("predict_proba", model=type(model).__name__):
+            probs = model.predict_proba(X)
+    instrumentation.incr("rows_scored", len(X))
+    instrumentation.observe("batch_rows", len(X), instrumentation.SIZE_BUCKETS)
+    best = probs.argmax(axis=1)
+    labels = np.asarray(getattr(model, 'classes_', np.arange(probs.shape[1])))[best]
+    confidence = probs[np.arange(len(best)), best]
+    return labels, confidence, probs
+
+def predict_from_dataframe(input_df, model_name="best_crypto_model", model=None):
     """
     Predicts using the specified model.
     If no model_name is given, defaults to 'best_crypto_model'.
+    An already loaded `model` skips the lookup.
     """
     # 1. Load Model
-    print(f"    Loading model: {model_name}...")
-    model = load_model(model_name)
+    if model is None:
+        print(f"    Loading model: {model_name}...")
+        model = load_model(model_name)
     
     # 2. Prepare Data
-    df_clean = input_df.copy()
-    
-    # Columns to drop (Targets/Metadata)
-    ignore_cols = [
-        'open_time', 'close_time', 'ignore', 
-        'future_return', 'label', 
-        'threshold_buy', 'threshold_sell'
-    ]
-    
-    # Filter columns
-    drop_cols = [c for c in ignore_cols if c in df_clean.columns]
-    X = df_clean.drop(columns=drop_cols)
+    # Same columns, same order as training (only missing features the
+    # model uses are computed)
+    with instrumentation.span("predict.feature_matrix"):
+        X = features.feature_matrix(input_df, model_columns(model))
     
-    # 3. Predict
-    preds = model.predict(X)
-    probs = model.predict_proba(X)
+    # 3. Predict (one predict_proba call; the label is its argmax)
+    preds, confidence, _ = score_matrix(model, X)
     
-    # 4. Extract Confidence
-    confidence = [probs[i][pred] for i, pred in enumerate(preds)]
-    
-    # 5. Attach results
-    df_clean['predicted_label'] = preds
-    df_clean['confidence'] = confidence
-    
-    label_map = {0: 'SELL', 1: 'HOLD', 2: 'BUY'}
-    df_clean['prediction_text'] = df_clean['predicted_label'].map(label_map)
+    # 4. Attach results (assign leaves input_df untouched without copying its columns)
+    import pandas as pd
+    df_clean = input_df.assign(predicted_label=preds, confidence=confidence,
+                               prediction_text=pd.Series(preds, index=input_df.index).map(LABEL_MAP))
     
     return df_clean
 
+# --- SHADOW SCORING ---
+# Challengers scored side by side with the champion on the same feature
+# matrix: one feature pass, one predict_proba per model (in parallel),
+# probabilities stacked as (models, rows, classes) in LABEL_MAP order.
+
+def _aligned_proba(model, X):
+    # Columns in LABEL_MAP order, whatever classes_ order the model uses
+    _, _, probs = score_matrix(model, X)
+    classes = list(getattr(model, 'classes_', range(probs.shape[1])))
+    if classes == list(LABEL_MAP):
+        return probs
+    aligned = np.zeros((len(X), len(LABEL_MAP)), dtype=probs.dtype)
+    for j, label in enumerate(classes):
+        aligned[:, list(LABEL_MAP).index(int(label))] = probs[:, j]
+    return aligned
+
+def _twin(model_name, others):
+    # The model in `others` whose file is a byte copy of model_name
+    # (publish_model makes one), or None
+    path = _model_path(model_name)
+    if not os.path.exists(path):
+        return None
+    for other in others:
+        other_path = _model_path(other)
+        if other != model_name and os.path.exists(other_path) and filecmp.cmp(path, other_path, shallow=False):
+            return other
+    return None
+
+def distinct_models(model_names=None, alias="best_crypto_model"):
+    """
+    Model names (default: every model in models/) without the published
+    alias when it is a copy of one of the others, so no model is counted
+    twice in a vote or a stack.
+    """
+    names = list(model_names) if model_names is not None else list_models()
+    if alias in names and _twin(alias, names) is not None:
+        names.remove(alias)
+    return names
+
+def score_models(X, model_names=None, max_workers=None):
+    """
+    Scores one feature matrix (MODEL_COLUMNS order, or a DataFrame with
+    every model's columns; each model takes its own columns from it) with
+    several models
+    (default: every distinct model in models/), their predict_proba calls fanned
+    out on a thread pool (the tree libraries release the GIL).
+
+    Returns a dict with the model names, the stacked probabilities
+    ("probs", shape (models, rows, classes)) and each model's scoring
+    time in seconds ("latency").
+    """
+    names = list(model_names) if model_names is not None else distinct_models()
+    models = [load_model(name) for name in names]
+
+    def run(name, model):
+        started = time.perf_counter()
+        probs = _aligned_proba(model, X)
+        elapsed = time.perf_counter() - started
+        instrumentation.observe("shadow_model_seconds", elapsed, model=name)
+        return probs, elapsed
+
+    workers = max_workers or min(len(models), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shadow") as pool:
+        results = list(pool.map(run, names, models))
+
+    probs = np.empty((len(names), len(X), len(LABEL_MAP)), dtype=np.float64)
+    for i, (p, _) in enumerate(results):
+        probs[i] = p
+    return {"models": names, "probs": probs,
+            "latency": {name: round(elapsed, 6) for name, (_, elapsed) in zip(names, results)}}
+
+def soft_vote(probs, weights=None):
+    """
+    Weighted mean of the models' probabilities: (models, rows, classes)
+    -> (rows, classes). Equal weights by default.
+    """
+    return np.average(probs, axis=0, weights=weights)
+
+def fit_stacker(probs, y, C=1.0):
+    """
+    Stacking ensemble: a logistic regression on every model's class
+    probabilities side by side. Fit it on out-of-sample scores (e.g. the
+    test split of evaluate.py), never on the models' own training rows.
+    """
+    from sklearn.linear_model import LogisticRegression
+
+    stacker = LogisticRegression(C=C, max_iter=1000)
+    stacker.fit(_stack_inputs(probs), y)
+    return stacker
+
+def _stack_inputs(probs):
+    # (models, rows, classes) -> (rows, models * classes)
+    return probs.transpose(1, 0, 2).reshape(probs.shape[1], -1)
+
+def stack_proba(stacker, probs):
+    """
+    Class probabilities of a fitted stacker, in LABEL_MAP order.
+    """
+    out = np.zeros((probs.shape[1], len(LABEL_MAP)))
+    out[:, [list(LABEL_MAP).index(int(c)) for c in stacker.classes_]] = stacker.predict_proba(_stack_inputs(probs))
+    return out
+
+def predict_shadow(input_df, model_names=None, champion="best_crypto_model", weights=None, stacker=None,
+                   max_workers=None):
+    """
+    predict_from_dataframe for the champion plus every challenger in
+    shadow: the frame gets the champion's usual prediction columns and a
+    prediction_<model> column per model, plus prediction_vote (soft vote)
+    and, with a fitted `stacker`, prediction_stack.
+
+    The champion alias is scored once: when it is a copy of a challenger
+    (see publish_model) that challenger's probabilities are used.
+
+    Returns (frame, scores) with scores as in score_models(), including
+    the ensemble probabilities under "vote" / "stack".
+    """
+    names = distinct_models(model_names, champion)
+    twin = champion if champion in names else _twin(champion, names)
+    if twin is None:
+        names.append(champion)
+        twin = champion
+
+    import pandas as pd
+
+    # One frame with every column any of the models was fitted on
+    # (pinned subsets, higher-timeframe columns); each model picks its own
+    columns = list(features.MODEL_COLUMNS)
+    for name in names:
+        columns += [c for c in model_columns(load_model(name)) if c not in columns]
+    with instrumentation.span("predict.feature_matrix"):
+        X = features.feature_matrix(input_df, columns)
+    if columns != features.MODEL_COLUMNS:
+        X = pd.DataFrame(X, columns=columns, index=input_df.index)
+    scores = score_models(X, names, max_workers)
+    probs = scores["probs"]
+    labels = np.array(list(LABEL_MAP))
+
+    def text(p):
+        return pd.Series(labels[p.argmax(axis=1)], index=input_df.index).map(LABEL_MAP)
+
+    champ = probs[names.index(twin)]
+    columns = {"predicted_label": labels[champ.argmax(axis=1)], "confidence": champ.max(axis=1),
+               "prediction_text": text(champ)}
+    for name, p in zip(names, probs):
+        if name != champion:
+            columns[f"prediction_{name}"] = text(p)
+
+    scores["vote"] = soft_vote(probs, weights)
+    columns["prediction_vote"] = text(scores["vote"])
+    if stacker is not None:
+        scores["stack"] = stack_proba(stacker, probs)
+        columns["prediction_stack"] = text(scores["stack"])
+
+    return input_df.assign(**columns), scores
+
 if __name__ == "__main__":
     print("Run this from your notebook!")
\ No newline at end of file
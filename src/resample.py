@@ -0,0 +1,279 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import data_fetcher
+import features
+import kline_store
+
+# Higher timeframes built from one stored base interval (normally 1m), so
+# one download feeds every horizon. Buckets are aligned like Binance's own
+# candles (UTC epoch, weeks start on Monday). Derived series are cached
+# per symbol/interval under data/store/resampled and only extended with
+# the base bars that arrived since; base months rewritten after they were
+# aggregated (backfills, dedupes) are aggregated again.
+
+# 1970-01-01 was a Thursday; Binance weeks start on Monday 00:00 UTC
+WEEK_OFFSET_MS = 4 * 86_400_000
+
+# Summed when candles are merged (the rest: first open, max high, min low, last close)
+SUM_COLUMNS = ["volume", "quote_asset_volume", "num_trades", "taker_base_volume", "taker_quote_volume"]
+
+# Higher-timeframe features attached to base rows as <feature>_<interval>
+MTF_COLUMNS = ["rsi", "macd_hist", "volatility", "pct_change_1d", "pct_change_7d"]
+
+
+def step_ms(interval):
+    step = data_fetcher.INTERVAL_MS.get(interval)
+    if step is None:
+        raise ValueError(f"Unknown interval: {interval}")
+    return step
+
+
+def infer_interval(open_time):
+    """
+    The interval of a kline series: its most common bar spacing.
+    """
+    ms = _to_ms(open_time)
+    diffs = np.diff(ms)
+    diffs = diffs[diffs > 0]
+    if not len(diffs):
+        raise ValueError("Need at least two bars to infer the interval")
+    values, counts = np.unique(diffs, return_counts=True)
+    spacing = int(values[counts.argmax()])
+    for name, step in data_fetcher.INTERVAL_MS.items():
+        if step == spacing:
+            return name
+    raise ValueError(f"No Binance interval is {spacing} ms long")
+
+
+def _to_ms(times):
+    times = pd.Series(times) if not isinstance(times, pd.Series) else times
+    if pd.api.types.is_datetime64_any_dtype(times):
+        return times.to_numpy().astype("datetime64[ms]").astype(np.int64)
+    return times.to_numpy(dtype=np.int64)
+
+
+def bucket_start(open_ms, interval):
+    """
+    Open time (ms) of the `interval` candle each base bar belongs to.
+    """
+    step = step_ms(interval)
+    offset = WEEK_OFFSET_MS if interval == "1w" else 0
+    return (open_ms - offset) // step * step + offset
+
+
+# --- AGGREGATION ---
+
+def aggregate(df, interval, base_interval="1m", include_partial=False):
+    """
+    Resamples klines of one symbol (sorted by open_time) to `interval`:
+    first open, max high, min low, last close, summed volumes, num_trades
+    and taker volumes. A trailing candle that is still forming (its last
+    base bar is not in df yet) is dropped unless include_partial.
+    """
+    base, step = step_ms(base_interval), step_ms(interval)
+    if step % base:
+        raise ValueError(f"{interval} is not a multiple of {base_interval}")
+    if df.empty:
+        return pd.DataFrame(columns=["open_time", "open", "high", "low", "close"]
+                            + [c for c in SUM_COLUMNS if c in df.columns] + ["close_time"])
+
+    open_ms = _to_ms(df["open_time"])
+    buckets = bucket_start(open_ms, interval)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(df)] - 1
+
+    out = {
+        "open_time": pd.to_datetime(buckets[starts], unit="ms"),
+        "open": df["open"].to_numpy()[starts],
+        "high": np.maximum.reduceat(df["high"].to_numpy(), starts),
+        "low": np.minimum.reduceat(df["low"].to_numpy(), starts),
+        "close": df["close"].to_numpy()[ends],
+    }
+    for col in SUM_COLUMNS:
+        if col in df.columns:
+            out[col] = np.add.reduceat(df[col].to_numpy(), starts)
+    out["close_time"] = pd.to_datetime(buckets[starts] + step - 1, unit="ms")
+    result = pd.DataFrame(out)
+
+    if not include_partial and open_ms[-1] + base < buckets[-1] + step:
+        result = result.iloc[:-1]
+    return result
+
+
+def aggregate_chunks(chunks, interval, base_interval="1m", include_partial=False):
+    """
+    aggregate() over base klines delivered in consecutive chunks (e.g.
+    month partitions): the bars of the last, possibly unfinished, candle
+    of each chunk are carried into the next one. Yields DataFrames.
+    """
+    carry = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        buckets = bucket_start(_to_ms(chunk["open_time"]), interval)
+        last = np.searchsorted(buckets, buckets[-1], side="left")
+        carry = chunk.iloc[last:]
+        if last:
+            yield aggregate(chunk.iloc[:last], interval, base_interval, include_partial=True)
+    if carry is not None:
+        tail = aggregate(carry, interval, base_interval, include_partial)
+        if len(tail):
+            yield tail
+
+
+# --- CACHE ---
+
+def cache_path(symbol, interval, base_interval="1m"):
+    return os.path.join(kline_store.data_dir(), 'store', 'resampled', f"symbol={symbol}",
+                        f"{interval}_from_{base_interval}.parquet")
+
+
+def _fingerprint_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def _base_fingerprints(symbol, base_interval):
+    # {month: [[part file, size, mtime], ...]}: any write to a month changes it
+    fingerprints = {}
+    for month in kline_store.list_months(symbol, base_interval):
+        files = kline_store._part_files(symbol, base_interval, [month])
+        fingerprints[month] = [[os.path.basename(f), os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in files]
+    return fingerprints
+
+
+def _first_changed_month(old, new):
+    changed = [m for m in set(old) | set(new) if old.get(m) != new.get(m)]
+    return min(changed) if changed else None
+
+
+def _base_chunks(symbol, base_interval, since):
+    # One month partition at a time, from `since` on
+    for month in kline_store.list_months(symbol, base_interval):
+        lo, hi = pd.Period(month, "M").start_time, (pd.Period(month, "M") + 1).start_time
+        if since is not None and hi <= since:
+            continue
+        yield kline_store.read_klines(symbol, base_interval, start=max(lo, since) if since is not None else lo,
+                                      end=hi)
+
+
+def resampled_klines(symbol, interval, base_interval="1m", start=None, end=None, rebuild=False):
+    """
+    `interval` klines of a symbol built from its stored `base_interval`
+    klines (see data_fetcher.update_many). The derived series is cached
+    with the fingerprint of the base partitions it was built from; later
+    calls only aggregate the base bars from the first candle not cached
+    yet (complete candles only), or from the earliest base month that
+    changed since (e.g. gaps merged by integrity.check_store), one month
+    partition at a time. Returns the candles with start <= open_time < end.
+    """
+    symbol = symbol.upper()
+    path = cache_path(symbol, interval, base_interval)
+    fingerprints = _base_fingerprints(symbol, base_interval)
+    cached, built_from = None, {}
+    if not rebuild and os.path.exists(path):
+        try:
+            with open(_fingerprint_path(path)) as f:
+                built_from = json.load(f)
+            cached = pd.read_parquet(path)
+        except (FileNotFoundError, ValueError):
+            # No fingerprint to compare against: built again from scratch
+            cached = None
+
+    since = None
+    if cached is not None and len(cached):
+        since = cached["open_time"].iloc[-1] + pd.Timedelta(milliseconds=step_ms(interval))
+        changed = _first_changed_month(built_from, fingerprints)
+        if changed is not None:
+            # The candle holding the month's first bar may have started in the month before
+            month_ms = pd.Period(changed, "M").start_time.value // 1_000_000
+            cut = pd.Timestamp(int(bucket_start(np.array([month_ms]), interval)[0]), unit="ms")
+            if cut < since:
+                cached = cached[cached["open_time"] < cut].reset_index(drop=True)
+                since = cut
+
+    fresh = list(aggregate_chunks(_base_chunks(symbol, base_interval, since), interval, base_interval))
+
+    if fresh or (cached is not None and built_from != fingerprints):
+        cached = pd.concat(([cached] if cached is not None else []) + fresh, ignore_index=True)
+        if len(cached):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp.{os.getpid()}"
+            cached.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+            # Written after the candles: a stale fingerprint only re-aggregates more
+            with open(tmp_path, 'w') as f:
+                json.dump(fingerprints, f)
+            os.replace(tmp_path, _fingerprint_path(path))
+            print(f"   {symbol} {interval}: +{sum(len(f) for f in fresh)} candles from {base_interval} -> {path}")
+        else:
+            cached = None
+
+    if cached is None:
+        return aggregate(pd.DataFrame(columns=["open_time", "open", "high", "low", "close"]), interval,
+                         base_interval)
+    if start is not None:
+        cached = cached[cached["open_time"] >= pd.Timestamp(start)]
+    if end is not None:
+        cached = cached[cached["open_time"] < pd.Timestamp(end)]
+    return cached.reset_index(drop=True)
+
+
+# --- CROSS-TIMEFRAME FEATURES ---
+
+def align(base_open_ms, base_interval, higher_open_ms, interval, values):
+    """
+    For every base bar, the value of the last `interval` candle that had
+    closed when the base bar closed (NaN before the first one): no
+    lookahead, a base bar never sees the candle it is part of until that
+    candle is complete.
+    """
+    base_close = base_open_ms + step_ms(base_interval)
+    higher_close = higher_open_ms + step_ms(interval)
+    idx = np.searchsorted(higher_close, base_close, side="right") - 1
+    out = np.asarray(values, dtype=np.float64)[np.maximum(idx, 0)]
+    out[idx < 0] = np.nan
+    return out
+
+
+def add_timeframe_features(df, timeframes=("4h", "1d"), base_interval=None, columns=None):
+    """
+    Adds <feature>_<interval> columns (default: MTF_COLUMNS) computed on
+    higher timeframes built from df's own OHLCV (per symbol when there is
+    a symbol column) and aligned to its rows with align(). base_interval
+    defaults to df's bar spacing.
+    """
+    columns = list(columns or MTF_COLUMNS)
+    timeframes = list(timeframes)
+    dtype = df["close"].dtype if pd.api.types.is_float_dtype(df["close"].dtype) else np.float64
+    values = {f"{c}_{tf}": np.full(len(df), np.nan, dtype=dtype) for tf in timeframes for c in columns}
+
+    if "symbol" in df.columns:
+        groups = df.groupby("symbol", observed=True, sort=False).indices
+    else:
+        groups = {None: np.arange(len(df))}
+
+    for idx in groups.values():
+        part = df.iloc[idx]
+        interval = base_interval or infer_interval(part["open_time"])
+        open_ms = _to_ms(part["open_time"])
+        for tf in timeframes:
+            higher = aggregate(part, tf, interval)
+            if higher.empty:
+                continue
+            computed = features.compute_features(higher, columns)
+            higher_ms = _to_ms(higher["open_time"])
+            for c in columns:
+                values[f"{c}_{tf}"][idx] = align(open_ms, interval, higher_ms, tf, computed[c])
+
+    return df.assign(**values)
+
+
+if __name__ == "__main__":
+    for tf in ("1h", "4h", "1d"):
+        print(resampled_klines("BTCUSDT", tf).tail(3).to_string(index=False))
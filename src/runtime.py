@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import features
+import predict
+
+# Slim inference runtime for cold starts (container restarts, CLI
+# scoring). It only imports numpy, the feature registry and predict.py,
+# and serves the exported array models (models/<name>.npz, see
+# export.py), so no pandas, joblib or model library is loaded and
+# nothing is unpickled. build_bundle() exports the saved models once
+# (after training; only exports that match their pickle are kept),
+# warm() loads and pre-runs them at start-up, and
+# check_startup() measures every entry point against a time budget in a
+# fresh interpreter.
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds from interpreter start to "ready" per entry point
+STARTUP_BUDGET_S = float(os.environ.get("STARTUP_BUDGET_S", 0.8))
+
+# What each entry point does before it can serve (statement run in a fresh interpreter)
+ENTRY_POINTS = {
+    "runtime": "import runtime; runtime.warm()",
+    "predict": "import predict; predict.warm_model()",
+    "service": "import service",
+}
+
+# Modules a cold start should not need to load
+HEAVY_MODULES = ["pandas", "pyarrow", "joblib", "sklearn", "xgboost", "lightgbm", "catboost", "plotly",
+                 "streamlit", "requests"]
+
+
+# --- BUNDLE ---
+
+def build_bundle(model_names=None, X=None, atol=1e-6):
+    """
+    Exports every saved model (default: all in models/) to .npz and keeps
+    each export only if it scores X (default: the newest 10,000 labeled
+    rows) like its pickle (export.export_verified). Models that fail, or
+    that the exporter doesn't support, keep serving from the pickle.
+    Returns {model: npz path or error}.
+    """
+    import export
+    import kline_store
+
+    if X is None:
+        df = kline_store.read_stage("labeled", columns=features.MODEL_COLUMNS)
+        if df is None:
+            raise FileNotFoundError(f"Parity check needs data: {kline_store.stage_path('labeled')}")
+        X = features.feature_matrix(df.dropna().tail(10_000))
+
+    results = {}
+    for name in model_names or predict.list_models():
+        try:
+            results[name], _ = export.export_verified(name, X, atol)
+        except Exception as e:
+            results[name] = f"{type(e).__name__}: {e}"
+    return results
+
+
+def warm(model_names=("best_crypto_model",)):
+    """
+    Loads each model the fast way and scores one row with it, and runs
+    the feature kernels once on a short synthetic series, so the first
+    real request pays no start-up costs. Returns {model: model}.
+    """
+    close = 100.0 + np.cumsum(np.ones(features.WARMUP_BARS + 1)) * 0.01
+    features.compute_feature_arrays({"open": close, "high": close, "low": close, "close": close,
+                                     "volume": np.ones_like(close)})
+    return {name: predict.warm_model(name) for name in model_names}
+
+
+# --- CLI SCORING ---
+
+def read_klines_csv(path):
+    """
+    OHLCV columns of a kline CSV (e.g. data/raw/raw_data.csv) as float64
+    arrays, read without pandas.
+    """
+    table = np.genfromtxt(path, delimiter=",", names=True, dtype=np.float64, encoding="utf-8")
+    return {c: np.atleast_1d(table[c]) for c in features.OHLCV_COLUMNS}
+
+
+def score_latest(inputs, model_name="best_crypto_model"):
+    """
+    Label, confidence and class probabilities of the newest bar of one
+    OHLCV series (dict of arrays).
+    """
+    model = predict.load_fast_model(model_name)
+    columns = predict.model_columns(model)
+    values = features.compute_feature_arrays(inputs, [c for c in columns if c not in features.OHLCV_COLUMNS])
+    X = np.array([[inputs[c][-1] if c in inputs else values[c][-1] for c in columns]], dtype=np.float32)
+    labels, confidence, probs = predict.score_matrix(model, X)
+    return {"label": predict.LABEL_MAP.get(int(labels[0]), str(labels[0])), "confidence": float(confidence[0]),
+            "probs": {predict.LABEL_MAP[k]: float(p) for k, p in zip(predict.LABEL_MAP, probs[0])}}
+
+
+# --- STARTUP BUDGET ---
+
+def measure_startup(statement, repeats=3):
+    """
+    Wall time of `statement` in a fresh interpreter (best of repeats),
+    the heavy modules it loaded and the 10 slowest modules the entry
+    point imports (cumulative, from python -X importtime).
+    """
+    probe = (f"{statement}\nimport json, sys\n"
+             f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    best, loaded, slowest = None, [], []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], cwd=SRC_DIR,
+                              capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+        if best is None or elapsed < best:
+            best = elapsed
+            loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+            slowest = _slowest_imports(proc.stderr, re.findall(r"\bimport (\w+)", statement))
+    return {"seconds": round(best, 4), "heavy_modules": loaded, "slowest_imports": slowest}
+
+
+def _slowest_imports(importtime_log, entry_modules, n=10):
+    # "import time: self [us] | cumulative | imported package", children
+    # indented two spaces per level and listed before their parent. What
+    # the entry point costs: the direct children of its own import, plus
+    # top-level (lazy) imports after it; interpreter start-up is skipped
+    rows, children, entered = [], [], False
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        row = (name.strip(), int(cumulative) / 1e6)
+        if level == 1:
+            children.append(row)
+        elif level == 0:
+            if row[0] in entry_modules:
+                rows += children
+                entered = True
+            elif entered:
+                rows.append(row)
+            children = []
+    rows.sort(key=lambda r: r[1], reverse=True)
+    return [{"module": m, "seconds": round(s, 4)} for m, s in rows[:n]]
+
+
+def check_startup(entry_points=None, budget=STARTUP_BUDGET_S, repeats=3):
+    """
+    measure_startup() for each entry point (default: ENTRY_POINTS) and
+    whether it stays within `budget` seconds. Returns {name: report}.
+    """
+    entry_points = entry_points or ENTRY_POINTS
+    results = {}
+    for name, statement in entry_points.items():
+        report = measure_startup(statement, repeats)
+        if "error" not in report:
+            report["within_budget"] = report["seconds"] <= budget
+        results[name] = report
+        if "error" in report:
+            print(f"   ❌ {name:<10} {report['error']}")
+            continue
+        heavy = f" (loads {', '.join(report['heavy_modules'])})" if report["heavy_modules"] else ""
+        print(f"   {'✅' if report['within_budget'] else '❌'} {name:<10} {report['seconds']:>7.3f}s{heavy}")
+    return results
+
+
+if __name__ == "__main__":
+    # python src/runtime.py               startup report (budget STARTUP_BUDGET_S)
+    # python src/runtime.py bundle        export the saved models to .npz (parity-checked)
+    # python src/runtime.py <klines.csv>  score the newest bar of a kline CSV
+    args = sys.argv[1:]
+    if not args:
+        print(f" Startup budget: {STARTUP_BUDGET_S}s")
+        report = check_startup()
+        sys.exit(0 if all(r.get("within_budget") for r in report.values() if "error" not in r) else 1)
+    elif args[0] == "bundle":
+        for name, result in build_bundle(args[1:] or None).items():
+            print(f"   {name:<24} {result}")
+    else:
+        print(json.dumps(score_latest(read_klines_csv(args[0]), *args[1:2]), indent=2))
@@ -0,0 +1,308 @@
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, model_validator
+
+# Make sibling modules importable when launched as `uvicorn src.service:app`
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import instrumentation
+import predict
+
+DEFAULT_MODEL = "best_crypto_model"
+
+# Micro-batching: requests arriving within MAX_WAIT_MS are scored together
+MAX_BATCH_ROWS = int(os.environ.get("SERVICE_MAX_BATCH_ROWS", 256))
+MAX_WAIT_MS = float(os.environ.get("SERVICE_MAX_WAIT_MS", 2))
+
+# SERVICE_PROMETHEUS=1 turns on span/counter collection (see
+# instrumentation.py), GET /metrics/prometheus and the profiler endpoints
+PROMETHEUS = os.environ.get("SERVICE_PROMETHEUS", "").lower() in ("1", "true", "yes")
+if PROMETHEUS:
+    instrumentation.enable()
+
+
+# --- REQUEST / RESPONSE SCHEMAS ---
+
+class PredictRequest(BaseModel):
+    """
+    Either one `row` or a batch of `rows`; each row maps every column of
+    the requested model (predict.model_columns: features.MODEL_COLUMNS
+    unless the model is pinned to a subset) to its value.
+    """
+    row: Optional[Dict[str, float]] = None
+    rows: Optional[List[Dict[str, float]]] = None
+    model: str = DEFAULT_MODEL
+
+    @model_validator(mode="after")
+    def _one_of(self):
+        if (self.row is None) == (self.rows is None):
+            raise ValueError("Send exactly one of 'row' or 'rows'")
+        if self.rows is not None and not self.rows:
+            raise ValueError("'rows' must not be empty")
+        return self
+
+
+class Prediction(BaseModel):
+    label: int
+    prediction: str
+    confidence: float
+    probabilities: List[float]
+
+
+class PredictResponse(BaseModel):
+    model: str
+    predictions: List[Prediction]
+
+
+# --- METRICS ---
+
+class RollingStats:
+    """
+    Keeps the last `size` samples (latencies in ms, batch sizes) for
+    percentile reporting.
+    """
+
+    def __init__(self, size=10_000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def record(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def summary(self):
+        if not self.samples:
+            return {"count": self.count, "p50": None, "p99": None}
+        values = np.fromiter(self.samples, dtype=float)
+        p50, p99 = np.percentile(values, [50, 99])
+        return {"count": self.count, "p50": round(float(p50), 3), "p99": round(float(p99), 3)}
+
+
+# --- MICRO-BATCHER ---
+
+class MicroBatcher:
+    """
+    Collects concurrent requests for one model into a single matrix (the
+    model's own `columns`, in order) and scores it with one predict_proba
+    call off the event loop.
+    """
+
+    def __init__(self, model_name, columns, max_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS):
+        self.model_name = model_name
+        self.columns = columns
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.batch_sizes = RollingStats(size=1000)
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, X):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((X, future))
+        return await future
+
+    def _score(self, X):
+        # Cache hit unless the file changed on disk, in which case the new
+        # model is picked up here (hot reload after evaluate.py); an exported
+        # .npz is preferred, so no model library is imported to serve it
+        model = predict.load_fast_model(self.model_name)
+        columns = _servable_columns(model)
+        if columns != self.columns:
+            # Rows were built for the old model; later requests use the new columns
+            self.columns = columns
+            raise ValueError(f"{self.model_name} was reloaded with different columns, retry the request")
+        return predict.score_matrix(model, X)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            rows = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+
+            # Keep collecting until the batch is full or the wait expires
+            while rows < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                rows += len(item[0])
+
+            X = np.concatenate([x for x, _ in items]) if len(items) > 1 else items[0][0]
+            self.batch_sizes.record(rows)
+            instrumentation.observe("microbatch_rows", rows, instrumentation.SIZE_BUCKETS, model=self.model_name)
+            try:
+                labels, confidence, probs = await loop.run_in_executor(None, self._score, X)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for x, future in items:
+                end = offset + len(x)
+                if not future.done():
+                    future.set_result((labels[offset:end], confidence[offset:end], probs[offset:end]))
+                offset = end
+
+
+# --- APP ---
+
+STATE = {"models": {}, "batchers": {}, "latency": RollingStats(), "started_at": None}
+
+
+def _servable_columns(model):
+    # Columns a request must send; a model fitted on inputs that aren't
+    # model columns can't be fed from request rows
+    columns = predict.model_columns(model)
+    n_features = getattr(model, "n_features_in_", None)
+    if n_features is not None and n_features != len(columns):
+        raise ValueError(f"fitted on {n_features} features, not on the model columns ({len(columns)})")
+    return columns
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load and pre-run every model once (the .npz export where there is
+    # one, see runtime.build_bundle); requests only ever touch warm objects
+    columns = {}
+    for name in predict.list_models():
+        try:
+            model = predict.warm_model(name)
+            columns[name] = _servable_columns(model)
+        except Exception as e:
+            print(f" Could not load {name}: {e}")
+            continue
+        STATE["models"][name] = model
+    for name in STATE["models"]:
+        batcher = MicroBatcher(name, columns[name])
+        batcher.start()
+        STATE["batchers"][name] = batcher
+    STATE["started_at"] = time.time()
+    print(f" Loaded models: {', '.join(STATE['models']) or 'none'}")
+
+    yield
+
+    for batcher in STATE["batchers"].values():
+        await batcher.stop()
+    STATE["batchers"].clear()
+    STATE["models"].clear()
+
+
+app = FastAPI(title="Crypto Classifier", lifespan=lifespan)
+
+
+def _to_matrix(rows, columns):
+    missing = [c for c in columns if any(c not in row for row in rows)]
+    if missing:
+        raise HTTPException(status_code=422, detail=f"Missing features: {missing}")
+    return np.array([[row[c] for c in columns] for row in rows], dtype=np.float32)
+
+
+@app.post("/predict", response_model=PredictResponse)
+async def predict_endpoint(request: PredictRequest):
+    started = time.perf_counter()
+
+    batcher = STATE["batchers"].get(request.model)
+    if batcher is None:
+        raise HTTPException(status_code=404, detail=f"Model not loaded: {request.model}")
+
+    rows = request.rows if request.rows is not None else [request.row]
+    labels, confidence, probs = await batcher.submit(_to_matrix(rows, batcher.columns))
+
+    predictions = [
+        Prediction(
+            label=int(label),
+            prediction=predict.LABEL_MAP.get(int(label), str(label)),
+            confidence=float(conf),
+            probabilities=[float(p) for p in prob],
+        )
+        for label, conf, prob in zip(labels, confidence, probs)
+    ]
+
+    elapsed = time.perf_counter() - started
+    STATE["latency"].record(elapsed * 1000)
+    instrumentation.observe("request_seconds", elapsed, model=request.model)
+    instrumentation.incr("predicted_rows", len(rows), model=request.model)
+    return PredictResponse(model=request.model, predictions=predictions)
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok" if STATE["models"] else "no_models",
+        "models": sorted(STATE["models"]),
+        "uptime_s": round(time.time() - STATE["started_at"], 1) if STATE["started_at"] else 0,
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "latency_ms": STATE["latency"].summary(),
+        "batch_rows": {name: b.batch_sizes.summary() for name, b in STATE["batchers"].items()},
+        "model_cache": predict.model_cache_stats(),
+        "instrumentation": instrumentation.snapshot() if instrumentation.is_enabled() else None,
+    }
+
+
+def _require_instrumentation():
+    if not instrumentation.is_enabled():
+        raise HTTPException(status_code=404, detail="Instrumentation is off (set SERVICE_PROMETHEUS=1)")
+
+
+@app.get("/metrics/prometheus", response_class=PlainTextResponse)
+async def metrics_prometheus():
+    _require_instrumentation()
+    return PlainTextResponse(instrumentation.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/profiler/start")
+async def profiler_start(interval_ms: float = 5.0):
+    _require_instrumentation()
+    instrumentation.start_profiler(interval_ms / 1000)
+    return {"profiling": True}
+
+
+@app.post("/profiler/stop")
+async def profiler_stop(top: int = 30):
+    """
+    Stops the sampling profiler; returns the hottest functions and the
+    folded stacks (for flamegraph.pl / speedscope).
+    """
+    _require_instrumentation()
+    profiler = instrumentation.stop_profiler()
+    if profiler is None:
+        raise HTTPException(status_code=409, detail="Profiler is not running")
+    return {"samples": profiler.sample_count, "top": profiler.top(top), "collapsed": profiler.collapsed()}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.environ.get("SERVICE_HOST", "0.0.0.0"),
+                port=int(os.environ.get("SERVICE_PORT", 8000)))
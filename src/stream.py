@@ -0,0 +1,384 @@
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import websockets
+
+import features
+import kline_store
+import predict
+from incremental_features import IncrementalFeatureEngine
+
+# Live mode: Binance kline WebSocket -> incremental features -> resident
+# model -> subscribers. Every stage is connected by a bounded queue, so a
+# slow stage pushes back on the one before it instead of buffering
+# without limit.
+
+STREAM_URL = "wss://stream.binance.com:9443/stream"
+
+# Sent by ReplayServer after its last candle. Binance never sends it: a
+# live stream that closes (cleanly at the 24h limit, or not) is reopened.
+END_OF_REPLAY = json.dumps({"replay": "end"})
+
+
+def stream_names(symbols, interval):
+    return [f"{s.lower()}@kline_{interval}" for s in symbols]
+
+
+def stream_url(symbols, interval, base_url=STREAM_URL):
+    return f"{base_url}?streams={'/'.join(stream_names(symbols, interval))}"
+
+
+def parse_kline(message):
+    """
+    Parses one combined-stream kline message. Returns the candle as a dict
+    once it is closed, None for in-progress updates and other events.
+    """
+    payload = json.loads(message)
+    data = payload.get("data", payload)
+    k = data.get("k") if isinstance(data, dict) else None
+    if not k or not k.get("x"):
+        return None
+    return {
+        "symbol": k["s"],
+        "interval": k["i"],
+        "open_time": int(k["t"]),
+        "close_time": int(k["T"]),
+        "open": float(k["o"]),
+        "high": float(k["h"]),
+        "low": float(k["l"]),
+        "close": float(k["c"]),
+        "volume": float(k["v"]),
+        "received_at": time.perf_counter(),
+    }
+
+
+# --- PIPELINE ---
+
+class StreamPipeline:
+    """
+    Consumes closed candles for many symbols, updates each symbol's
+    IncrementalFeatureEngine in O(1), scores every candle that closed
+    together with one predict_proba call and publishes the signals.
+
+    Backpressure: the reader awaits a bounded candle queue, so when
+    scoring falls behind the socket stops being read (and the exchange's
+    TCP window fills). Subscribers get their own bounded queues. A slow
+    subscriber loses its oldest signals instead of stalling everyone else.
+    """
+
+    def __init__(self, symbols, interval="1m", model_name="best_crypto_model", url=STREAM_URL,
+                 queue_size=1000, max_batch=256, reconnect_delay=1.0):
+        self.symbols = [s.upper() for s in symbols]
+        self.interval = interval
+        self.model_name = model_name
+        self.url = stream_url(self.symbols, interval, url)
+        self.candles = asyncio.Queue(maxsize=queue_size)
+        self.max_batch = max_batch
+        self.reconnect_delay = reconnect_delay
+        self.engines = {s: IncrementalFeatureEngine() for s in self.symbols}
+        self.subscribers = []
+        self.stats = {"messages": 0, "candles": 0, "duplicates": 0, "scored": 0, "warming_up": 0,
+                      "published": 0, "dropped": 0, "reconnects": 0, "batches": 0, "bad_messages": 0}
+        self.latency_ms = []
+        self._tasks = []
+        self._stopped = asyncio.Event()
+
+    # --- warm-up ---
+
+    def warmup(self, histories):
+        """
+        Seeds the engines from history ({symbol: DataFrame with open_time +
+        close, oldest first}), so signals start with the first live candle.
+        """
+        for symbol, df in histories.items():
+            engine = self.engines.get(symbol.upper())
+            if engine is None or df is None or df.empty:
+                continue
+            df = df.tail(features.WARMUP_BARS * 2)
+            if np.issubdtype(df["open_time"].dtype, np.datetime64):
+                df = df.assign(open_time=df["open_time"].astype("datetime64[ms]").astype("int64"))
+            engine.update(df[["open_time", "close"]])
+
+    def warmup_from_store(self):
+        """
+        Warm-up from the local kline store (see data_fetcher.update_many).
+        """
+        histories = {}
+        for symbol in self.symbols:
+            df = kline_store.read_klines(symbol, self.interval, columns=["open_time", "close"])
+            if df is not None and len(df):
+                histories[symbol] = df
+        self.warmup(histories)
+        return sorted(histories)
+
+    # --- subscribers ---
+
+    def subscribe(self, maxsize=100):
+        """
+        Returns a bounded asyncio.Queue that receives every published
+        signal (a dict). Call unsubscribe() when done.
+        """
+        queue = asyncio.Queue(maxsize=maxsize)
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+
+    def _publish(self, signal):
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.stats["dropped"] += 1
+            queue.put_nowait(signal)
+        self.stats["published"] += 1
+
+    # --- stages ---
+
+    async def _ingest(self):
+        try:
+            ended = False
+            while not self._stopped.is_set() and not ended:
+                try:
+                    async with websockets.connect(self.url, max_queue=64) as ws:
+                        async for message in ws:
+                            if message == END_OF_REPLAY:
+                                ended = True
+                                break
+                            self.stats["messages"] += 1
+                            try:
+                                candle = parse_kline(message)
+                            except (ValueError, KeyError, TypeError, AttributeError):
+                                # A malformed frame is skipped, not a reason to reconnect
+                                self.stats["bad_messages"] += 1
+                                continue
+                            if candle is not None:
+                                # Blocks while the queue is full: backpressure
+                                await self.candles.put(candle)
+                # Dropped connections, refused handshakes (e.g. a 503 on reconnect), timeouts
+                except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                    if self._stopped.is_set():
+                        break
+                    self.stats["reconnects"] += 1
+                    print(f" Stream disconnected ({type(e).__name__}), reconnecting in {self.reconnect_delay}s")
+                    await asyncio.sleep(self.reconnect_delay)
+                else:
+                    if ended or self._stopped.is_set():
+                        break
+                    # Clean close (Binance ends every connection after 24h): reopen it
+                    self.stats["reconnects"] += 1
+                    print(f" Stream closed by the server, reconnecting in {self.reconnect_delay}s")
+                    await asyncio.sleep(self.reconnect_delay)
+        finally:
+            # _process only ends on this marker (on stop() it is cancelled instead)
+            if not self._stopped.is_set():
+                await self.candles.put(None)
+
+    def _update(self, candle):
+        engine = self.engines.get(candle["symbol"])
+        if engine is None:
+            return None
+        # Reconnects can replay the last candle; features must advance once per bar
+        if engine.last_open_time is not None and candle["open_time"] <= engine.last_open_time:
+            self.stats["duplicates"] += 1
+            return None
+        self.stats["candles"] += 1
+        values = engine.update_one(candle["close"], candle["open_time"])
+        if not engine.is_warm:
+            self.stats["warming_up"] += 1
+            return None
+        return [candle[c] for c in features.OHLCV_COLUMNS] + [values[c] for c in features.FEATURE_COLUMNS]
+
+    def _score(self, rows):
+        # Cached model; a newly published file is picked up on the next batch
+        model = predict.load_model(self.model_name)
+        return predict.score_matrix(model, np.asarray(rows, dtype=np.float32))
+
+    async def _process(self):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            batch = [await self.candles.get()]
+            # Drain whatever else is already waiting (candles of all symbols close together)
+            while len(batch) < self.max_batch and not self.candles.empty():
+                batch.append(self.candles.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+
+            ready, rows = [], []
+            for candle in batch:
+                row = self._update(candle)
+                if row is not None:
+                    ready.append(candle)
+                    rows.append(row)
+            if not rows:
+                continue
+
+            labels, confidence, probs = await loop.run_in_executor(None, self._score, rows)
+            self.stats["batches"] += 1
+            now = time.perf_counter()
+            for candle, label, conf, prob in zip(ready, labels, confidence, probs):
+                self.latency_ms.append((now - candle["received_at"]) * 1000)
+                self._publish({
+                    "symbol": candle["symbol"],
+                    "open_time": candle["open_time"],
+                    "close": candle["close"],
+                    "label": int(label),
+                    "prediction": predict.LABEL_MAP.get(int(label), str(label)),
+                    "confidence": float(conf),
+                    "probabilities": [float(p) for p in prob],
+                })
+            self.stats["scored"] += len(rows)
+            del self.latency_ms[:-10_000]
+
+        # Tell subscribers the stream has ended
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    async def run(self):
+        """
+        Runs until the stream ends or stop() is called.
+        """
+        self._tasks = [asyncio.create_task(self._ingest()), asyncio.create_task(self._process())]
+        try:
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # One stage failed: cancel the other rather than leave it waiting on its queue
+            await self.stop()
+            raise
+
+    async def stop(self):
+        self._stopped.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def summary(self):
+        stats = dict(self.stats)
+        if self.latency_ms:
+            p50, p99 = np.percentile(self.latency_ms, [50, 99])
+            stats["latency_ms"] = {"p50": round(float(p50), 3), "p99": round(float(p99), 3)}
+        return stats
+
+
+# --- LOCAL REPLAY SERVER ---
+
+def kline_message(symbol, interval, row, closed=True):
+    """
+    Formats one candle like a Binance combined-stream kline event.
+    """
+    open_time = int(row["open_time"])
+    close_time = int(row.get("close_time", open_time + 1))
+    return json.dumps({
+        "stream": f"{symbol.lower()}@kline_{interval}",
+        "data": {
+            "e": "kline", "E": close_time, "s": symbol,
+            "k": {
+                "t": open_time, "T": close_time, "s": symbol, "i": interval,
+                "o": str(row["open"]), "h": str(row["high"]), "l": str(row["low"]),
+                "c": str(row["close"]), "v": str(row["volume"]), "x": closed,
+            },
+        },
+    })
+
+
+def replay_frames_from_raw(symbols, path=None):
+    """
+    Replay history from data/raw/raw_data.csv. The file holds one series,
+    so each symbol gets a copy scaled by a different factor.
+    """
+    path = path or os.path.join(kline_store.data_dir(), 'raw', 'raw_data.csv')
+    raw = pd.read_csv(path)
+    frames = {}
+    for i, symbol in enumerate(symbols):
+        df = raw.copy()
+        scale = 1.0 + 0.1 * i
+        df[["open", "high", "low", "close"]] *= scale
+        frames[symbol.upper()] = df
+    return frames
+
+
+class ReplayServer:
+    """
+    Local WebSocket server that replays stored candles in the Binance
+    combined-stream format, for tests and demos:
+
+        async with ReplayServer(frames, "1d") as url:
+            pipeline = StreamPipeline(symbols, "1d", url=url)
+
+    Candles are sent in open_time order across the subscribed symbols.
+    Each one is preceded by an in-progress update that the client must
+    ignore. `delay` seconds are slept between bars. The last frame is
+    END_OF_REPLAY, which ends the pipeline (any other close reconnects).
+    """
+
+    def __init__(self, frames, interval="1d", host="127.0.0.1", port=0, delay=0.0):
+        self.frames = {s.upper(): df for s, df in frames.items()}
+        self.interval = interval
+        self.host, self.port = host, port
+        self.delay = delay
+        self._server = None
+
+    async def _handler(self, ws):
+        request = getattr(ws, "request", None)
+        path = request.path if request is not None else getattr(ws, "path", "")
+        streams = parse_qs(urlparse(path).query).get("streams", [""])[0].split("/")
+        symbols = [s.split("@")[0].upper() for s in streams if s]
+        frames = [self.frames[s].assign(symbol=s) for s in symbols if s in self.frames]
+        if not frames:
+            await ws.send(END_OF_REPLAY)
+            return
+        merged = pd.concat(frames).sort_values(["open_time", "symbol"], kind="stable")
+
+        for _, bar in merged.groupby("open_time", sort=True):
+            for row in bar.to_dict("records"):
+                await ws.send(kline_message(row["symbol"], self.interval, row, closed=False))
+                await ws.send(kline_message(row["symbol"], self.interval, row, closed=True))
+            if self.delay:
+                await asyncio.sleep(self.delay)
+        await ws.send(END_OF_REPLAY)
+
+    async def __aenter__(self):
+        self._server = await websockets.serve(self._handler, self.host, self.port)
+        port = next(iter(self._server.sockets)).getsockname()[1]
+        return f"ws://{self.host}:{port}/stream"
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+async def replay_demo(symbols=("BTCUSDT", "ETHUSDT", "BNBUSDT"), interval="1d"):
+    """
+    End-to-end run against the replay server built from data/raw.
+    """
+    frames = replay_frames_from_raw(symbols)
+    async with ReplayServer(frames, interval) as url:
+        pipeline = StreamPipeline(symbols, interval, url=url)
+        signals = pipeline.subscribe(maxsize=10_000)
+        await pipeline.run()
+
+    received = []
+    while not signals.empty():
+        signal = signals.get_nowait()
+        if signal is not None:
+            received.append(signal)
+    print(f" Replayed {len(symbols)} symbols: {pipeline.summary()}")
+    if received:
+        print(f" Last signal: {received[-1]}")
+    return pipeline, received
+
+
+if __name__ == "__main__":
+    asyncio.run(replay_demo())
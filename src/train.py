@@ -1,86 +1,547 @@
 import pandas as pd
 import numpy as np
 import os
-import joblib
+import sys
+import json
+import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import instrumentation
+import kline_store
+import features
+import predict
+from threadpoolctl import threadpool_limits
 
-# Models
-from sklearn.linear_model import LogisticRegression
-from sklearn.ensemble import RandomForestClassifier
-from xgboost import XGBClassifier
-from lightgbm import LGBMClassifier
-from catboost import CatBoostClassifier
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 warnings.filterwarnings('ignore')
 
-def train_models():
+MODEL_NAMES = ["LogisticRegression", "RandomForest", "XGBoost", "LightGBM", "CatBoost"]
+
+# Relative share of the cores each model gets when training in parallel.
+# LogisticRegression (lbfgs) is effectively single-threaded.
+THREAD_WEIGHTS = {"LogisticRegression": 0, "RandomForest": 1, "XGBoost": 1, "LightGBM": 1, "CatBoost": 1}
+
+
+def best_params_path():
+    return os.path.join(predict._model_dir(), 'best_params.json')
+
+
+def load_tuned_params():
+    """
+    Hyperparameters found by model_selection.search(), or {} if none saved.
+    """
+    path = best_params_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def build_model(name, n_threads=None, params=None):
+    """
+    Returns an unfitted model with its thread count pinned to n_threads
+    (None lets the library decide, as before). `params` overrides the
+    default hyperparameters.
+    """
+    model = _default_model(name, n_threads)
+    if params:
+        model.set_params(**params)
+    return model
+
+
+def _default_model(name, n_threads):
+    # Each model library is imported on first use: training one model (or
+    # importing this module from a worker) doesn't pay for all five
+    if name == "LogisticRegression":
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression(max_iter=1000, class_weight='balanced')
+    if name == "RandomForest":
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(n_estimators=100, max_depth=10, random_state=42, class_weight='balanced',
+                                      n_jobs=n_threads)
+    if name == "XGBoost":
+        from xgboost import XGBClassifier
+        return XGBClassifier(n_estimators=100, learning_rate=0.05, max_depth=5, eval_metric='mlogloss', random_state=42,
+                             n_jobs=n_threads)
+    if name == "LightGBM":
+        from lightgbm import LGBMClassifier
+        return LGBMClassifier(n_estimators=100, learning_rate=0.05, random_state=42, verbose=-1, class_weight='balanced',
+                              n_jobs=n_threads if n_threads is not None else -1)
+    if name == "CatBoost":
+        from catboost import CatBoostClassifier
+        return CatBoostClassifier(iterations=100, learning_rate=0.05, depth=6, verbose=0, random_state=42,
+                                  auto_class_weights='Balanced', thread_count=n_threads if n_threads is not None else -1,
+                                  allow_writing_files=False)
+    raise ValueError(f"Unknown model: {name}")
+
+
+def thread_budgets(names, total_cores=None):
+    """
+    Splits the machine's cores between models so their thread counts add
+    up to total_cores. Every model gets at least one thread; the rest is
+    shared according to THREAD_WEIGHTS.
+    """
+    total_cores = total_cores or os.cpu_count() or 1
+    budgets = {name: 1 for name in names}
+    spare = total_cores - len(names)
+    weights = {n: THREAD_WEIGHTS.get(n, 1) for n in names}
+    weight_sum = sum(weights.values())
+
+    if spare > 0 and weight_sum > 0:
+        shares = {n: spare * w / weight_sum for n, w in weights.items()}
+        for n in names:
+            budgets[n] += int(shares[n])
+        # Hand out the remainder by largest fractional share
+        leftover = total_cores - sum(budgets.values())
+        for n in sorted(names, key=lambda n: shares[n] - int(shares[n]), reverse=True)[:leftover]:
+            budgets[n] += 1
+    return budgets
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def _fit_and_save(name, n_threads, X_train, y_train, params=None):
+    """
+    Worker: fits one model under its thread budget and saves it.
+    Never raises, so one failing model can't take the others down.
+    """
+    started = time.perf_counter()
+    result = {"name": name, "threads": n_threads, "error": None}
+    try:
+        # Also caps the BLAS/OpenMP pools the libraries use internally
+        with threadpool_limits(limits=n_threads):
+            model = build_model(name, n_threads, params)
+            model.fit(X_train, y_train)
+        predict.save_model(model, name)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - started, 2)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+@instrumentation.timed("stage.train")
+def train_models(parallel=True, total_cores=None, model_names=None, use_tuned_params=False, feature_set=None):
     """
     Trains all defined models on the Training set (70% of data)
     and saves EVERY model to the 'models/' folder.
     Does NOT evaluate or compare them.
+
+    With parallel=True every model trains in its own process with an
+    explicit thread budget (the budgets add up to total_cores).
+    use_tuned_params=True applies models/best_params.json from
+    model_selection.search().
+    feature_set trains on a reduced column list: a list of columns (which
+    may include higher-timeframe ones like "rsi_4h") or the name of a set
+    saved by feature_selection.py ("pinned" = the pinned one). predict.py
+    picks the columns up from the fitted model.
+    Returns one result dict per model (seconds, peak_rss_mb, error).
     """
     # --- 1. SETUP ---
-    current_script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(current_script_dir)
-    
-    input_path = os.path.join(project_root, 'data', 'labeled', 'labeled_data.csv')
-    model_dir = os.path.join(project_root, 'models')
-    
+    model_dir = predict._model_dir()
+
     # Create models folder if missing
     os.makedirs(model_dir, exist_ok=True)
 
     print(" Starting Factory Training (Saving ALL models)...")
-    
-    if not os.path.exists(input_path):
-        print(f" Error: File not found at {input_path}")
-        return
 
     # --- 2. PREPARE DATA ---
-    df = pd.read_csv(input_path)
-    df.dropna(inplace=True)
-    
-    drop_cols = ['open_time', 'close_time', 'ignore', 'future_return', 'label', 'threshold_buy', 'threshold_sell']
-    feature_cols = [c for c in df.columns if c not in drop_cols]
-    
+    # Only the model inputs and the target are read (+ open_time for the
+    # incremental retrain state)
+    df = _read_labeled()
+    if df is None:
+        print(f" Error: File not found at {kline_store.stage_path('labeled')}")
+        return
+
+    # Fixed column order shared with serving (see features.py)
+    feature_cols = features.MODEL_COLUMNS
+    if feature_set is not None:
+        import feature_selection
+        feature_cols = feature_selection.resolve(feature_set)
+        absent = [c for c in feature_cols if c not in df.columns]
+        if absent:
+            raise ValueError(f"Columns not in the labeled data: {absent} (feature_generator(timeframes=...))")
+
     X = df[feature_cols]
     y = df['label']
-    
+
     # Time Series Split: Train on first 70%
     # We reserve the rest (Validation + Test) for the evaluation script
     train_end = int(len(df) * 0.70)
-    
+
     X_train = X.iloc[:train_end]
     y_train = y.iloc[:train_end]
-    
+
     print(f"   Training Data: {len(X_train)} rows (First 70%)")
     print(f"   Features: {len(feature_cols)}")
 
-    # --- 3. DEFINE MODELS ---
-    models = {
-        "LogisticRegression": LogisticRegression(max_iter=1000, class_weight='balanced'),
-        "RandomForest": RandomForestClassifier(n_estimators=100, max_depth=10, random_state=42, class_weight='balanced'),
-        "XGBoost": XGBClassifier(n_estimators=100, learning_rate=0.05, max_depth=5, eval_metric='mlogloss', random_state=42),
-        "LightGBM": LGBMClassifier(n_estimators=100, learning_rate=0.05, random_state=42, verbose=-1, class_weight='balanced'),
-        "CatBoost": CatBoostClassifier(iterations=100, learning_rate=0.05, depth=6, verbose=0, random_state=42, auto_class_weights='Balanced')
-    }
-
-    # --- 4. TRAIN & SAVE LOOP ---
-    print(f"\n    Training {len(models)} models...")
-    
-    for name, model in models.items():
+    # --- 3. THREAD BUDGETS ---
+    names = list(model_names or MODEL_NAMES)
+    total_cores = total_cores or os.cpu_count() or 1
+    budgets = thread_budgets(names, total_cores)
+    tuned = load_tuned_params() if use_tuned_params else {}
+    if tuned:
+        print(f"   Using tuned hyperparameters for: {', '.join(n for n in names if n in tuned)}")
+
+    # --- 4. TRAIN & SAVE ---
+    print(f"\n    Training {len(names)} models ({'parallel' if parallel else 'sequential'}, {total_cores} cores)...")
+    results = []
+
+    def report(result):
+        results.append(result)
+        rss = f"{result['peak_rss_mb']} MB" if result['peak_rss_mb'] is not None else "n/a"
+        if result["error"]:
+            print(f"      - {result['name']:<20} Failed after {result['seconds']}s: {result['error']}")
+        else:
+            print(f"      - {result['name']:<20} {result['seconds']:>7}s  {result['threads']:>2} threads  "
+                  f"peak RSS {rss}  -> models/{result['name']}.pkl")
+
+    if parallel:
+        # One fresh process per model so peak RSS is per model
+        workers = min(len(names), total_cores)
+        with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+            futures = {
+                pool.submit(_fit_and_save, name, budgets[name] if workers == len(names) else 1,
+                            X_train, y_train, tuned.get(name)): name
+                for name in names
+            }
+            for future in as_completed(futures):
+                try:
+                    report(future.result())
+                except Exception as e:
+                    # The worker process itself died (e.g. out of memory)
+                    report({"name": futures[future], "threads": budgets[futures[future]],
+                            "error": f"{type(e).__name__}: {e}", "seconds": 0.0, "peak_rss_mb": None})
+    else:
+        for name in names:
+            report(_fit_and_save(name, total_cores, X_train, y_train, tuned.get(name)))
+
+    # Reference point for retrain_incremental (drift baseline, rows seen)
+    for result in results:
+        if not result["error"]:
+            _record_full_fit(result["name"], df, feature_cols, train_end)
+
+    failed = [r["name"] for r in results if r["error"]]
+    if failed:
+        print(f"\n {len(names) - len(failed)}/{len(names)} models trained; failed: {', '.join(failed)}")
+    else:
+        print(f"\n All models trained and saved to {model_dir}")
+    return results
+
+# --- INCREMENTAL RETRAINING ---
+# New candles only extend the training window (first 70% of the labeled
+# file). Instead of refitting, the boosted models continue from their
+# saved state with a few more rounds fitted on the new rows, and the
+# random forest grows extra trees (warm_start). A drift check against the
+# last full fit decides when that is no longer good enough. Per-model
+# state lives next to the model in models/<name>.state.json.
+
+BOOSTED = {"XGBoost", "LightGBM", "CatBoost"}
+CLASSES = [0, 1, 2]
+
+# Columns in price units: the drift check looks at them relative to the
+# close (their level trends with the market and would always "drift").
+# Volume trends too and is left out.
+PRICE_SCALED = ["open", "high", "low", "sma_20", "sma_50", "sma_200", "bb_high", "bb_low",
+                "macd", "macd_signal", "macd_hist"]
+
+# Left out of the drift check: moving averages, bands, MACD and rolling
+# volatility follow the trend / volatility regime for hundreds of bars,
+# so a short block of new rows sits in a few deciles of the training
+# window even on stationary data (PSI > 1). A real shift in returns
+# still shows up in the short-memory columns (returns, RSI, bar shape).
+PERSISTENT = ["sma_20", "sma_50", "sma_200", "bb_high", "bb_low", "macd", "macd_signal", "volatility"]
+
+
+def labeled_model_columns():
+    """
+    MODEL_COLUMNS plus the higher-timeframe columns the labeled stage has
+    (feature_generator(timeframes=...)). Training and evaluation read the
+    same set, so both drop the same NaN rows and split the same frame.
+    """
+    stage = kline_store.stage_columns("labeled") or []
+    return features.MODEL_COLUMNS + [c for c in stage if features.timeframe_column(c) is not None]
+
+
+def _read_labeled():
+    columns = labeled_model_columns() + ['label']
+    if 'open_time' in (kline_store.stage_columns("labeled") or []):
+        columns = ['open_time'] + columns
+    df = kline_store.read_stage("labeled", columns=columns)
+    if df is None:
+        return None
+    return df.dropna()
+
+
+def state_path(name):
+    return os.path.join(predict._model_dir(), f'{name}.state.json')
+
+
+def load_state(name):
+    try:
+        with open(state_path(name)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save_state(name, state):
+    path = state_path(name)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def drift_frame(df):
+    """
+    The labeled columns as the drift check sees them: price-scaled
+    columns divided by the close, scale-free ones (RSI, returns) as they
+    are, PERSISTENT ones left out.
+    """
+    close = df['close'].to_numpy(dtype=np.float64)
+    out = {}
+    for column in features.MODEL_COLUMNS:
+        if column in ('close', 'volume') or column in PERSISTENT or column not in df.columns:
+            continue
+        values = df[column].to_numpy(dtype=np.float64)
+        out[column] = values / close if column in PRICE_SCALED else values
+    return pd.DataFrame(out, index=df.index)
+
+
+def reference_histograms(X, bins=10):
+    """
+    Per-column decile edges of the training data and the share of rows in
+    each bin: the reference the drift check compares new rows with.
+    """
+    reference = {}
+    for column in X.columns:
+        values = X[column].to_numpy(dtype=np.float64)
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+        reference[column] = {"edges": edges.tolist(), "share": (counts / max(len(values), 1)).tolist()}
+    return reference
+
+
+def population_stability(reference, X, eps=1e-4):
+    """
+    Population stability index of each column of X against its reference
+    histogram (< 0.1 stable, 0.1-0.25 moderate shift, > 0.25 large shift).
+    """
+    psi = {}
+    for column, ref in reference.items():
+        if column not in X.columns:
+            continue
+        edges = np.asarray(ref["edges"])
+        values = X[column].to_numpy(dtype=np.float64)
+        counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+        actual = np.clip(counts / max(len(values), 1), eps, None)
+        expected = np.clip(np.asarray(ref["share"]), eps, None)
+        psi[column] = float(np.sum((actual - expected) * np.log(actual / expected)))
+    return psi
+
+
+def _log_loss(model, X, y):
+    from sklearn.metrics import log_loss
+
+    _, _, probs = predict.score_matrix(model, X)
+    return float(log_loss(y, probs, labels=CLASSES))
+
+
+def _last_time(df):
+    return str(df['open_time'].iloc[-1]) if 'open_time' in df.columns and len(df) else None
+
+
+def _record_full_fit(name, df, columns, train_end, window="expanding", window_size=None):
+    # Drift baseline: the training window's histograms and the model's
+    # log-loss on the validation window that follows it
+    train_df = df.iloc[:train_end]
+    if window == "sliding" and window_size:
+        train_df = train_df.iloc[-window_size:]
+    val_df = df.iloc[train_end:int(len(df) * 0.85)]
+    model = predict.load_model(name, use_cache=False)
+    baseline = _log_loss(model, val_df[columns], val_df['label']) if len(val_df) else None
+    _save_state(name, {
+        "fitted_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "window": window,
+        "window_size": window_size,
+        "columns": list(columns),
+        "rows_seen": int(train_end),
+        "last_open_time": _last_time(df.iloc[:train_end]),
+        "updates": 0,
+        "rows_since_full_fit": 0,
+        "baseline_log_loss": baseline,
+        "reference": reference_histograms(drift_frame(train_df)),
+    })
+
+
+def _new_rows(train_df, state):
+    # Rows of the training window the model has not seen yet
+    if state.get("last_open_time") is not None and 'open_time' in train_df.columns:
+        return train_df[train_df['open_time'] > pd.Timestamp(state["last_open_time"])]
+    return train_df.iloc[state["rows_seen"]:]
+
+
+def drift_check(model, state, new, psi_threshold=0.25, loss_tolerance=0.10):
+    """
+    Decides whether new labeled rows still look like the data of the last
+    full fit: feature drift (max PSI over drift_frame columns) and
+    performance drift (the current model's log-loss on the new rows vs
+    its validation log-loss at that fit). Returns (needs_full_refit, report).
+    """
+    # States saved before PERSISTENT existed still hold their histograms;
+    # drift_frame no longer has those columns, so they are skipped
+    psi = population_stability(state["reference"], drift_frame(new))
+    worst = max(psi, key=psi.get) if psi else None
+    loss = _log_loss(model, new[state["columns"]], new['label'])
+    baseline = state.get("baseline_log_loss")
+    report = {"max_psi": round(psi[worst], 4) if worst else 0.0, "max_psi_feature": worst,
+              "log_loss": round(loss, 4), "baseline_log_loss": baseline}
+    reasons = []
+    if worst is not None and psi[worst] > psi_threshold:
+        reasons.append(f"feature drift ({worst} PSI {psi[worst]:.2f} > {psi_threshold})")
+    if baseline is not None and loss > baseline * (1 + loss_tolerance):
+        reasons.append(f"log-loss {loss:.3f} > {baseline:.3f} +{loss_tolerance:.0%}")
+    report["reasons"] = reasons
+    return bool(reasons), report
+
+
+def continue_training(name, model, X, y, rounds=50, n_threads=None, params=None, max_trees=None):
+    """
+    Returns `model` updated with the rows (X, y): boosted models get
+    `rounds` more boosting rounds starting from their current trees,
+    RandomForest `rounds` more trees (warm_start; with max_trees the
+    oldest are dropped), LogisticRegression a warm-started refit.
+    """
+    with threadpool_limits(limits=n_threads):
+        if name in BOOSTED:
+            updated = build_model(name, n_threads, params)
+            if name == "XGBoost":
+                updated.set_params(n_estimators=rounds)
+                updated.fit(X, y, xgb_model=model.get_booster())
+            elif name == "LightGBM":
+                updated.set_params(n_estimators=rounds)
+                updated.fit(X, y, init_model=model.booster_)
+            else:
+                updated.set_params(iterations=rounds)
+                updated.fit(X, y, init_model=model)
+            return updated
+        if name == "RandomForest":
+            model.set_params(warm_start=True, n_estimators=len(model.estimators_) + rounds, n_jobs=n_threads)
+            model.fit(X, y)
+            if max_trees and len(model.estimators_) > max_trees:
+                # Sliding forest: the trees fitted on the oldest rows go first
+                model.estimators_ = model.estimators_[-max_trees:]
+                model.n_estimators = max_trees
+            model.set_params(warm_start=False)
+            return model
+        if name == "LogisticRegression":
+            model.set_params(warm_start=True)
+            model.fit(X, y)
+            model.set_params(warm_start=False)
+            return model
+    raise ValueError(f"Unknown model: {name}")
+
+
+@instrumentation.timed("stage.retrain")
+def retrain_incremental(model_names=None, window="expanding", window_size=None, rounds=50, min_new_rows=50,
+                        psi_threshold=0.25, loss_tolerance=0.10, max_updates=30, total_cores=None,
+                        use_tuned_params=False, force_full=False):
+    """
+    Updates the saved models with the labeled rows that arrived since
+    their last fit, instead of refitting them from scratch.
+
+    Per model: no state (never trained by train_models / here), a drift
+    check failure (see drift_check), max_updates incremental updates in a
+    row or force_full -> full refit on the training window; fewer than
+    min_new_rows new rows (or rows missing a class) -> skipped until more
+    arrive; otherwise continue_training on the new rows.
+
+    window="expanding" refits on the whole training window (first 70%),
+    "sliding" on its last window_size rows; a sliding random forest also
+    keeps its tree count constant. Logistic regression has no
+    incremental form, so it is warm-started on the (cheap) full window.
+    Returns one result dict per model (action, reason, rows, seconds).
+    """
+    df = _read_labeled()
+    if df is None:
+        print(f" Error: File not found at {kline_store.stage_path('labeled')}")
+        return None
+
+    names = list(model_names or MODEL_NAMES)
+    total_cores = total_cores or os.cpu_count() or 1
+    tuned = load_tuned_params() if use_tuned_params else {}
+    train_end = int(len(df) * 0.70)
+    train_df = df.iloc[:train_end]
+    window_df = train_df.iloc[-window_size:] if window == "sliding" and window_size else train_df
+    print(f" Incremental retrain ({window} window, {len(window_df)} of {train_end} training rows)...")
+
+    results = []
+    for name in names:
+        started = time.perf_counter()
+        state = load_state(name)
+        result = {"name": name, "action": "full", "reason": None, "rows": 0, "drift": None, "error": None}
         try:
-            print(f"      - Training {name}...", end=" ")
-            model.fit(X_train, y_train)
-            
-            # Save the individual model
-            save_path = os.path.join(model_dir, f"{name}.pkl")
-            joblib.dump(model, save_path)
-            print(f" Saved to models/{name}.pkl")
-            
+            model = predict.load_model(name, use_cache=False) if state else None
+            columns = state["columns"] if state else predict.model_columns(model) if model else features.MODEL_COLUMNS
+            new = _new_rows(train_df, state) if state else train_df
+            result["rows"] = len(new)
+
+            if state is None:
+                result["reason"] = "no saved state"
+            elif force_full:
+                result["reason"] = "forced"
+            elif state["updates"] >= max_updates:
+                result["reason"] = f"{max_updates} incremental updates since the last full fit"
+            elif len(new) < min_new_rows:
+                result.update(action="skip", reason=f"{len(new)} new rows (< {min_new_rows})")
+            elif set(new['label'].unique()) != set(CLASSES):
+                result.update(action="skip", reason="new rows do not cover every class yet")
+            else:
+                needs_refit, result["drift"] = drift_check(model, state, new, psi_threshold, loss_tolerance)
+                if needs_refit:
+                    result["reason"] = "; ".join(result["drift"]["reasons"])
+                else:
+                    result["action"] = "incremental"
+
+            if result["action"] == "full":
+                fitted = _fit_and_save(name, total_cores, window_df[columns], window_df['label'], tuned.get(name))
+                if fitted["error"]:
+                    raise RuntimeError(fitted["error"])
+                _record_full_fit(name, df, columns, train_end, window, window_size)
+            elif result["action"] == "incremental":
+                X_fit, y_fit = (window_df[columns], window_df['label']) if name == "LogisticRegression" \
+                    else (new[columns], new['label'])
+                max_trees = model.n_estimators if name == "RandomForest" and window == "sliding" else None
+                updated = continue_training(name, model, X_fit, y_fit, rounds, total_cores, tuned.get(name),
+                                            max_trees)
+                predict.save_model(updated, name)
+                state.update(updates=state["updates"] + 1, rows_seen=train_end,
+                             rows_since_full_fit=state.get("rows_since_full_fit", 0) + len(new),
+                             last_open_time=_last_time(train_df), updated_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+                _save_state(name, state)
         except Exception as e:
-            print(f" Failed: {e}")
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = round(time.perf_counter() - started, 2)
+        results.append(result)
 
-    print(f"\n All models trained and saved to {model_dir}")
+        if result["error"]:
+            print(f"      - {name:<20} Failed after {result['seconds']}s: {result['error']}")
+        else:
+            reason = f" ({result['reason']})" if result["reason"] else ""
+            print(f"      - {name:<20} {result['action']:<11} {result['rows']:>8} new rows  "
+                  f"{result['seconds']:>7}s{reason}")
+    return results
 
 if __name__ == "__main__":
-    train_models()
\ No newline at end of file
+    train_models()
@@ -0,0 +1,116 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_fetcher
+import features
+import predict
+
+# Scores a whole universe of symbols at once: concurrent fetch, one
+# feature pass per group of equally long histories (the kernels work on
+# (symbols, bars) matrices), and one predict_proba call per model over
+# the latest row of every symbol.
+
+
+def _closed(df, now_ms):
+    # The last kline is still forming until its close_time has passed
+    return df[df["close_time"].astype("int64") < now_ms]
+
+
+def latest_features(frames):
+    """
+    Latest feature row of every symbol ({symbol: klines DataFrame}).
+    Symbols with the same number of bars are stacked into one matrix
+    and computed together. Returns a DataFrame indexed by symbol with
+    open_time + MODEL_COLUMNS; symbols without enough history for every
+    indicator are left out.
+    """
+    groups = {}
+    for symbol, df in frames.items():
+        if df is not None and len(df):
+            groups.setdefault(len(df), []).append(symbol)
+
+    parts = []
+    for length, symbols in groups.items():
+        inputs = {
+            c: np.vstack([frames[s][c].to_numpy(dtype=np.float64) for s in symbols])
+            for c in features.OHLCV_COLUMNS
+        }
+        values = features.compute_feature_arrays(inputs)
+        latest = {c: inputs[c][:, -1] for c in features.OHLCV_COLUMNS}
+        latest.update({c: values[c][:, -1] for c in features.FEATURE_COLUMNS})
+        latest["open_time"] = [int(frames[s]["open_time"].iloc[-1]) for s in symbols]
+        parts.append(pd.DataFrame(latest, index=pd.Index(symbols, name="symbol")))
+
+    if not parts:
+        return pd.DataFrame(columns=["open_time"] + features.MODEL_COLUMNS)
+    table = pd.concat(parts)
+    table["open_time"] = pd.to_datetime(table["open_time"], unit="ms")
+    return table[["open_time"] + features.MODEL_COLUMNS].dropna()
+
+
+def score_universe(symbols=None, interval="1d", limit=365, model_names=("best_crypto_model",), n_symbols=300,
+                   closed_only=True, signals_only=True, max_workers=16, base_url=data_fetcher.BASE_URL):
+    """
+    Fetches every symbol (default: the n_symbols most traded USDT pairs)
+    concurrently and scores its latest candle with each model.
+
+    Returns a table with one row per (symbol, model): label, confidence
+    and class probabilities, ranked by confidence. signals_only drops
+    HOLD rows.
+    """
+    timings = {}
+    started = time.perf_counter()
+    if symbols is None:
+        symbols = data_fetcher.fetch_top_symbols("USDT", n_symbols, base_url=base_url)
+    symbols = list(dict.fromkeys(s.upper() for s in symbols))
+
+    fetched = data_fetcher.fetch_many(symbols, [interval], limit=limit + int(closed_only),
+                                      max_workers=max_workers, base_url=base_url)
+    now_ms = int(time.time() * 1000)
+    frames = {}
+    for (symbol, _), df in fetched.items():
+        if df is None or df.empty:
+            continue
+        frames[symbol] = (_closed(df, now_ms) if closed_only else df).tail(limit).reset_index(drop=True)
+    timings["fetch"] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    latest = latest_features(frames)
+    timings["features"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    X = np.ascontiguousarray(latest[features.MODEL_COLUMNS].to_numpy(dtype=np.float32))
+    tables = []
+    for model_name in model_names:
+        if not len(X):
+            break
+        model = predict.load_fast_model(model_name)
+        labels, confidence, probs = predict.score_matrix(model, X)
+        table = latest[["open_time", "close"]].reset_index()
+        table["model"] = model_name
+        table["label"] = labels
+        table["prediction"] = table["label"].map(predict.LABEL_MAP)
+        table["confidence"] = confidence
+        table[["p_sell", "p_hold", "p_buy"]] = probs
+        tables.append(table)
+    timings["predict"] = time.perf_counter() - mark
+
+    result = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(
+        columns=["symbol", "open_time", "close", "model", "label", "prediction", "confidence",
+                 "p_sell", "p_hold", "p_buy"])
+    if signals_only:
+        result = result[result["prediction"] != "HOLD"]
+    result = result.sort_values(["model", "confidence"], ascending=[True, False]).reset_index(drop=True)
+
+    skipped = len(symbols) - len(latest)
+    print(f" Scored {len(latest)}/{len(symbols)} symbols ({skipped} skipped: failed or too little history) in "
+          f"{time.perf_counter() - started:.2f}s "
+          f"(fetch {timings['fetch']:.2f}s, features {timings['features']:.3f}s, predict {timings['predict']:.3f}s)")
+    return result
+
+
+if __name__ == "__main__":
+    signals = score_universe()
+    print(signals.head(30).to_string(index=False))